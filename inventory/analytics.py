@@ -0,0 +1,85 @@
+from decimal import Decimal
+
+from django.db.models import Sum, Count, F, Value, DecimalField
+from django.db.models.functions import Coalesce, TruncDay, TruncWeek, TruncMonth, TruncYear
+
+from .ledger import end_of_day, start_of_day
+from .models import OrderItem
+
+
+# Dimension name -> the OrderItem lookups that identify (and label) a group
+GROUP_FIELDS = {
+    'product': ['product_id', 'product__name', 'product__specification'],
+    'category': ['product__category_id', 'product__category__name'],
+    'customer': ['order__customer_id', 'order__customer__name'],
+    'salesperson': ['order__user', 'order__user_email'],
+}
+
+PERIOD_FUNCTIONS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+ZERO = Value(Decimal('0.00'), output_field=DecimalField(max_digits=20, decimal_places=2))
+
+
+def sales_items(start=None, end=None, paid_only=False):
+    """Completed order lines, optionally limited to a date range (inclusive)."""
+    items = OrderItem.objects.filter(status='Done', order__status='Done')
+    if paid_only:
+        items = items.filter(order__payment_status='Paid')
+    # Bounds on the column itself (not its DATE()) so the (status, order_date) index applies
+    if start:
+        items = items.filter(order__order_date__gte=start_of_day(start))
+    if end:
+        items = items.filter(order__order_date__lt=end_of_day(end))
+    return items
+
+
+def _margin(revenue, profit):
+    if not revenue:
+        return Decimal('0.00')
+    return (profit / revenue * 100).quantize(Decimal('0.01'))
+
+
+def profit_breakdown(items, group_by=(), period='month'):
+    """
+    Revenue, COGS, gross profit and margin of `items` grouped by any mix of
+    product, category, customer, salesperson and period. Everything is summed
+    in the database, so one query returns the rows and one more the totals.
+    """
+    measures = {
+        'quantity': Coalesce(Sum('quantity'), 0),
+        'revenue': Coalesce(Sum('price'), ZERO),
+        'cogs': Coalesce(Sum('cost'), ZERO),
+        'orders': Count('order', distinct=True),
+    }
+
+    values = []
+    annotations = {}
+    for dimension in group_by:
+        if dimension == 'period':
+            annotations['period'] = PERIOD_FUNCTIONS[period]('order__order_date')
+            values.append('period')
+        else:
+            values.extend(GROUP_FIELDS[dimension])
+
+    rows = []
+    if values:
+        grouped = (
+            items.annotate(**annotations)
+            .values(*values)
+            .annotate(**measures)
+            .annotate(gross_profit=F('revenue') - F('cogs'))
+            .order_by(*values)
+        )
+        for row in grouped:
+            row['margin'] = _margin(row['revenue'], row['gross_profit'])
+            rows.append(row)
+
+    totals = items.aggregate(**measures)
+    totals['gross_profit'] = totals['revenue'] - totals['cogs']
+    totals['margin'] = _margin(totals['revenue'], totals['gross_profit'])
+    return rows, totals
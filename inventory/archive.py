@@ -0,0 +1,268 @@
+"""
+Parquet archive of closed sales months.
+
+`manage.py archive_sales` writes every closed month of Order, OrderItem, Report
+and OrderLog rows to SALES_ARCHIVE_DIR/<table>/year=YYYY/month=MM/part-0.parquet
+(columns named after the ORM lookups they were read from) and records it as an
+ArchivedMonth together with the order data version of that month (see
+inventory.report_cache). Nothing is deleted from the database.
+
+`sales_trend` answers revenue / COGS / profit per month from the Parquet files
+with pyarrow for every archived month whose data version still matches, and
+from the database, through the same `profit_breakdown` as the sales reports,
+for the rest (recent months, and archived months that were changed afterwards
+until they are archived again).
+"""
+import os
+from datetime import date
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import models
+from django.db.models import Q, Sum
+
+from .analytics import GROUP_FIELDS, profit_breakdown, sales_items
+from .models import ArchivedMonth, DataVersion, Order, OrderItem, OrderLog, Report
+from .report_cache import order_day_key
+from .yearly_report import month_bounds
+
+
+CHUNK_SIZE = 5000
+
+ORDER_ITEM_COLUMNS = [
+    'id', 'order_id', 'order__order_date', 'order__status', 'order__payment_status',
+    'order__customer_id', 'order__customer__name', 'order__user', 'order__user_email',
+    'product_id', 'product__name', 'product__specification', 'product__category_id', 'product__category__name',
+    'quantity', 'unit_price', 'price', 'cost', 'status',
+]
+
+# table -> (model, date lookup of the month, columns)
+ARCHIVE_TABLES = {
+    'orders': (Order, 'order_date', [field.attname for field in Order._meta.concrete_fields]),
+    'order_items': (OrderItem, 'order__order_date', ORDER_ITEM_COLUMNS),
+    'reports': (Report, 'order_date', [field.attname for field in Report._meta.concrete_fields]),
+    'order_logs': (OrderLog, 'timestamp', [field.attname for field in OrderLog._meta.concrete_fields]),
+}
+
+
+def archive_dir():
+    return getattr(settings, 'SALES_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'sales_archive'))
+
+
+def keep_months():
+    return getattr(settings, 'SALES_ARCHIVE_KEEP_MONTHS', 1)
+
+
+def first_of_month(day):
+    return day.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(start, end):
+    """First days of the months from `start` to `end` inclusive."""
+    month, end = first_of_month(start), first_of_month(end)
+    while month <= end:
+        yield month
+        month = add_months(month, 1)
+
+
+def last_closed_month(today):
+    """Months up to this one are closed: the current month and SALES_ARCHIVE_KEEP_MONTHS before it stay live."""
+    return add_months(first_of_month(today), -(keep_months() + 1))
+
+
+def month_versions(start, end):
+    """{first of month: order data version} for start..end, summed from the per-day versions in one query."""
+    versions = {}
+    rows = DataVersion.objects.filter(
+        key__gte=order_day_key(first_of_month(start)),
+        key__lt=order_day_key(add_months(first_of_month(end), 1)),
+    ).values_list('key', 'version')
+    for key, version in rows:
+        month = date.fromisoformat(key.split(':', 1)[1]).replace(day=1)
+        versions[month] = versions.get(month, 0) + version
+    return versions
+
+
+def _resolve(model, lookup):
+    field = None
+    for part in lookup.split('__'):
+        field = (field.related_model if field else model)._meta.get_field(part)
+    return field
+
+
+def _arrow_type(field):
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        return pa.int64()
+    if isinstance(field, models.ForeignKey):
+        return _arrow_type(field.target_field)
+    return pa.string()
+
+
+def table_schema(table):
+    """A fixed schema per table, so empty months and all-null columns still line up."""
+    model, _, columns = ARCHIVE_TABLES[table]
+    return pa.schema([pa.field(column, _arrow_type(_resolve(model, column))) for column in columns])
+
+
+def month_queryset(table, month):
+    model, lookup, _ = ARCHIVE_TABLES[table]
+    field = _resolve(model, lookup)
+    dates, datetimes = month_bounds(month.year, month.month)
+    start, end = datetimes if isinstance(field, models.DateTimeField) else dates
+    return model.objects.filter(**{f'{lookup}__gte': start, f'{lookup}__lt': end})
+
+
+def month_path(table, month):
+    return os.path.join(archive_dir(), table, f'year={month.year}', f'month={month.month:02d}', 'part-0.parquet')
+
+
+def _record_batch(rows, schema):
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)], schema=schema
+    )
+
+
+def write_table(table, month):
+    """Write one table's rows for `month` (in chunks) and return the number of rows."""
+    _, _, columns = ARCHIVE_TABLES[table]
+    schema = table_schema(table)
+    path = month_path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+
+    written = 0
+    rows = month_queryset(table, month).order_by('pk').values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+    with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == CHUNK_SIZE:
+                writer.write_batch(_record_batch(chunk, schema))
+                written += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_batch(_record_batch(chunk, schema))
+            written += len(chunk)
+    os.replace(tmp, path)
+    return written
+
+
+def archive_month(month):
+    """(Re)write every table of `month` and record it; returns the ArchivedMonth."""
+    month = first_of_month(month)
+    # Read the version first: a change made while the files are written makes the month stale, not wrong
+    version = month_versions(month, month).get(month, 0)
+    counts = {table: write_table(table, month) for table in ARCHIVE_TABLES}
+
+    sold = month_queryset('orders', month).exclude(status='Cancelled').aggregate(revenue=Sum('total_amount'))
+    archived, _ = ArchivedMonth.objects.update_or_create(
+        month=month,
+        defaults={
+            'data_version': version,
+            'rows': counts,
+            'orders': counts['orders'],
+            'revenue': sold['revenue'] or Decimal('0.00'),
+        },
+    )
+    return archived
+
+
+def months_to_archive(today, force=False):
+    """Closed months with orders that are not archived yet, or changed since they were."""
+    following = add_months(last_closed_month(today), 1)
+    _, (cutoff, _) = month_bounds(following.year, following.month)
+    months = [day.date() for day in Order.objects.filter(order_date__lt=cutoff).datetimes('order_date', 'month')]
+    if force or not months:
+        return months
+    archived = dict(ArchivedMonth.objects.filter(month__in=months).values_list('month', 'data_version'))
+    versions = month_versions(months[0], months[-1])
+    return [month for month in months if archived.get(month) != versions.get(month, 0)]
+
+
+def fresh_archived_months(start, end):
+    """Archived months in start..end whose data has not changed since they were written."""
+    versions = month_versions(start, end)
+    archived = ArchivedMonth.objects.filter(month__gte=first_of_month(start), month__lte=first_of_month(end))
+    return {
+        month for month, version in archived.values_list('month', 'data_version')
+        if versions.get(month, 0) == version and os.path.exists(month_path('order_items', month))
+    }
+
+
+def _archived_breakdown(month, group_by):
+    """profit_breakdown-shaped rows for one archived month, aggregated by pyarrow."""
+    keys = [column for dimension in group_by for column in GROUP_FIELDS[dimension]]
+    table = pq.read_table(
+        month_path('order_items', month),
+        columns=keys + ['order_id', 'quantity', 'price', 'cost', 'status', 'order__status'],
+        filters=[('status', '=', 'Done'), ('order__status', '=', 'Done')],
+    )
+    if table.num_rows == 0:
+        return []
+    grouped = table.group_by(keys).aggregate([
+        ('quantity', 'sum'), ('price', 'sum'), ('cost', 'sum'), ('order_id', 'count_distinct'),
+    ])
+    rows = []
+    for row in grouped.to_pylist():
+        revenue = Decimal(row.pop('price_sum') or 0).quantize(Decimal('0.01'))
+        cogs = Decimal(row.pop('cost_sum') or 0).quantize(Decimal('0.01'))
+        rows.append({
+            'period': month,
+            **{key: row[key] for key in keys},
+            'quantity': row['quantity_sum'] or 0,
+            'revenue': revenue,
+            'cogs': cogs,
+            'orders': row['order_id_count_distinct'],
+            'gross_profit': revenue - cogs,
+            'source': 'archive',
+        })
+    return rows
+
+
+def sales_trend(start, end, group_by=()):
+    """
+    Monthly revenue, COGS, gross profit, margin and order count for start..end,
+    optionally split by product, category, customer or salesperson.
+    """
+    months = list(month_range(start, end))
+    archived = fresh_archived_months(months[0], months[-1])
+    live = [month for month in months if month not in archived]
+
+    rows = []
+    for month in sorted(archived):
+        rows.extend(_archived_breakdown(month, group_by))
+
+    if live:
+        ranges = Q()
+        for month in live:
+            _, (month_start, month_end) = month_bounds(month.year, month.month)
+            ranges |= Q(order__order_date__gte=month_start, order__order_date__lt=month_end)
+        live_rows, _ = profit_breakdown(sales_items().filter(ranges), group_by=('period', *group_by), period='month')
+        for row in live_rows:
+            period = row['period']
+            row['period'] = period.date() if hasattr(period, 'date') else period
+            row['source'] = 'live'
+            row.pop('margin')
+            rows.append(row)
+
+    keys = [column for dimension in group_by for column in GROUP_FIELDS[dimension]]
+    for row in rows:
+        revenue = row['revenue']
+        row['margin'] = (row['gross_profit'] / revenue * 100).quantize(Decimal('0.01')) if revenue else Decimal('0.00')
+    rows.sort(key=lambda row: (row['period'], *[str(row[key]) for key in keys]))
+    return rows, {'archived_months': sorted(archived), 'live_months': live}
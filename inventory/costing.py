@@ -0,0 +1,441 @@
+"""
+Product costing fed by purchase records.
+
+Every purchase line received into a Product's stock (inventory.receiving)
+becomes a CostLayer, dated when it was received. The engine keeps
+`Product.unit_cost` current so a sale can be costed in O(1):
+
+* ``average`` (default): moving weighted average of on-hand stock and receipts.
+* ``fifo``: cost of the oldest layer that still has remaining quantity; sales
+  consume layers oldest first. What each order item took is kept as
+  LayerConsumption rows, so reducing, cancelling or deleting the sale gives
+  that quantity back to the layers (newest first), as lots do.
+
+Pick the method with ``INVENTORY_COSTING_METHOD`` in settings. Whenever history
+changes (a back-dated receipt, an edited or deleted purchase line) the affected
+products are replayed in bulk with `rebuild_costs`.
+
+The stock a product already had when its first purchase layer arrived is an
+opening layer (CostLayer.opening) at the cost known then. The average replay
+weighs each receipt against the stock on hand just before it, which is the
+current stock less the StockMovement rows since (one subquery per layer), the
+figure the incremental path reads from Product.stock. Sales made before the
+opening layer keep the cost they were stored with.
+"""
+from collections import defaultdict, deque
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, OrderItem, CostLayer, LayerConsumption, StockMovement
+from .report_cache import bump, order_day_key
+from .valuation import update_unit_costs
+
+
+COST_PLACES = Decimal('0.0001')
+MONEY_PLACES = Decimal('0.01')
+REBUILD_CHUNK_SIZE = 500
+
+
+def costing_method():
+    return getattr(settings, 'INVENTORY_COSTING_METHOD', 'average')
+
+
+def current_unit_cost(product):
+    """The maintained unit cost, falling back to the manually entered buying price."""
+    if product.unit_cost is not None:
+        return product.unit_cost
+    return product.buying_price
+
+
+def _is_backdated(product_id, received_at):
+    return OrderItem.objects.filter(
+        product_id=product_id, order__order_date__gt=received_at
+    ).exists()
+
+
+def _head_layer_cost(product_id):
+    head = (
+        CostLayer.objects.filter(product_id=product_id, remaining__gt=0)
+        .order_by('received_at', 'id')
+        .values_list('unit_cost', flat=True)
+        .first()
+    )
+    return head
+
+
+def _opening_quantity(product, received_at):
+    """Stock on hand just before `received_at`: the current stock less the movements since."""
+    moved = StockMovement.objects.filter(product=product, timestamp__gte=received_at).aggregate(total=Sum('quantity'))['total']
+    return max((product.stock or 0) - (moved or 0), 0)
+
+
+def _opening_layer(product_id, quantity, unit_cost, first_received_at):
+    # Just before the first purchase layer, so it sorts (and is consumed) first
+    return CostLayer(
+        product_id=product_id,
+        received_at=first_received_at - timedelta(microseconds=1),
+        quantity=quantity,
+        remaining=quantity,
+        unit_cost=Decimal(str(unit_cost or 0)).quantize(COST_PLACES),
+        opening=True,
+    )
+
+
+def add_layer(product, quantity, unit_cost, received_at=None, purchase_product=None):
+    """Record a receipt of `quantity` at `unit_cost` and move the product cost."""
+    received_at = received_at or timezone.now()
+    unit_cost = Decimal(str(unit_cost)).quantize(COST_PLACES)
+
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product.pk)
+        if not CostLayer.objects.filter(product=product).exists():
+            _opening_layer(
+                product.pk, _opening_quantity(product, received_at), current_unit_cost(product), received_at
+            ).save()
+        layer = CostLayer.objects.create(
+            product=product,
+            purchase_product=purchase_product,
+            received_at=received_at,
+            quantity=quantity,
+            remaining=quantity,
+            unit_cost=unit_cost,
+        )
+
+        if _is_backdated(product.pk, received_at):
+            rebuild_costs([product.pk])
+            return layer
+
+        if costing_method() == 'fifo':
+            new_cost = _head_layer_cost(product.pk)
+        else:
+            on_hand = max(product.stock or 0, 0)
+            old_cost = current_unit_cost(product)
+            if old_cost is None or on_hand == 0:
+                new_cost = unit_cost
+            else:
+                new_cost = (on_hand * old_cost + quantity * unit_cost) / (on_hand + quantity)
+
+        update_unit_costs({product.pk: Decimal(new_cost).quantize(COST_PLACES)})
+    return layer
+
+
+def add_layers(receipts, received_at=None):
+    """
+    Record several receipts at `received_at`, as `add_layer` does one at a
+    time, with one insert for the layers. `receipts` are (product, quantity,
+    unit cost, purchase line); the products must be locked and their stock not
+    yet moved by these receipts. Products with sales after `received_at` are
+    replayed, the others moved incrementally. Returns {product id: unit cost}.
+    """
+    received_at = received_at or timezone.now()
+    receipts = [
+        (product, quantity, Decimal(str(unit_cost)).quantize(COST_PLACES), line)
+        for product, quantity, unit_cost, line in receipts
+        if quantity and quantity > 0
+    ]
+    products = {product.pk: product for product, *_ in receipts}
+    if not products:
+        return {}
+
+    with transaction.atomic():
+        layered = set(CostLayer.objects.filter(product_id__in=list(products)).values_list('product_id', flat=True).distinct())
+        moved = dict(
+            StockMovement.objects.filter(product_id__in=list(products), timestamp__gte=received_at)
+            .values_list('product_id').annotate(total=Sum('quantity')).order_by()
+        )
+        layers = [
+            _opening_layer(pk, max((product.stock or 0) - (moved.get(pk) or 0), 0), current_unit_cost(product), received_at)
+            for pk, product in products.items()
+            if pk not in layered
+        ]
+        layers.extend(
+            CostLayer(product_id=product.pk, purchase_product=line, received_at=received_at,
+                      quantity=quantity, remaining=quantity, unit_cost=unit_cost)
+            for product, quantity, unit_cost, line in receipts
+        )
+        CostLayer.objects.bulk_create(layers, batch_size=REBUILD_CHUNK_SIZE)
+
+        backdated = set(
+            OrderItem.objects.filter(product_id__in=list(products), order__order_date__gt=received_at)
+            .values_list('product_id', flat=True).distinct()
+        )
+        costs = {}
+        if costing_method() == 'fifo':
+            heads = (
+                Product.objects.filter(pk__in=list(products.keys() - backdated))
+                .annotate(head=Subquery(
+                    CostLayer.objects.filter(product=OuterRef('pk'), remaining__gt=0)
+                    .order_by('received_at', 'id').values('unit_cost')[:1]
+                ))
+                .values_list('id', 'head')
+            )
+            costs.update(heads)
+        else:
+            on_hand = {pk: max(product.stock or 0, 0) for pk, product in products.items()}
+            for product, quantity, unit_cost, _ in receipts:
+                if product.pk in backdated:
+                    continue
+                old_cost = costs.get(product.pk, current_unit_cost(product))
+                if old_cost is None or on_hand[product.pk] == 0:
+                    costs[product.pk] = unit_cost
+                else:
+                    costs[product.pk] = Decimal(
+                        (on_hand[product.pk] * old_cost + quantity * unit_cost) / (on_hand[product.pk] + quantity)
+                    ).quantize(COST_PLACES)
+                on_hand[product.pk] += quantity
+        costs = {pk: Decimal(cost).quantize(COST_PLACES) for pk, cost in costs.items() if cost is not None}
+        update_unit_costs(costs)
+
+        if backdated:
+            rebuild_costs(backdated)
+            costs.update(Product.objects.filter(pk__in=list(backdated)).values_list('id', 'unit_cost'))
+    return costs
+
+
+def _consume(item, quantity):
+    """Take `quantity` for `item` off the oldest open layers of its product."""
+    layers = list(
+        CostLayer.objects.select_for_update()
+        .filter(product_id=item.product_id, remaining__gt=0)
+        .order_by('received_at', 'id')
+    )
+    left, changed, consumptions = quantity, [], []
+    for layer in layers:
+        if left <= 0:
+            break
+        taken = min(layer.remaining, left)
+        layer.remaining -= taken
+        left -= taken
+        changed.append(layer)
+        consumptions.append(LayerConsumption(order_item=item, layer=layer, quantity=taken))
+    CostLayer.objects.bulk_update(changed, ['remaining'])
+    LayerConsumption.objects.bulk_create(consumptions)
+
+
+def _give_back(item, quantity):
+    # The newest layers first, so the oldest stay consumed as they would have been
+    consumptions = (
+        LayerConsumption.objects.select_for_update()
+        .filter(order_item=item)
+        .order_by('-layer__received_at', '-layer_id', '-id')
+    )
+    left = quantity
+    for consumption in consumptions:
+        if left <= 0:
+            break
+        given = min(consumption.quantity, left)
+        CostLayer.objects.filter(pk=consumption.layer_id).update(remaining=F('remaining') + given)
+        if given == consumption.quantity:
+            consumption.delete()
+        else:
+            LayerConsumption.objects.filter(pk=consumption.pk).update(quantity=F('quantity') - given)
+        left -= given
+
+
+def sync_consumption(item):
+    """FIFO only: make the layer quantity taken by `item` match what it sells (nothing unless Done)."""
+    if costing_method() != 'fifo' or not item.product_id:
+        return
+    wanted = (item.quantity or 0) if item.status == 'Done' else 0
+    with transaction.atomic():
+        # Layers of another product were taken before the item's product was changed
+        _release(item.layer_consumptions.exclude(layer__product_id=item.product_id))
+        taken = item.layer_consumptions.aggregate(total=Coalesce(Sum('quantity'), 0))['total']
+        if wanted == taken:
+            return
+        if wanted > taken:
+            _consume(item, wanted - taken)
+        else:
+            _give_back(item, taken - wanted)
+        update_unit_costs({item.product_id: _head_layer_cost(item.product_id)})
+
+
+def _release(consumptions):
+    returned = list(consumptions.values('layer_id', 'layer__product_id').annotate(total=Sum('quantity')).order_by())
+    if not returned:
+        return
+    with transaction.atomic():
+        for row in returned:
+            CostLayer.objects.filter(pk=row['layer_id']).update(remaining=F('remaining') + row['total'])
+        consumptions.delete()
+        product_ids = {row['layer__product_id'] for row in returned}
+        update_unit_costs({pk: _head_layer_cost(pk) for pk in product_ids})
+
+
+def release_consumption(items):
+    """Give back everything `items` took from the cost layers, in bulk (cancelled or deleted items)."""
+    if costing_method() != 'fifo':
+        return
+    _release(LayerConsumption.objects.filter(order_item__in=[item.pk for item in items if item.pk]))
+
+
+def _replay(product, events, method):
+    """
+    Walk one product's purchases and sales in date order.
+    Returns ({order_item_id: cost}, {layer_id: remaining}, unit_cost,
+    [(order_item_id, layer_id, quantity taken)]); nothing is taken under the
+    average method. Sales before the first layer are left out: they keep their
+    stored cost.
+    """
+    item_costs = {}
+    remaining = {}
+    consumed = []
+
+    if method == 'fifo':
+        queue = deque()
+        last_cost = None
+        for kind, _, obj in events:
+            if kind == 'purchase':
+                remaining[obj['id']] = obj['quantity']
+                last_cost = obj['unit_cost']
+                if obj['quantity'] > 0:
+                    queue.append([obj['id'], obj['quantity'], obj['unit_cost']])
+                continue
+            if last_cost is None:
+                continue
+            left = obj['quantity'] or 0
+            cost = Decimal('0.00')
+            while left > 0 and queue:
+                entry = queue[0]
+                taken = min(entry[1], left)
+                cost += taken * entry[2]
+                consumed.append((obj['id'], entry[0], taken))
+                entry[1] -= taken
+                remaining[entry[0]] = entry[1]
+                left -= taken
+                last_cost = entry[2]
+                if entry[1] == 0:
+                    queue.popleft()
+            # Sold beyond the layers: at the last cost known
+            cost += left * last_cost
+            item_costs[obj['id']] = cost.quantize(MONEY_PLACES)
+        unit_cost = queue[0][2] if queue else None
+        return item_costs, remaining, unit_cost, consumed
+
+    average = None
+    last_at, received = None, 0
+    for kind, at, obj in events:
+        if kind == 'purchase':
+            remaining[obj['id']] = obj['quantity']
+            # The stock on hand just before the receipt comes from the ledger, as add_layer reads
+            # it from Product.stock, so adjustments, imports and returns weigh in as well. Lines
+            # received together (add_layers) also weigh in the ones before them.
+            if at != last_at:
+                last_at, received = at, 0
+            on_hand = max(obj['on_hand'], 0) + received
+            received += obj['quantity']
+            if average is None or on_hand == 0:
+                average = obj['unit_cost']
+            else:
+                average = (on_hand * average + obj['quantity'] * obj['unit_cost']) / (on_hand + obj['quantity'])
+            # Rounded as Product.unit_cost stores it, which the next receipt starts from
+            average = Decimal(average).quantize(COST_PLACES)
+            continue
+        if average is None:
+            continue
+        cost = (obj['quantity'] or 0) * average
+        item_costs[obj['id']] = Decimal(cost).quantize(MONEY_PLACES)
+    unit_cost = Decimal(average).quantize(COST_PLACES) if average is not None else None
+    return item_costs, remaining, unit_cost, consumed
+
+
+def _add_opening_layers(product_ids):
+    """
+    Give the products among `product_ids` that have purchase layers but no
+    opening layer one (layers recorded before opening layers existed): the
+    stock before the first layer per the movement ledger, at the buying price.
+    """
+    first_layers = CostLayer.objects.filter(product=OuterRef('pk')).order_by('received_at', 'id')
+    moved = (
+        StockMovement.objects.filter(product=OuterRef('pk'), timestamp__gte=OuterRef('first_received_at'))
+        .values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    missing = (
+        Product.objects.filter(pk__in=product_ids, cost_layers__isnull=False)
+        .exclude(cost_layers__opening=True)
+        .distinct()
+        .annotate(first_received_at=Subquery(first_layers.values('received_at')[:1]))
+        .annotate(moved=Coalesce(Subquery(moved), 0))
+        .values_list('id', 'stock', 'buying_price', 'first_received_at', 'moved')
+    )
+    CostLayer.objects.bulk_create([
+        _opening_layer(pk, max((stock or 0) - moved, 0), buying_price, first_received_at)
+        for pk, stock, buying_price, first_received_at, moved in missing
+    ], batch_size=REBUILD_CHUNK_SIZE)
+
+
+def rebuild_costs(product_ids=None):
+    """
+    Replay purchase layers and completed sales for the given products (all
+    products with layers when omitted) and rewrite OrderItem.cost, layer
+    remainders and Product.unit_cost with bulk updates. Only items whose cost
+    changed are written, and the report versions of their order days are bumped.
+    """
+    method = costing_method()
+    if product_ids is None:
+        product_ids = CostLayer.objects.values_list('product_id', flat=True).distinct()
+    product_ids = sorted(set(product_ids))
+
+    updated = 0
+    for start in range(0, len(product_ids), REBUILD_CHUNK_SIZE):
+        chunk = product_ids[start:start + REBUILD_CHUNK_SIZE]
+        _add_opening_layers(chunk)
+        events = defaultdict(list)
+
+        moved = (
+            StockMovement.objects.filter(product=OuterRef('product_id'), timestamp__gte=OuterRef('received_at'))
+            .values('product').annotate(total=Sum('quantity')).values('total')
+        )
+        for layer in (
+            CostLayer.objects.filter(product_id__in=chunk)
+            .annotate(on_hand=F('product__stock') - Coalesce(Subquery(moved), 0))
+            .values('id', 'product_id', 'received_at', 'quantity', 'unit_cost', 'on_hand')
+        ):
+            layer['on_hand'] = layer['on_hand'] or 0
+            events[layer['product_id']].append(('purchase', layer['received_at'], layer))
+
+        sales = {}
+        for item in (
+            OrderItem.objects.filter(product_id__in=chunk, status='Done', order__status='Done')
+            .values('id', 'product_id', 'quantity', 'cost', received_at=F('order__order_date'))
+        ):
+            events[item['product_id']].append(('sale', item['received_at'], item))
+            sales[item['id']] = item
+
+        products = Product.objects.filter(pk__in=chunk).values('id')
+        item_updates, layer_updates, unit_costs, consumptions = [], [], {}, []
+        for product in products:
+            # Purchases sort before sales made at the same instant
+            ordered = sorted(
+                events.get(product['id'], []),
+                key=lambda e: (e[1], e[0] != 'purchase', e[2]['id'])
+            )
+            item_costs, remaining, unit_cost, consumed = _replay(product, ordered, method)
+            consumptions.extend(
+                LayerConsumption(order_item_id=item_id, layer_id=layer_id, quantity=quantity)
+                for item_id, layer_id, quantity in consumed
+            )
+            item_updates.extend(
+                OrderItem(id=pk, cost=cost) for pk, cost in item_costs.items() if sales[pk]['cost'] != cost
+            )
+            layer_updates.extend(CostLayer(id=pk, remaining=qty) for pk, qty in remaining.items())
+            unit_costs[product['id']] = unit_cost
+
+        with transaction.atomic():
+            OrderItem.objects.bulk_update(item_updates, ['cost'], batch_size=REBUILD_CHUNK_SIZE)
+            CostLayer.objects.bulk_update(layer_updates, ['remaining'], batch_size=REBUILD_CHUNK_SIZE)
+            # What each sale took from the layers, so editing or cancelling it gives that back
+            LayerConsumption.objects.filter(layer__product_id__in=chunk).delete()
+            LayerConsumption.objects.bulk_create(consumptions, batch_size=REBUILD_CHUNK_SIZE)
+            update_unit_costs(unit_costs, batch_size=REBUILD_CHUNK_SIZE)
+            # bulk_update sends no signals: move the versions of the days whose COGS changed
+            bump(*{order_day_key(timezone.localdate(sales[item.id]['received_at'])) for item in item_updates})
+        updated += len(unit_costs)
+    return updated
+
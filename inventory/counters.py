@@ -0,0 +1,188 @@
+"""
+Row counts maintained in the Counter table.
+
+Every counted model has a total key plus one key per value of a few tracked
+fields: 'orders', 'orders:status=Done', 'orders:credit=0',
+'products:is_bundle=1', ... Model signals apply +1/-1 with F() updates in the
+transaction of the save or delete, so reading a count is a single-row lookup
+instead of a COUNT(*) over the table. A key without a row counts 0.
+
+`CountedPaginator` answers the page count from a counter when the queryset is
+the whole table or only filtered by equality on one tracked field, and runs
+COUNT(*) as before for anything else (searches, joins, several filters).
+`rebuild_counters` recounts with one grouped query per tracked field; the
+`reconcile_counters` command runs it and reports drift.
+"""
+from collections import defaultdict
+
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, F, QuerySet
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact
+from django.db.models.sql.where import AND, WhereNode
+from django.utils.functional import cached_property
+
+from .models import Category, Counter, CustomerInfo, Order, Product, Supplier
+
+
+ORDERS = 'orders'
+PRODUCTS = 'products'
+CUSTOMERS = 'customers'
+SUPPLIERS = 'suppliers'
+CATEGORIES = 'categories'
+
+# model -> (total key, fields with a counter per value)
+COUNTED = {
+    Order: (ORDERS, ('status', 'credit', 'receipt', 'payment_status')),
+    Product: (PRODUCTS, ('is_bundle',)),
+    CustomerInfo: (CUSTOMERS, ()),
+    Supplier: (SUPPLIERS, ()),
+    Category: (CATEGORIES, ()),
+}
+
+
+def _label(value):
+    if value is None:
+        return '-'
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+def field_key(model, field, value):
+    """'orders:credit=0' for (Order, 'credit', False)."""
+    value = model._meta.get_field(field).to_python(value)
+    return f'{COUNTED[model][0]}:{field}={_label(value)}'
+
+
+def instance_state(instance):
+    """The tracked field values of a counted instance, or None if some were not loaded."""
+    try:
+        return tuple(instance.__dict__[field] for field in COUNTED[type(instance)][1])
+    except KeyError:
+        return None
+
+
+def state_keys(model, state):
+    total, fields = COUNTED[model]
+    return [total] + [field_key(model, field, value) for field, value in zip(fields, state)]
+
+
+def apply(deltas):
+    """Add {key: delta}, one UPDATE per changed key, in key order so concurrent writers lock rows alike."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        for key in sorted(deltas):
+            if not Counter.objects.filter(key=key).update(value=F('value') + deltas[key]):
+                Counter.objects.get_or_create(key=key)
+                Counter.objects.filter(key=key).update(value=F('value') + deltas[key])
+
+
+def track(model, old_state, new_state):
+    """Move the counters of `model` from one row state to another; either is None for a create or delete."""
+    track_changes(model, [(old_state, new_state)])
+
+
+def track_changes(model, changes):
+    """`track` for [(old_state, new_state), ...] of rows written in bulk, summed into one update per key."""
+    deltas = defaultdict(int)
+    for old_state, new_state in changes:
+        for state, sign in ((old_state, -1), (new_state, 1)):
+            if state is not None:
+                for key in state_keys(model, state):
+                    deltas[key] += sign
+    apply(deltas)
+
+
+def count_created(model, instances):
+    """Count rows written with bulk_create, which sends no signals."""
+    deltas = defaultdict(int)
+    for instance in instances:
+        for key in state_keys(model, instance_state(instance)):
+            deltas[key] += 1
+    apply(deltas)
+
+
+def count(key):
+    return Counter.objects.filter(key=key).values_list('value', flat=True).first() or 0
+
+
+def exact_filters(queryset):
+    """{field: value} when `queryset` only filters its own columns by equality, else None."""
+    query = queryset.query
+    if query.distinct or query.combinator or query.is_sliced or query.group_by is not None:
+        return None
+    filters = {}
+    nodes = [query.where]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, WhereNode):
+            if node.connector != AND or node.negated:
+                return None
+            nodes.extend(node.children)
+        elif (
+            isinstance(node, Exact)
+            and isinstance(node.lhs, Col)
+            and node.lhs.alias == query.base_table
+            and not hasattr(node.rhs, 'resolve_expression')
+        ):
+            filters[node.lhs.target.name] = node.rhs
+        else:
+            return None
+    return filters
+
+
+def count_for(queryset):
+    """The maintained number of rows of `queryset`, or None if no counter covers it."""
+    if not isinstance(queryset, QuerySet) or queryset.model not in COUNTED:
+        return None
+    filters = exact_filters(queryset)
+    if filters is None or len(filters) > 1:
+        return None
+    total, fields = COUNTED[queryset.model]
+    if not filters:
+        return count(total)
+    (field, value), = filters.items()
+    if field not in fields:
+        return None
+    return count(field_key(queryset.model, field, value))
+
+
+class CountedPaginator(Paginator):
+    @cached_property
+    def count(self):
+        maintained = count_for(self.object_list)
+        return super().count if maintained is None else maintained
+
+
+def rebuild_counters(models=None):
+    """
+    Recount the counters of `models` (all counted models by default) and
+    replace their rows. Returns {key: (stored, actual)} for the keys that drifted.
+    """
+    models = list(models or COUNTED)
+    actual = {}
+    for model in models:
+        total, fields = COUNTED[model]
+        actual[total] = model.objects.count()
+        for field in fields:
+            for value, rows in model.objects.values_list(field).annotate(rows=Count('pk')).order_by():
+                actual[field_key(model, field, value)] = rows
+
+    with transaction.atomic():
+        counters = Counter.objects.none()
+        for model in models:
+            total = COUNTED[model][0]
+            counters |= Counter.objects.filter(key=total) | Counter.objects.filter(key__startswith=f'{total}:')
+        stored = dict(counters.select_for_update().values_list('key', 'value'))
+        counters.delete()
+        Counter.objects.bulk_create([Counter(key=key, value=value) for key, value in actual.items()], batch_size=1000)
+
+    return {
+        key: (stored.get(key, 0), actual.get(key, 0))
+        for key in sorted(set(stored) | set(actual))
+        if stored.get(key, 0) != actual.get(key, 0)
+    }
@@ -0,0 +1,102 @@
+"""
+Home screen dashboard.
+
+`dashboard()` returns every tile of the app's home screen (revenue, profit,
+product cost, low stock count, order and product totals, recent orders and the
+last seven days of sales) from a handful of aggregate queries run inside one
+transaction, so on InnoDB's repeatable read they all see the same snapshot.
+
+The result is kept in memory for DASHBOARD_CACHE_SECONDS. Refreshing is
+single-flight per process: the first request after expiry recomputes it under
+a lock, concurrent requests wait for that result instead of querying too, so
+a burst of devices opening the app costs one computation per worker process.
+"""
+import time
+from datetime import timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .counters import count, ORDERS, PRODUCTS
+from .ledger import start_of_day
+from .models import Order, OrderItem, Product
+from .serializers import OrderSerializer
+from .valuation import total_valuation
+
+
+RECENT_ORDERS = 10
+WEEK_DAYS = 7
+
+_snapshot = None
+_expires = 0.0
+_lock = Lock()
+
+
+def cache_seconds():
+    return getattr(settings, 'DASHBOARD_CACHE_SECONDS', 5)
+
+
+def weekly_sales(today):
+    """Paid sales of the last seven days (today included), oldest first, from one grouped query."""
+    first = today - timedelta(days=WEEK_DAYS - 1)
+    totals = dict(
+        Order.objects.filter(order_date__gte=start_of_day(first), status='Done', payment_status='Paid')
+        .annotate(day=TruncDate('order_date', tzinfo=timezone.get_current_timezone()))
+        .values_list('day')
+        .annotate(sales=Sum('total_amount'))
+        .order_by()
+    )
+    days = [first + timedelta(days=offset) for offset in range(WEEK_DAYS)]
+    return [{'period': day.strftime('%A'), 'sales': float(totals.get(day) or 0)} for day in days]
+
+
+def compute_dashboard():
+    today = timezone.localdate()
+    paid = Q(status='Done', payment_status='Paid')
+    with transaction.atomic():
+        revenue = Order.objects.filter(paid).aggregate(total_revenue=Sum('total_amount'))['total_revenue']
+        cost = OrderItem.objects.filter(
+            order__status='Done', order__payment_status='Paid'
+        ).aggregate(total_cost=Sum('cost'))['total_cost']
+        out_of_stock = Product.objects.filter(is_low_stock=True).count()
+        total_order, total_product = count(ORDERS), count(PRODUCTS)
+        quantity, value = total_valuation()
+        recent = (
+            Order.objects.select_related('customer')
+            .prefetch_related('items__product')
+            .order_by('-order_date')[:RECENT_ORDERS]
+        )
+        recent_orders = OrderSerializer(recent, many=True).data
+        sales = weekly_sales(today)
+
+    return {
+        'total_revenue': revenue,
+        'total_profit': 0.00 if revenue is None or cost is None else float(revenue - cost),
+        'total_product_cost': value,
+        'total_quantity': quantity,
+        'out_of_stock': out_of_stock,
+        'total_order': total_order,
+        'total_product': total_product,
+        'recent_orders': recent_orders,
+        'weekly_sales': sales,
+        'generated_at': timezone.now(),
+    }
+
+
+def dashboard():
+    """The cached dashboard, recomputed by one request at a time once it is older than DASHBOARD_CACHE_SECONDS."""
+    global _snapshot, _expires
+    if _snapshot is not None and time.monotonic() < _expires:
+        return _snapshot
+    with _lock:
+        # Whoever held the lock before us may have just refreshed it
+        if _snapshot is not None and time.monotonic() < _expires:
+            return _snapshot
+        snapshot = compute_dashboard()
+        _snapshot, _expires = snapshot, time.monotonic() + cache_seconds()
+        return snapshot
+
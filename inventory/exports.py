@@ -0,0 +1,179 @@
+"""
+Streaming spreadsheet exports.
+
+Rows are read with `values_list(...).iterator()` so only one chunk is in memory
+at a time. CSV/TSV are generated straight into a StreamingHttpResponse; XLSX is
+written by a write-only openpyxl workbook into a temporary file which is then
+streamed back with FileResponse.
+"""
+import csv
+import io
+import json
+import tempfile
+from decimal import Decimal
+
+import openpyxl
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse, FileResponse
+
+from .models import Product, Report
+
+
+CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+}
+
+# (column header, values lookup); the first columns match what the product import reads
+PRODUCT_COLUMNS = [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('description', 'description'),
+    ('package', 'package'),
+    ('piece', 'piece'),
+    ('buying_price', 'buying_price'),
+    ('selling_price', 'selling_price'),
+    ('unit', 'unit'),
+    ('stock', 'stock'),
+    ('receipt_no', 'receipt_no'),
+    ('user', 'user'),
+    ('specification', 'specification'),
+    ('category', 'category__name'),
+    ('supplier', 'supplier__name'),
+]
+
+REPORT_FORMATS = dict(EXPORT_FORMATS, ndjson='application/x-ndjson')
+
+ORDER_REPORT_COLUMNS = [
+    (field.name, field.name) for field in Report._meta.concrete_fields
+]
+ORDER_REPORT_TOTAL_FIELDS = ('quantity', 'sub_total', 'vat', 'total_amount')
+
+
+class Echo:
+    """File-like object whose write() hands the line back, for csv.writer in a generator."""
+    def write(self, value):
+        return value
+
+
+def queryset_rows(queryset, columns, chunk_size=CHUNK_SIZE):
+    """The header followed by one tuple per row, fetched in chunks (joins included)."""
+    yield [header for header, _ in columns]
+    yield from queryset.values_list(*[lookup for _, lookup in columns]).iterator(chunk_size=chunk_size)
+
+
+def product_rows(queryset=None):
+    queryset = queryset if queryset is not None else Product.objects.all()
+    return queryset_rows(queryset.order_by('id'), PRODUCT_COLUMNS)
+
+
+def stream_delimited(rows, filename, delimiter=','):
+    writer = csv.writer(Echo(), delimiter=delimiter)
+    content_type = EXPORT_FORMATS['tsv' if delimiter == '\t' else 'csv']
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
+def write_xlsx(rows, target, title='Sheet'):
+    """Write rows to `target` (a path or binary file) with a write-only workbook."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=title)
+    for row in rows:
+        ws.append(list(row))
+    wb.save(target)
+
+
+def stream_xlsx(rows, filename, title='Sheet'):
+    # openpyxl needs a seekable file for the zip container; the rows themselves
+    # are flushed to disk as they are appended, so memory stays flat
+    target = tempfile.TemporaryFile(suffix='.xlsx')
+    write_xlsx(rows, target, title=title)
+    target.seek(0)
+    return FileResponse(target, as_attachment=True, filename=filename, content_type=EXPORT_FORMATS['xlsx'])
+
+
+def _empty_totals():
+    return {'lines': 0, **{field: 0 for field in ORDER_REPORT_TOTAL_FIELDS}}
+
+
+def _add_row(totals, row):
+    totals['lines'] += 1
+    for field in ORDER_REPORT_TOTAL_FIELDS:
+        totals[field] += row[field] or 0
+
+
+def _money(totals):
+    """The subtotals with the amounts rounded to cents."""
+    for field in ORDER_REPORT_TOTAL_FIELDS[1:]:
+        totals[field] = Decimal(totals[field]).quantize(Decimal('0.01'))
+    return totals
+
+
+def order_report_records(reports):
+    """
+    Yield ('row', values) for every report line in date order, ('day_total', subtotals)
+    after the last line of each day and a final ('total', totals). The subtotals
+    are summed from the streamed rows, so they always match the lines above them.
+    """
+    fields = [lookup for _, lookup in ORDER_REPORT_COLUMNS]
+    current, day, totals = None, None, _empty_totals()
+    for row in reports.order_by('order_date', 'id').values(*fields).iterator(chunk_size=CHUNK_SIZE):
+        if current is not None and row['order_date'] != current:
+            yield 'day_total', {'order_date': current, **_money(day)}
+        if row['order_date'] != current:
+            current, day = row['order_date'], _empty_totals()
+        _add_row(day, row)
+        _add_row(totals, row)
+        yield 'row', row
+    if current is not None:
+        yield 'day_total', {'order_date': current, **_money(day)}
+    yield 'total', _money(totals)
+
+
+def order_report_table(records):
+    """Flatten order report records into sheet rows; subtotals are labelled in the product column."""
+    header = [name for name, _ in ORDER_REPORT_COLUMNS]
+    labels = {'day_total': 'Day total', 'total': 'Total'}
+    yield header
+    for kind, data in records:
+        if kind == 'row':
+            yield [data[name] for name in header]
+            continue
+        line = [data.get(name) if name in ORDER_REPORT_TOTAL_FIELDS or name == 'order_date' else None for name in header]
+        line[header.index('product_name')] = labels[kind]
+        yield line
+
+
+def stream_ndjson(records, filename):
+    lines = (json.dumps({'type': kind, **data}, cls=DjangoJSONEncoder) + '\n' for kind, data in records)
+    response = StreamingHttpResponse(lines, content_type=REPORT_FORMATS['ndjson'])
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
+def export_response(rows, output, basename, title='Sheet'):
+    """Streaming response for `rows` in `output` ('xlsx', 'csv' or 'tsv')."""
+    if output == 'csv':
+        return stream_delimited(rows, f'{basename}.csv')
+    if output == 'tsv':
+        return stream_delimited(rows, f'{basename}.tsv', delimiter='\t')
+    return stream_xlsx(rows, f'{basename}.xlsx', title=title)
+
+
+def export_to_file(rows, output, title='Sheet'):
+    """Write rows into a temporary binary file (rewound) for storing as a job result."""
+    target = tempfile.TemporaryFile()
+    if output in ('csv', 'tsv'):
+        text = io.TextIOWrapper(target, encoding='utf-8', newline='')
+        writer = csv.writer(text, delimiter='\t' if output == 'tsv' else ',')
+        writer.writerows(rows)
+        text.flush()
+        target = text.detach()
+    else:
+        write_xlsx(rows, target, title=title)
+    target.seek(0)
+    return target
@@ -0,0 +1,215 @@
+"""
+Demand forecasting and reorder suggestions.
+
+The daily demand of every product over the last FORECAST_HISTORY_DAYS comes
+from one grouped query (product, day, units). The series stay in that sparse
+(product, day, quantity) form and every statistic is a weighted
+`np.bincount` over it for all products at once, so memory grows with the
+number of sales rather than products x days:
+
+* rolling averages over the last 7, 28 and 90 days (days without sales count as 0),
+* the trend as the least-squares slope of the last 90 days,
+* the standard deviation of the last 28 days for safety stock.
+
+Daily demand is the 28-day average projected with the trend to the middle of
+the lead time + review period. The suggested reorder quantity covers that
+period plus safety stock (REORDER_SERVICE_Z standard deviations over the lead
+time) minus current stock. The lead time is the supplier's own, else
+REORDER_LEAD_TIME_DAYS.
+"""
+import math
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .analytics import sales_items
+from .models import DemandForecast, Product
+
+
+BATCH_SIZE = 2000
+WINDOWS = (7, 28, 90)
+TREND_DAYS = 90
+STD_DAYS = 28
+
+
+def history_days():
+    return getattr(settings, 'FORECAST_HISTORY_DAYS', 730)
+
+
+def lead_time_days():
+    return getattr(settings, 'REORDER_LEAD_TIME_DAYS', 7)
+
+
+def review_days():
+    return getattr(settings, 'REORDER_REVIEW_DAYS', 7)
+
+
+def service_z():
+    return getattr(settings, 'REORDER_SERVICE_Z', 1.65)
+
+
+def daily_demand_rows(start, end):
+    """(product_id, day, units) for every product and day with completed sales in start..end."""
+    return (
+        sales_items(start=start, end=end)
+        .filter(product__isnull=False)
+        .annotate(day=TruncDate('order__order_date'))
+        .values_list('product_id', 'day')
+        .annotate(units=Sum('quantity'))
+        .order_by()
+    )
+
+
+def _window_sum(index, offsets, weights, days, horizon, size):
+    """Per-product sum of `weights` over the last `days` of a `horizon`-day series."""
+    mask = offsets >= horizon - days
+    return np.bincount(index[mask], weights=weights[mask], minlength=size)
+
+
+def compute_forecasts(product_ids, stock, lead_times, sale_products, sale_offsets, sale_units, horizon,
+                      review=7, z=1.65):
+    """
+    Vectorised statistics for all products. `sale_*` are parallel arrays of
+    sales (product id, day offset from the start of the history where
+    horizon - 1 is today, units). Returns a dict of arrays aligned with
+    `product_ids`.
+    """
+    size = len(product_ids)
+    order = np.argsort(product_ids)
+    sorted_ids = product_ids[order]
+    position = np.searchsorted(sorted_ids, sale_products)
+    known = (position < size) & (sorted_ids[np.minimum(position, size - 1)] == sale_products)
+    index = order[position[known]]
+    offsets = sale_offsets[known]
+    units = sale_units[known].astype(np.float64)
+
+    result = {}
+    for days in WINDOWS:
+        result[f'avg_{days}'] = _window_sum(index, offsets, units, days, horizon, size) / days
+
+    # Least-squares slope over the last TREND_DAYS, with t = 0..n-1 and zero-sale days included
+    n = TREND_DAYS
+    t = (offsets - (horizon - n)).astype(np.float64)
+    sum_y = _window_sum(index, offsets, units, n, horizon, size)
+    sum_ty = _window_sum(index, offsets, units * t, n, horizon, size)
+    sum_t = n * (n - 1) / 2
+    sum_tt = (n - 1) * n * (2 * n - 1) / 6
+    result['trend'] = (n * sum_ty - sum_t * sum_y) / (n * sum_tt - sum_t ** 2)
+
+    mean = result[f'avg_{STD_DAYS}']
+    sum_yy = _window_sum(index, offsets, units ** 2, STD_DAYS, horizon, size)
+    result['demand_std'] = np.sqrt(np.maximum(sum_yy / STD_DAYS - mean ** 2, 0))
+
+    cover_period = lead_times + review
+    demand = np.maximum(result['avg_28'] + result['trend'] * cover_period / 2, 0)
+    result['daily_demand'] = demand
+
+    on_hand = np.maximum(stock, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['days_of_cover'] = np.where(demand > 0, on_hand / demand, np.nan)
+
+    safety = z * result['demand_std'] * np.sqrt(lead_times)
+    target = demand * cover_period + safety
+    result['reorder_quantity'] = np.where(demand > 0, np.ceil(np.maximum(target - on_hand, 0)), 0).astype(np.int64)
+    return result
+
+
+def build_forecasts(today=None, progress=None):
+    """Recompute DemandForecast for every product; returns the number of products."""
+    today = today or timezone.localdate()
+    horizon = history_days()
+    start = today - timedelta(days=horizon - 1)
+
+    products = list(Product.objects.values_list('id', 'stock', 'supplier__lead_time_days'))
+    if not products:
+        DemandForecast.objects.all().delete()
+        return 0
+    product_ids = np.fromiter((row[0] for row in products), dtype=np.int64, count=len(products))
+    stock = np.fromiter((row[1] or 0 for row in products), dtype=np.float64, count=len(products))
+    lead_times = np.fromiter(
+        (row[2] if row[2] is not None else lead_time_days() for row in products), dtype=np.float64, count=len(products)
+    )
+
+    rows = list(daily_demand_rows(start, today).iterator(chunk_size=10000))
+    if progress:
+        progress(0, len(products), "Computing forecasts")
+    sale_products = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    sale_offsets = (
+        np.array([row[1] for row in rows], dtype='datetime64[D]') - np.datetime64(start, 'D')
+    ).astype(np.int64) if rows else np.zeros(0, dtype=np.int64)
+    sale_units = np.fromiter((row[2] or 0 for row in rows), dtype=np.float64, count=len(rows))
+
+    stats = compute_forecasts(
+        product_ids, stock, lead_times, sale_products, sale_offsets, sale_units, horizon,
+        review=review_days(), z=service_z(),
+    )
+
+    now = timezone.now()
+    forecasts = [
+        DemandForecast(
+            product_id=int(product_ids[i]),
+            avg_7=round(float(stats['avg_7'][i]), 4),
+            avg_28=round(float(stats['avg_28'][i]), 4),
+            avg_90=round(float(stats['avg_90'][i]), 4),
+            trend=round(float(stats['trend'][i]), 6),
+            daily_demand=round(float(stats['daily_demand'][i]), 4),
+            demand_std=round(float(stats['demand_std'][i]), 4),
+            stock=int(stock[i]),
+            days_of_cover=None if math.isnan(stats['days_of_cover'][i]) else round(float(stats['days_of_cover'][i]), 1),
+            lead_time_days=int(lead_times[i]),
+            reorder_quantity=int(stats['reorder_quantity'][i]),
+            computed_at=now,
+        )
+        for i in range(len(products))
+    ]
+    with transaction.atomic():
+        DemandForecast.objects.all().delete()
+        for begin in range(0, len(forecasts), BATCH_SIZE):
+            DemandForecast.objects.bulk_create(forecasts[begin:begin + BATCH_SIZE])
+            if progress:
+                progress(min(begin + BATCH_SIZE, len(forecasts)), len(forecasts))
+    return len(forecasts)
+
+
+def reorder_suggestions(supplier_id=None):
+    """Products to reorder grouped by supplier, with the estimated cost at the current unit cost."""
+    forecasts = (
+        DemandForecast.objects.filter(reorder_quantity__gt=0)
+        .select_related('product__supplier')
+        .order_by('product__supplier__name', 'product__supplier_id', '-reorder_quantity')
+    )
+    if supplier_id is not None:
+        forecasts = forecasts.filter(product__supplier_id=supplier_id)
+
+    suppliers = {}
+    for forecast in forecasts:
+        product = forecast.product
+        unit_cost = product.unit_cost if product.unit_cost is not None else product.buying_price
+        group = suppliers.setdefault(product.supplier_id, {
+            'supplier_id': product.supplier_id,
+            'supplier_name': product.supplier.name if product.supplier else None,
+            'lead_time_days': forecast.lead_time_days,
+            'total_quantity': 0,
+            'estimated_cost': 0,
+            'products': [],
+        })
+        cost = round(float(unit_cost or 0) * forecast.reorder_quantity, 2)
+        group['total_quantity'] += forecast.reorder_quantity
+        group['estimated_cost'] = round(group['estimated_cost'] + cost, 2)
+        group['products'].append({
+            'product_id': product.id,
+            'product_name': product.name,
+            'specification': product.specification,
+            'stock': forecast.stock,
+            'daily_demand': forecast.daily_demand,
+            'trend': forecast.trend,
+            'days_of_cover': forecast.days_of_cover,
+            'reorder_quantity': forecast.reorder_quantity,
+            'estimated_cost': cost,
+        })
+    return list(suppliers.values())
@@ -0,0 +1,144 @@
+"""
+Inventory health: ABC classification, stock turnover and dead stock.
+
+One grouped query over completed order lines gives, per product, the revenue,
+COGS and units sold in the last HEALTH_WINDOW_DAYS and the time of its last
+sale ever; one more reads every product's stock and cost. The rest is numpy
+over those arrays:
+
+* ABC by share of window revenue: products are ranked by revenue and belong to
+  A while the revenue ranked above them is below ABC_A_SHARE of the total, to B
+  below ABC_B_SHARE, and to C otherwise (so is everything without revenue).
+* Turnover is units sold in the window, annualised, per unit on hand (current
+  stock stands in for average inventory); days of inventory is 365 / turnover.
+* Dead stock is stock > 0 with no sale in DEAD_STOCK_DAYS.
+
+The result replaces the ProductHealth table, which the endpoints read as is.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Sum, Max, F, DecimalField, IntegerField
+from django.utils import timezone
+
+from .models import OrderItem, Product, ProductHealth
+
+
+BATCH_SIZE = 2000
+
+
+def window_days():
+    return getattr(settings, 'HEALTH_WINDOW_DAYS', 365)
+
+
+def dead_stock_days():
+    return getattr(settings, 'DEAD_STOCK_DAYS', 90)
+
+
+def abc_shares():
+    return getattr(settings, 'ABC_A_SHARE', 0.8), getattr(settings, 'ABC_B_SHARE', 0.95)
+
+
+def product_sales(since):
+    """{product_id: (revenue, cogs, units) since `since`, last sale ever} from one grouped query."""
+    in_window = {'order__order_date__gte': since}
+    money = DecimalField(max_digits=20, decimal_places=2)
+    return (
+        OrderItem.objects.filter(status='Done', order__status='Done', product__isnull=False)
+        .values('product_id')
+        .annotate(
+            revenue=Sum(Case(When(**in_window, then=F('price')), default=0, output_field=money)),
+            cogs=Sum(Case(When(**in_window, then=F('cost')), default=0, output_field=money)),
+            units=Sum(Case(When(**in_window, then=F('quantity')), default=0, output_field=IntegerField())),
+            last_sale=Max('order__order_date'),
+        )
+        .order_by()
+    )
+
+
+def classify_abc(revenue, a_share=0.8, b_share=0.95):
+    """Array of 'A'/'B'/'C' for `revenue` (one value per product)."""
+    classes = np.full(len(revenue), 'C', dtype='<U1')
+    total = revenue.sum()
+    if total <= 0:
+        return classes, np.zeros(len(revenue)), np.zeros(len(revenue))
+    ranking = np.argsort(-revenue, kind='stable')
+    share = revenue / total
+    cumulative = np.empty(len(revenue))
+    cumulative[ranking] = np.cumsum(share[ranking])
+    before = cumulative - share
+    selling = revenue > 0
+    classes[selling & (before < b_share)] = 'B'
+    classes[selling & (before < a_share)] = 'A'
+    return classes, share, cumulative
+
+
+def compute_health(now=None):
+    """ProductHealth rows (unsaved) for every product."""
+    now = now or timezone.now()
+    window = window_days()
+    since = now - timedelta(days=window)
+
+    products = list(Product.objects.values_list('id', 'stock', 'unit_cost', 'buying_price'))
+    sales = {row['product_id']: row for row in product_sales(since)}
+    count = len(products)
+
+    revenue = np.zeros(count)
+    units = np.zeros(count)
+    stock = np.fromiter((row[1] or 0 for row in products), dtype=np.float64, count=count)
+    unit_cost = np.fromiter(
+        (float(row[2] if row[2] is not None else row[3] or 0) for row in products), dtype=np.float64, count=count
+    )
+    last_sale = [None] * count
+    for i, (product_id, *_) in enumerate(products):
+        row = sales.get(product_id)
+        if row:
+            revenue[i] = float(row['revenue'] or 0)
+            units[i] = row['units'] or 0
+            last_sale[i] = row['last_sale']
+
+    classes, share, cumulative = classify_abc(revenue, *abc_shares())
+    on_hand = np.maximum(stock, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        turnover = np.where(on_hand > 0, units * (365 / window) / on_hand, np.nan)
+        days_of_inventory = np.where(turnover > 0, 365 / turnover, np.nan)
+    idle_days = np.array(
+        [(now - sale).days if sale else -1 for sale in last_sale], dtype=np.int64
+    ) if count else np.zeros(0, dtype=np.int64)
+    dead = (on_hand > 0) & ((idle_days < 0) | (idle_days >= dead_stock_days()))
+
+    rows = []
+    for i, (product_id, *_) in enumerate(products):
+        row = sales.get(product_id) or {}
+        rows.append(ProductHealth(
+            product_id=product_id,
+            abc_class=classes[i],
+            revenue=row.get('revenue') or Decimal('0.00'),
+            cogs=row.get('cogs') or Decimal('0.00'),
+            quantity_sold=int(units[i]),
+            revenue_share=round(float(share[i]), 6),
+            cumulative_share=round(float(cumulative[i]), 6),
+            stock=int(stock[i]),
+            stock_value=Decimal(str(round(on_hand[i] * unit_cost[i], 2))),
+            turnover=None if np.isnan(turnover[i]) else round(float(turnover[i]), 4),
+            days_of_inventory=None if np.isnan(days_of_inventory[i]) else round(float(days_of_inventory[i]), 1),
+            last_sale_at=last_sale[i],
+            days_since_last_sale=None if idle_days[i] < 0 else int(idle_days[i]),
+            is_dead_stock=bool(dead[i]),
+            computed_at=now,
+        ))
+    return rows
+
+
+def refresh_product_health(progress=None):
+    rows = compute_health()
+    with transaction.atomic():
+        ProductHealth.objects.all().delete()
+        for start in range(0, len(rows), BATCH_SIZE):
+            ProductHealth.objects.bulk_create(rows[start:start + BATCH_SIZE])
+            if progress:
+                progress(min(start + BATCH_SIZE, len(rows)), len(rows))
+    return len(rows)
@@ -0,0 +1,268 @@
+"""
+Bulk product import from a spreadsheet.
+
+The workbook is read in read-only mode and every row is validated before
+anything is written. Existing products are resolved with one `in_bulk` query,
+then new and changed products are written with chunked bulk_create/bulk_update
+inside a single transaction, with one ProductLog batch for the changes. Bulk
+writes skip the Product signals, so the stock ledger, valuation, low-stock
+flags and the product report version are updated here explicitly. Only the
+columns present in the sheet are applied to existing products.
+
+Backends that cannot return ids from a bulk insert (MySQL) still get one
+bulk_create: each new row carries a batch marker in `user` while it is
+inserted, the ids are read back by marker above the highest id seen before the
+insert, and the real `user` values are written back with one bulk_update.
+The marker is matched rather than the order of the new ids, since concurrent
+inserts may interleave auto-increment values. It never outlives the
+transaction: all three steps run inside apply_import's atomic block (checked
+before the insert), so a failure anywhere rolls the marked rows back with it.
+"""
+import uuid
+from decimal import Decimal, InvalidOperation
+
+import openpyxl
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .models import Product, Category, Supplier, ProductLog, StockMovement
+from .counters import count_created
+from .ledger import record_movements
+from .report_cache import bump, PRODUCTS
+from .stock_alerts import refresh_low_stock
+from .valuation import apply_product_changes, product_state
+
+
+BATCH_SIZE = 1000
+MAX_DIFF_ROWS = 1000
+
+INTEGER_FIELDS = ('package', 'piece', 'stock', 'receipt_no')
+DECIMAL_FIELDS = ('buying_price', 'selling_price')
+TEXT_FIELDS = {'name': 200, 'description': None, 'unit': 255, 'user': 255, 'specification': 255}
+# Sheet column -> Product field resolved by name
+RELATED_FIELDS = {'category': ('category_id', Category), 'supplier': ('supplier_id', Supplier)}
+
+
+class ImportResult:
+    def __init__(self):
+        self.errors = []
+        self.created = []    # [(row number, Product)]
+        self.updated = []    # [(row number, Product, {field: (old, new)})]
+        self.unchanged = 0
+
+    def summary(self, with_changes=False):
+        data = {
+            'created': len(self.created),
+            'updated': len(self.updated),
+            'unchanged': self.unchanged,
+            'errors': self.errors,
+        }
+        if with_changes:
+            changes = [
+                {'row': row, 'id': product.id, 'action': 'create', 'name': product.name}
+                for row, product in self.created
+            ] + [
+                {
+                    'row': row, 'id': product.id, 'action': 'update', 'name': product.name,
+                    'changes': {field: {'old': old, 'new': new} for field, (old, new) in fields.items()},
+                }
+                for row, product, fields in self.updated
+            ]
+            changes.sort(key=lambda change: change['row'])
+            data['changes'] = changes[:MAX_DIFF_ROWS]
+            data['truncated'] = len(changes) > MAX_DIFF_ROWS
+        return data
+
+
+def read_rows(file):
+    """Yield (row number, {header: value}) from the active sheet, skipping empty rows."""
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        headers = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for number, row in enumerate(rows, start=2):
+            if all(cell is None or str(cell).strip() == '' for cell in row):
+                continue
+            yield number, dict(zip(headers, row))
+    finally:
+        wb.close()
+
+
+def _integer(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, int):
+        return value
+    return int(str(value).strip())
+
+
+def _decimal(value):
+    return Decimal(str(value).strip()).quantize(Decimal('0.01'))
+
+
+def clean_row(data, lookups):
+    """Return ({field: value} for the columns present, errors) for one sheet row."""
+    fields, errors = {}, {}
+    for column, value in data.items():
+        if isinstance(value, str):
+            value = value.strip()
+        blank = value is None or value == ''
+        try:
+            if column == 'id':
+                fields['id'] = None if blank else _integer(value)
+            elif column in INTEGER_FIELDS:
+                fields[column] = None if blank else _integer(value)
+                if column == 'stock' and fields[column] is not None and fields[column] < 0:
+                    errors[column] = "stock can't be negative"
+            elif column in DECIMAL_FIELDS:
+                fields[column] = None if blank else _decimal(value)
+                if fields[column] is not None and fields[column] < 0:
+                    errors[column] = "must not be negative"
+            elif column in TEXT_FIELDS:
+                fields[column] = None if blank else str(value)
+                max_length = TEXT_FIELDS[column]
+                if max_length and fields[column] and len(fields[column]) > max_length:
+                    errors[column] = f"must be at most {max_length} characters"
+            elif column in RELATED_FIELDS:
+                field, _ = RELATED_FIELDS[column]
+                if blank:
+                    fields[field] = None
+                elif str(value) in lookups[column]:
+                    fields[field] = lookups[column][str(value)]
+                else:
+                    errors[column] = f"unknown {column} '{value}'"
+        except (ValueError, InvalidOperation):
+            errors[column] = f"invalid value '{value}'"
+    return fields, errors
+
+
+def plan_import(file, progress=None):
+    """
+    Parse and validate the whole sheet and work out what would change, without writing.
+    `progress(rows_read)` is called every BATCH_SIZE rows when given.
+    """
+    result = ImportResult()
+    lookups = {
+        'category': dict(Category.objects.values_list('name', 'id')),
+        'supplier': dict(Supplier.objects.order_by('-id').values_list('name', 'id')),
+    }
+
+    rows, seen_ids = [], set()
+    for number, data in read_rows(file):
+        fields, errors = clean_row(data, lookups)
+        pk = fields.pop('id', None)
+        if pk is not None:
+            if pk in seen_ids:
+                errors['id'] = f"id {pk} appears more than once"
+            seen_ids.add(pk)
+        for column, message in errors.items():
+            result.errors.append({'row': number, 'field': column, 'error': message})
+        rows.append((number, pk, fields))
+        if progress and len(rows) % BATCH_SIZE == 0:
+            progress(len(rows))
+
+    existing = Product.objects.in_bulk([pk for _, pk, _ in rows if pk is not None])
+
+    for number, pk, fields in rows:
+        product = existing.get(pk)
+        if product is None:
+            if not fields.get('name'):
+                result.errors.append({'row': number, 'field': 'name', 'error': "name is required for new products"})
+                continue
+            result.created.append((number, Product(id=pk, **fields)))
+            continue
+
+        changes = {
+            field: (getattr(product, field), value)
+            for field, value in fields.items()
+            if getattr(product, field) != value
+        }
+        if changes:
+            result.updated.append((number, product, changes))
+        else:
+            result.unchanged += 1
+    return result
+
+
+def _change_logs(result, user):
+    logs = [
+        ProductLog(product=product, change_type="Import Create", field_name="Product",
+                   old_value=None, new_value=product.name, user=user)
+        for _, product in result.created
+    ]
+    for _, product, changes in result.updated:
+        logs.extend(
+            ProductLog(product=product, change_type="Import Update", field_name=field,
+                       old_value=old, new_value=new, user=user)
+            for field, (old, new) in changes.items()
+        )
+    return logs
+
+
+def _bulk_create_products(products):
+    """
+    bulk_create `products` and set their ids, reading them back by batch marker
+    where the backend returns none. Must run inside a transaction.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        Product.objects.bulk_create(products, batch_size=BATCH_SIZE)
+        return
+    Product.objects.bulk_create([p for p in products if p.pk is not None], batch_size=BATCH_SIZE)
+    pending = [p for p in products if p.pk is None]
+    if not pending:
+        return
+    if not connection.in_atomic_block:
+        raise RuntimeError("Products must be bulk created inside a transaction, so the batch marker is never committed.")
+    last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+    batch = uuid.uuid4().hex
+    users = [product.user for product in pending]
+    for index, product in enumerate(pending):
+        product.user = f"{batch}:{index}"
+    Product.objects.bulk_create(pending, batch_size=BATCH_SIZE)
+    ids = dict(Product.objects.filter(pk__gt=last_id, user__startswith=f"{batch}:").values_list('user', 'id'))
+    for index, (product, user) in enumerate(zip(pending, users)):
+        product.pk = ids[f"{batch}:{index}"]
+        product.user = user
+    Product.objects.bulk_update(pending, ['user'], batch_size=BATCH_SIZE)
+
+
+def apply_import(result, user=None, progress=None):
+    """
+    Write a validated plan in one transaction. `progress(products_written)` is
+    called after each chunk; an exception raised from it rolls everything back.
+    """
+    created = [product for _, product in result.created]
+    valuation_changes, movements = [], []
+
+    with transaction.atomic():
+        _bulk_create_products(created)
+        count_created(Product, created)
+        for product in created:
+            valuation_changes.append((None, product_state(product)))
+            movements.append((product.pk, product.stock or 0, product.stock))
+
+        updated_fields = set()
+        for _, product, changes in result.updated:
+            old_state = product_state(product)
+            old_stock = product.stock
+            for field, (_, new) in changes.items():
+                setattr(product, field, new)
+            updated_fields.update(changes)
+            valuation_changes.append((old_state, product_state(product)))
+            movements.append((product.pk, (product.stock or 0) - (old_stock or 0), product.stock))
+        if progress:
+            progress(len(created))
+        updated = [product for _, product, _ in result.updated]
+        for start in range(0, len(updated), BATCH_SIZE):
+            Product.objects.bulk_update(updated[start:start + BATCH_SIZE], sorted(updated_fields))
+            if progress:
+                progress(len(created) + min(start + BATCH_SIZE, len(updated)))
+
+        ProductLog.objects.bulk_create(_change_logs(result, user), batch_size=BATCH_SIZE)
+        record_movements(movements, StockMovement.IMPORT, model_name='Product', user=user)
+        apply_product_changes(valuation_changes)
+        touched = [product.pk for product in created] + [product.pk for _, product, _ in result.updated]
+        for start in range(0, len(touched), BATCH_SIZE):
+            refresh_low_stock(touched[start:start + BATCH_SIZE])
+        bump(PRODUCTS)
+    return result
@@ -0,0 +1,217 @@
+"""
+A small database-backed job queue.
+
+Views enqueue a BackgroundJob row and return its id; `manage.py run_jobs`
+claims queued jobs (SELECT ... FOR UPDATE SKIP LOCKED, so several workers can
+run side by side) and calls the handler registered for the job kind. Handlers
+receive a JobContext to report progress, which also raises JobCancelled once a
+cancellation was requested, and to attach a result file for download.
+
+Handlers are listed by import path in JOB_HANDLERS and imported by the worker
+when it runs a job, so the web workers that only enqueue never load them (nor
+pandas and numpy behind them).
+
+A running job holds a lease: a heartbeat thread in the worker renews
+`heartbeat_at` while the handler runs. A job whose lease ran out
+(JOB_LEASE_SECONDS) lost its worker; the next claim puts it back in the queue,
+or fails it once it was claimed JOB_MAX_ATTEMPTS times. A worker that finds
+its job taken from it stops at the next progress report and leaves the row alone.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import BackgroundJob
+
+
+# Job kind -> import path of its handler (see inventory/tasks.py)
+JOB_HANDLERS = {
+    'product_import': 'inventory.tasks.import_products',
+    'product_export': 'inventory.tasks.export_products',
+    'order_report': 'inventory.tasks.export_order_report',
+    'supplier_report': 'inventory.tasks.supplier_report',
+    'yearly_report': 'inventory.tasks.yearly_report',
+    'demand_forecast': 'inventory.tasks.demand_forecast',
+    'product_health': 'inventory.tasks.product_health',
+}
+
+# Write progress to the database at most this often (seconds)
+PROGRESS_INTERVAL = 1.0
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def lease_seconds():
+    return getattr(settings, 'JOB_LEASE_SECONDS', 300)
+
+
+def max_attempts():
+    return getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+
+
+def enqueue(kind, params=None, user=None, input_file=None):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    job = BackgroundJob(kind=kind, params=params or {}, user=user)
+    if input_file is not None:
+        job.input_file.save(os.path.basename(input_file.name), input_file, save=False)
+    job.save()
+    return job
+
+
+def cancel(job):
+    """Queued jobs are cancelled right away; running ones stop at their next progress report."""
+    with transaction.atomic():
+        job = BackgroundJob.objects.select_for_update().get(pk=job.pk)
+        if job.status == BackgroundJob.QUEUED:
+            job.status = BackgroundJob.CANCELLED
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'finished_at'])
+        elif job.status == BackgroundJob.RUNNING:
+            job.cancel_requested = True
+            job.save(update_fields=['cancel_requested'])
+    return job
+
+
+class JobContext:
+    def __init__(self, job):
+        self.job = job
+        self._last_write = 0.0
+
+    @property
+    def params(self):
+        return self.job.params
+
+    def progress(self, done, total=None, message=None, force=False):
+        """Record progress (throttled) and stop the handler if the job was cancelled."""
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+
+        fields = {'progress': done}
+        if total is not None:
+            fields['total'] = total
+        if message is not None:
+            fields['message'] = message[:255]
+        BackgroundJob.objects.filter(pk=self.job.pk).update(**fields)
+        for field, value in fields.items():
+            setattr(self.job, field, value)
+
+        if not owned(self.job).filter(cancel_requested=False).exists():
+            raise JobCancelled()
+
+    def save_result_file(self, name, fileobj):
+        self.job.result_file.save(name, File(fileobj), save=False)
+        BackgroundJob.objects.filter(pk=self.job.pk).update(result_file=self.job.result_file.name)
+
+
+def owned(job):
+    """The job's row while it is still running on the worker that claimed it."""
+    return BackgroundJob.objects.filter(pk=job.pk, status=BackgroundJob.RUNNING, worker=job.worker)
+
+
+def requeue_expired(now=None):
+    """Put running jobs whose lease ran out back in the queue (or fail them after max_attempts()). Returns their number."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=lease_seconds())
+    with transaction.atomic():
+        expired = list(
+            BackgroundJob.objects.select_for_update(skip_locked=True)
+            .filter(status=BackgroundJob.RUNNING)
+            .filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff))
+        )
+        for job in expired:
+            if job.cancel_requested:
+                job.status, job.message, job.finished_at = BackgroundJob.CANCELLED, "Cancelled", now
+            elif job.attempts >= max_attempts():
+                job.status, job.finished_at = BackgroundJob.FAILED, now
+                job.message = f"The worker stopped responding ({job.attempts} attempts)"
+            else:
+                job.status, job.message, job.progress = BackgroundJob.QUEUED, "Requeued: the worker stopped responding", 0
+            job.worker = None
+            job.save(update_fields=['status', 'message', 'progress', 'finished_at', 'worker'])
+    return len(expired)
+
+
+def claim_next(worker=None):
+    """Mark the oldest queued job as running and return it (None when the queue is empty)."""
+    requeue_expired()
+    with transaction.atomic():
+        job = (
+            BackgroundJob.objects.select_for_update(skip_locked=True)
+            .filter(status=BackgroundJob.QUEUED)
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = BackgroundJob.RUNNING
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.attempts += 1
+        job.worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at', 'attempts', 'worker'])
+    return job
+
+
+class Heartbeat(threading.Thread):
+    """Renews the lease of a running job every quarter lease until stopped."""
+
+    def __init__(self, job):
+        super().__init__(name=f"job-{job.pk}-heartbeat", daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(lease_seconds() / 4):
+                try:
+                    owned(self.job).update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    pass  # retried at the next beat, well inside the lease
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job):
+    context = JobContext(job)
+    fields = ['status', 'finished_at', 'result', 'error', 'progress', 'message']
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        if job.kind not in JOB_HANDLERS:
+            raise ValueError(f"No handler registered for job kind '{job.kind}'")
+        job.result = import_string(JOB_HANDLERS[job.kind])(context)
+        job.status = BackgroundJob.SUCCEEDED
+        job.message = "Completed"
+        if job.total is not None:
+            job.progress = job.total
+    except JobCancelled:
+        job.status = BackgroundJob.CANCELLED
+        job.message = "Cancelled"
+    except Exception as e:
+        job.status = BackgroundJob.FAILED
+        job.message = str(e)[:255]
+        job.error = traceback.format_exc()
+    finally:
+        heartbeat.stop()
+    job.finished_at = timezone.now()
+    # A job requeued after its lease ran out belongs to another worker now
+    owned(job).update(**{field: getattr(job, field) for field in fields})
+    return job
@@ -0,0 +1,171 @@
+"""
+Append-only stock movement ledger.
+
+Every change of `Product.stock` written through `save()` is recorded as a
+StockMovement by the Product signals in models.py. Code that changes stock
+wraps the work in `stock_movement(...)` so the rows carry the reason (sale,
+purchase, import ...) and a reference to the document. Bulk paths that bypass
+signals call `record_movements` themselves.
+
+Periodic StockSnapshot rows (see the `snapshot_stock` command) bound the work
+of "stock on date X": the latest snapshot before X plus the movements after it.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Case, When, OuterRef, Subquery, Sum, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockMovement, StockSnapshot
+
+
+_movement_context = ContextVar('stock_movement_context', default=None)
+
+
+@contextmanager
+def stock_movement(kind, model_name=None, object_id=None, user=None):
+    """
+    Tag the stock changes made inside the block. Works as a decorator too;
+    use `tag_movements` to add the id of an object created inside the block.
+    """
+    context = {'kind': kind, 'model_name': model_name, 'object_id': object_id, 'user': user}
+    token = _movement_context.set(context)
+    try:
+        yield context
+    finally:
+        _movement_context.reset(token)
+
+
+def tag_movements(**fields):
+    """Fill in the reference of the enclosing `stock_movement` block."""
+    context = _movement_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+def _movement_kind(context_kind, quantity):
+    # Stock coming back while selling is a return (cancelled items)
+    if context_kind == StockMovement.SALE and quantity > 0:
+        return StockMovement.RETURN
+    return context_kind
+
+
+def record_product_change(product, old_stock):
+    """Called by the Product post_save signal with the stock before the save."""
+    new_stock = product.stock or 0
+    quantity = new_stock - (old_stock or 0)
+    if quantity == 0:
+        return None
+
+    context = _movement_context.get() or {'kind': StockMovement.ADJUSTMENT}
+    return StockMovement.objects.create(
+        product=product,
+        kind=_movement_kind(context['kind'], quantity),
+        quantity=quantity,
+        stock_after=new_stock,
+        model_name=context.get('model_name') or 'Product',
+        object_id=context.get('object_id') or product.pk,
+        user=context.get('user') or product.user,
+    )
+
+
+def record_movements(changes, kind, model_name=None, object_id=None, user=None):
+    """
+    Bulk variant for code that updates stock with queryset updates.
+    `changes` is an iterable of (product_id, quantity, stock_after).
+    """
+    rows = [
+        StockMovement(
+            product_id=product_id,
+            kind=_movement_kind(kind, quantity),
+            quantity=quantity,
+            stock_after=stock_after,
+            model_name=model_name,
+            object_id=object_id,
+            user=user,
+        )
+        for product_id, quantity, stock_after in changes
+        if quantity
+    ]
+    return StockMovement.objects.bulk_create(rows, batch_size=1000)
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def end_of_day(day):
+    return start_of_day(day + timedelta(days=1))
+
+
+def take_snapshot(day=None, batch_size=2000):
+    """
+    Store every product's stock as its snapshot for `day` (default today).
+    Today's snapshot is the current stock, taken now. A past day's is worked
+    out from the ledger (`stock_on_date`) and dated at the end of that day, so
+    the movements after it are not counted twice.
+    """
+    today = timezone.localdate()
+    day = day or today
+    if day > today:
+        raise ValueError("Can't take a stock snapshot for a future date.")
+
+    created = 0
+    with transaction.atomic():
+        StockSnapshot.objects.filter(date=day).delete()
+        if day == today:
+            taken_at = timezone.now()
+            stocks = Product.objects.values_list('id', 'stock')
+        else:
+            taken_at = end_of_day(day)
+            stocks = stock_on_date(day).values_list('id', 'stock_on_date')
+        stocks = stocks.order_by('id').iterator(chunk_size=batch_size)
+        while True:
+            batch = [
+                StockSnapshot(product_id=pk, date=day, stock=stock or 0, taken_at=taken_at)
+                for pk, stock in islice(stocks, batch_size)
+            ]
+            if not batch:
+                break
+            created += len(StockSnapshot.objects.bulk_create(batch))
+    return created
+
+
+def stock_on_date(day, products=None):
+    """
+    Products annotated with `stock_on_date`: the latest snapshot taken before
+    the end of `day` plus the movements recorded between it and the end of `day`.
+    """
+    until = end_of_day(day)
+    products = products if products is not None else Product.objects.all()
+
+    latest = StockSnapshot.objects.filter(
+        product=OuterRef('pk'), taken_at__lt=until
+    ).order_by('-taken_at')
+    snapshot_stock = Subquery(latest.values('stock')[:1], output_field=IntegerField())
+    snapshot_at = Subquery(latest.values('taken_at')[:1])
+
+    products = products.annotate(snapshot_stock=snapshot_stock, snapshot_at=snapshot_at)
+
+    def moved(**since):
+        total = (
+            StockMovement.objects.filter(product=OuterRef('pk'), timestamp__lt=until, **since)
+            .values('product')
+            .annotate(total=Sum('quantity'))
+            .values('total')
+        )
+        return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+    # Products without a snapshot yet are summed from their first movement
+    moved_since_snapshot = Case(
+        When(snapshot_at__isnull=True, then=moved()),
+        default=moved(timestamp__gte=OuterRef('snapshot_at')),
+        output_field=IntegerField(),
+    )
+    return products.annotate(
+        stock_on_date=Coalesce('snapshot_stock', 0) + moved_since_snapshot
+    )
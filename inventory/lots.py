@@ -0,0 +1,95 @@
+"""
+Stock lots with expiry dates.
+
+Receiving perishable stock creates a StockLot. Order items take their quantity
+from the product's lots first-expiry-first-out (lots without an expiry date go
+last) and record it as LotAllocation rows, which are released again when the
+item is reduced or cancelled (like stock, nothing comes back when an order is
+deleted). Stock received before lots were tracked
+simply has no lot and is not allocated.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import StockLot, LotAllocation
+
+
+def near_expiry_days():
+    return getattr(settings, 'NEAR_EXPIRY_DAYS', 30)
+
+
+def _allocate(item, quantity):
+    lots = (
+        StockLot.objects.select_for_update()
+        .filter(product_id=item.product_id, remaining__gt=0)
+        .order_by(F('expiry_date').asc(nulls_last=True), 'received_at', 'id')
+    )
+    allocations = []
+    left = quantity
+    for lot in lots:
+        if left <= 0:
+            break
+        taken = min(lot.remaining, left)
+        StockLot.objects.filter(pk=lot.pk).update(remaining=F('remaining') - taken)
+        allocations.append(LotAllocation(order_item=item, lot=lot, quantity=taken))
+        left -= taken
+    LotAllocation.objects.bulk_create(allocations)
+
+
+def _release(item, quantity):
+    # Give back the latest-expiring stock first so the earliest lots stay allocated
+    allocations = (
+        LotAllocation.objects.select_for_update()
+        .filter(order_item=item)
+        .order_by(F('lot__expiry_date').desc(nulls_first=True), '-id')
+    )
+    left = quantity
+    for allocation in allocations:
+        if left <= 0:
+            break
+        given = min(allocation.quantity, left)
+        StockLot.objects.filter(pk=allocation.lot_id).update(remaining=F('remaining') + given)
+        if given == allocation.quantity:
+            allocation.delete()
+        else:
+            LotAllocation.objects.filter(pk=allocation.pk).update(quantity=F('quantity') - given)
+        left -= given
+
+
+def sync_allocation(item):
+    """Make the lots allocated to `item` match its quantity (nothing once cancelled)."""
+    if not item.product_id:
+        return
+    wanted = 0 if item.status == 'Cancelled' else (item.quantity or 0)
+    with transaction.atomic():
+        allocated = item.lot_allocations.aggregate(total=Coalesce(Sum('quantity'), 0))['total']
+        if wanted > allocated:
+            _allocate(item, wanted - allocated)
+        elif wanted < allocated:
+            _release(item, allocated - wanted)
+
+
+def release_items(items):
+    """Release every allocation of `items` in bulk (used where items are cancelled with bulk_update)."""
+    allocations = LotAllocation.objects.filter(order_item__in=items)
+    returned = allocations.values('lot_id').annotate(total=Sum('quantity'))
+    with transaction.atomic():
+        for row in returned:
+            StockLot.objects.filter(pk=row['lot_id']).update(remaining=F('remaining') + row['total'])
+        allocations.delete()
+
+
+def near_expiry_lots(days=None, today=None):
+    """Lots with stock left that expire within `days` (already expired lots included)."""
+    today = today or timezone.localdate()
+    days = near_expiry_days() if days is None else days
+    return (
+        StockLot.objects.select_related('product')
+        .filter(expiry_date__lte=today + timedelta(days=days), remaining__gt=0)
+        .order_by('expiry_date', 'product_id', 'id')
+    )
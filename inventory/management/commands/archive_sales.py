@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventory.archive import archive_month, months_to_archive
+
+
+class Command(BaseCommand):
+    help = 'Write closed sales months (orders, items, reports and order logs) to the Parquet archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Archive only this month (YYYY-MM)')
+        parser.add_argument('--force', action='store_true', help='Rewrite months that are already archived and unchanged')
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                months = [datetime.strptime(options['month'], '%Y-%m').date()]
+            except ValueError:
+                raise CommandError("--month must be in YYYY-MM format.")
+        else:
+            months = months_to_archive(timezone.localdate(), force=options['force'])
+
+        if not months:
+            self.stdout.write("Nothing to archive.")
+        for month in months:
+            archived = archive_month(month)
+            self.stdout.write(f"{month:%Y-%m}: {archived.rows}")
+        self.stdout.write(self.style.SUCCESS(f"Archived {len(months)} month(s)."))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.forecast import build_forecasts
+
+
+class Command(BaseCommand):
+    help = 'Recompute demand forecasts and suggested reorder quantities for every product'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        products = build_forecasts()
+        self.stdout.write(self.style.SUCCESS(
+            f"Forecast {products} products in {time.monotonic() - started:.1f}s."
+        ))
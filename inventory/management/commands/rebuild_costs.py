@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from inventory.costing import rebuild_costs, costing_method
+
+
+class Command(BaseCommand):
+    help = 'Replay purchase cost layers and sales to recompute product unit costs and order item costs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, nargs='*', help='Only rebuild these product ids')
+
+    def handle(self, *args, **options):
+        products = options.get('product') or None
+        updated = rebuild_costs(products)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {costing_method()} costs for {updated} products."
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from inventory.receivables import rebuild_customer_balances
+
+
+class Command(BaseCommand):
+    help = 'Recompute every customer balance from the open orders and report any drift'
+
+    def handle(self, *args, **options):
+        drift = rebuild_customer_balances()
+        for customer_id, ((old_amount, old_orders), (amount, orders)) in drift.items():
+            self.stdout.write(self.style.WARNING(
+                f"Customer {customer_id} drifted: stored {old_amount} on {old_orders} orders, "
+                f"actual {amount} on {orders} orders."
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Customer balances reconciled ({len(drift)} drifted)."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from inventory.payments import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Check that the payment allocations of every order and purchase expense add up to its paid amount and correct any drift'
+
+    def handle(self, *args, **options):
+        drift = reconcile_payments(fix=True)
+        for field, rows in drift.items():
+            for pk, paid, allocated in rows:
+                self.stdout.write(self.style.WARNING(
+                    f"{field.capitalize()} {pk} drifted: paid {paid}, allocated {allocated}."
+                ))
+        drifted = sum(len(rows) for rows in drift.values())
+        self.stdout.write(self.style.SUCCESS(f"Payment allocations reconciled ({drifted} drifted)."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from inventory.purchase_totals import rebuild_purchase_totals
+
+
+class Command(BaseCommand):
+    help = 'Recompute the purchase expense totals from their lines and the purchase supplier amounts from their expenses, and report any drift'
+
+    def handle(self, *args, **options):
+        drift = rebuild_purchase_totals()
+        for (kind, pk), (stored, actual) in drift.items():
+            self.stdout.write(self.style.WARNING(f"{kind.capitalize()} {pk} drifted: stored {stored}, actual {actual}."))
+        self.stdout.write(self.style.SUCCESS(f"Purchase totals rebuilt ({len(drift)} drifted)."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from inventory.valuation import rebuild_valuation
+
+
+class Command(BaseCommand):
+    help = 'Recompute the maintained stock valuation from the product table and report any drift'
+
+    def handle(self, *args, **options):
+        (old_quantity, old_value), (quantity, value) = rebuild_valuation()
+        if (old_quantity, old_value) != (quantity, value):
+            self.stdout.write(self.style.WARNING(
+                f"Valuation drifted: stored {old_quantity} / {old_value}, actual {quantity} / {value}."
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Stock valuation reconciled: {quantity} units worth {value}."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory.stock_alerts import refresh_low_stock
+
+
+class Command(BaseCommand):
+    help = 'Recompute the low-stock flag of every product (e.g. after changing DEFAULT_REORDER_POINT)'
+
+    def handle(self, *args, **options):
+        flipped = refresh_low_stock()
+        self.stdout.write(self.style.SUCCESS(f"Updated the low-stock flag of {flipped} products."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory.health import refresh_product_health
+
+
+class Command(BaseCommand):
+    help = 'Recompute ABC classes, turnover and dead stock for every product (run nightly)'
+
+    def handle(self, *args, **options):
+        products = refresh_product_health()
+        self.stdout.write(self.style.SUCCESS(f"Product health refreshed for {products} products."))
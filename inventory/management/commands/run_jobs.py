@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from inventory.jobs import claim_next, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (imports, exports, reports). Start one or more of these next to the web workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty instead of polling')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait between polls of an empty queue')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS("Job worker started."))
+        while True:
+            close_old_connections()
+            job = claim_next()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            self.stdout.write(f"Running {job}...")
+            job = run_job(job)
+            style = self.style.SUCCESS if job.status == job.SUCCEEDED else self.style.WARNING
+            self.stdout.write(style(f"{job} finished: {job.message or job.status}"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from inventory.ledger import take_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Store the stock of every product as a snapshot for stock-at-date queries (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=str, help='Snapshot date (YYYY-MM-DD), defaults to today; a past date is worked out from the stock ledger')
+
+    def handle(self, *args, **options):
+        day = None
+        if options.get('date'):
+            day = parse_date(options['date'])
+            if day is None:
+                raise CommandError('--date must be in YYYY-MM-DD format')
+        try:
+            created = take_snapshot(day)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Stored {created} stock snapshots."))
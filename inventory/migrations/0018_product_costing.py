@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_order_status_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchaseproduct',
+            name='linked_product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchase_lines', to='inventory.product'),
+        ),
+        migrations.AlterField(
+            model_name='purchaseexpense',
+            name='purchase_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('remaining', models.IntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='inventory.product')),
+                ('purchase_product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='inventory.purchaseproduct')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'received_at'], name='costlayer_product_received_idx')],
+            },
+        ),
+    ]
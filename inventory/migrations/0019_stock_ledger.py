@@ -0,0 +1,62 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def baseline_snapshot(apps, schema_editor):
+    """Existing stock predates the ledger, so start it from a snapshot of today."""
+    Product = apps.get_model('inventory', 'Product')
+    StockSnapshot = apps.get_model('inventory', 'StockSnapshot')
+    today = django.utils.timezone.localdate()
+    taken_at = django.utils.timezone.now()
+    StockSnapshot.objects.bulk_create(
+        (
+            StockSnapshot(product_id=pk, date=today, stock=stock or 0, taken_at=taken_at)
+            for pk, stock in Product.objects.values_list('id', 'stock')
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_product_costing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('Sale', 'Sale'), ('Return', 'Return'), ('Purchase', 'Purchase'), ('Adjustment', 'Adjustment'), ('Import', 'Import')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('stock_after', models.IntegerField(blank=True, null=True)),
+                ('model_name', models.CharField(blank=True, max_length=50, null=True)),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('user', models.CharField(blank=True, max_length=255, null=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'timestamp'], name='movement_product_time_idx'), models.Index(fields=['timestamp'], name='movement_time_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('stock', models.IntegerField()),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'taken_at'], name='snapshot_product_taken_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'date'), name='unique_product_snapshot_date')],
+            },
+        ),
+        migrations.RunPython(baseline_snapshot, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def initial_valuation(apps, schema_editor):
+    """Seed the buckets and the total from the current products."""
+    from decimal import Decimal
+    from django.db.models import F, Sum, DecimalField, ExpressionWrapper
+    from django.db.models.functions import Coalesce
+
+    Product = apps.get_model('inventory', 'Product')
+    StockValuation = apps.get_model('inventory', 'StockValuation')
+    value = ExpressionWrapper(
+        F('stock') * Coalesce('unit_cost', 'buying_price'),
+        output_field=DecimalField(max_digits=24, decimal_places=4),
+    )
+    rows = [
+        StockValuation(
+            key=f"c:{row['category_id'] or '-'}|s:{row['supplier_id'] or '-'}",
+            category_id=row['category_id'],
+            supplier_id=row['supplier_id'],
+            quantity=row['quantity'],
+            value=row['value'] or Decimal('0'),
+        )
+        for row in Product.objects.filter(stock__gt=0)
+        .values('category_id', 'supplier_id')
+        .annotate(quantity=Sum('stock'), value=Sum(value))
+    ]
+    rows.append(StockValuation(
+        key='total',
+        quantity=sum(row.quantity for row in rows),
+        value=sum((row.value for row in rows), Decimal('0')),
+    ))
+    StockValuation.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockValuation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='inventory.category')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='inventory.supplier')),
+            ],
+        ),
+        migrations.RunPython(initial_valuation, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def flag_low_stock(apps, schema_editor):
+    from django.conf import settings
+
+    Product = apps.get_model('inventory', 'Product')
+    Product.objects.filter(stock__lte=getattr(settings, 'DEFAULT_REORDER_POINT', 3)).update(is_low_stock=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0020_stock_valuation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='reorder_point',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='is_low_stock',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reorder_point',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='StockAlertEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('Low', 'Low'), ('Restocked', 'Restocked')], max_length=20)),
+                ('stock', models.IntegerField(blank=True, null=True)),
+                ('reorder_point', models.IntegerField()),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='inventory.product')),
+            ],
+        ),
+        migrations.RunPython(flag_low_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0021_reorder_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot_number', models.CharField(blank=True, max_length=100, null=True)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.IntegerField()),
+                ('remaining', models.IntegerField()),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.CharField(blank=True, default='User', max_length=255, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots', to='inventory.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LotAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('order_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lot_allocations', to='inventory.orderitem')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='inventory.stocklot')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stocklot',
+            index=models.Index(fields=['product', 'expiry_date'], name='lot_product_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklot',
+            index=models.Index(fields=['expiry_date', 'remaining'], name='lot_expiry_remaining_idx'),
+        ),
+    ]
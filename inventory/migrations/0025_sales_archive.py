@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0024_data_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('data_version', models.PositiveBigIntegerField(default=0)),
+                ('rows', models.JSONField(default=dict)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0025_sales_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplier',
+            name='lead_time_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('avg_7', models.FloatField(default=0)),
+                ('avg_28', models.FloatField(default=0)),
+                ('avg_90', models.FloatField(default=0)),
+                ('trend', models.FloatField(default=0)),
+                ('daily_demand', models.FloatField(default=0)),
+                ('demand_std', models.FloatField(default=0)),
+                ('stock', models.IntegerField(default=0)),
+                ('days_of_cover', models.FloatField(blank=True, null=True)),
+                ('lead_time_days', models.PositiveIntegerField(default=0)),
+                ('reorder_quantity', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='forecast', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['reorder_quantity'], name='forecast_reorder_idx')],
+            },
+        ),
+    ]
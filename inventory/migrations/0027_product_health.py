@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0026_demand_forecast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductHealth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('abc_class', models.CharField(choices=[('A', 'A'), ('B', 'B'), ('C', 'C')], db_index=True, max_length=1)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('cogs', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('quantity_sold', models.IntegerField(default=0)),
+                ('revenue_share', models.FloatField(default=0)),
+                ('cumulative_share', models.FloatField(default=0)),
+                ('stock', models.IntegerField(default=0)),
+                ('stock_value', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('turnover', models.FloatField(blank=True, null=True)),
+                ('days_of_inventory', models.FloatField(blank=True, null=True)),
+                ('last_sale_at', models.DateTimeField(blank=True, null=True)),
+                ('days_since_last_sale', models.IntegerField(blank=True, null=True)),
+                ('is_dead_stock', models.BooleanField(db_index=True, default=False)),
+                ('computed_at', models.DateTimeField()),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='health', to='inventory.product')),
+            ],
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:34
+
+from django.db import migrations, models
+
+
+def initial_counters(apps, schema_editor):
+    """Seed the counters from the current tables (see inventory.counters for the keys)."""
+    from django.db.models import Count
+
+    Counter = apps.get_model('inventory', 'Counter')
+    counted = [
+        ('orders', 'Order', ('status', 'credit', 'receipt', 'payment_status')),
+        ('products', 'Product', ('is_bundle',)),
+        ('customers', 'CustomerInfo', ()),
+        ('suppliers', 'Supplier', ()),
+        ('categories', 'Category', ()),
+    ]
+
+    def label(value):
+        if value is None:
+            return '-'
+        return str(int(value)) if isinstance(value, bool) else str(value)
+
+    rows = []
+    for total, model_name, fields in counted:
+        model = apps.get_model('inventory', model_name)
+        rows.append(Counter(key=total, value=model.objects.count()))
+        for field in fields:
+            for value, count in model.objects.values_list(field).annotate(count=Count('pk')).order_by():
+                rows.append(Counter(key=f'{total}:{field}={label(value)}', value=count))
+    Counter.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0027_product_health'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(initial_counters, migrations.RunPython.noop),
+    ]
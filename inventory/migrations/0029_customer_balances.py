@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def initial_balances(apps, schema_editor):
+    """Seed the balances from the open orders (see inventory.receivables)."""
+    from django.db.models import Count, Q, Sum
+
+    Order = apps.get_model('inventory', 'Order')
+    CustomerBalance = apps.get_model('inventory', 'CustomerBalance')
+    rows = (
+        Order.objects.filter(Q(unpaid_amount__gt=0) & ~Q(status='Cancelled') & ~Q(payment_status='Paid'))
+        .filter(customer__isnull=False)
+        .values('customer_id')
+        .annotate(outstanding=Sum('unpaid_amount'), open_orders=Count('id'))
+        .order_by()
+    )
+    CustomerBalance.objects.bulk_create([CustomerBalance(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0028_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('outstanding', models.DecimalField(db_index=True, decimal_places=2, default=0.0, max_digits=20)),
+                ('open_orders', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', 'customer'], name='order_open_idx'),
+        ),
+        migrations.AddField(
+            model_name='customerbalance',
+            name='customer',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='inventory.customerinfo'),
+        ),
+        migrations.RunPython(initial_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def opening_allocations(apps, schema_editor):
+    """One opening allocation per order and purchase expense already (partly) paid (see inventory.payments)."""
+    from datetime import datetime, time
+
+    from django.utils import timezone
+
+    Order = apps.get_model('inventory', 'Order')
+    PurchaseExpense = apps.get_model('inventory', 'PurchaseExpense')
+    PaymentAllocation = apps.get_model('inventory', 'PaymentAllocation')
+    rows = [
+        PaymentAllocation(order_id=pk, amount=paid, source='opening', user=user, created_at=order_date)
+        for pk, paid, user, order_date in Order.objects.exclude(paid_amount=0).exclude(paid_amount__isnull=True)
+        .values_list('id', 'paid_amount', 'user', 'order_date').iterator(chunk_size=2000)
+    ]
+    rows += [
+        PaymentAllocation(
+            expense_id=pk, amount=paid, source='opening', user=user,
+            created_at=timezone.make_aware(datetime.combine(purchase_date, time.min)),
+        )
+        for pk, paid, user, purchase_date in PurchaseExpense.objects.exclude(paid_amount=0)
+        .exclude(paid_amount__isnull=True).values_list('id', 'paid_amount', 'user', 'purchase_date').iterator(chunk_size=2000)
+    ]
+    PaymentAllocation.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0029_customer_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('Receipt', 'Receipt'), ('Disbursement', 'Disbursement')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('unallocated', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('method', models.CharField(blank=True, max_length=50, null=True)),
+                ('reference', models.CharField(blank=True, max_length=255, null=True)),
+                ('note', models.TextField(blank=True, null=True)),
+                ('paid_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.CharField(blank=True, default='User', max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='inventory.customerinfo')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='inventory.purchasesupplier')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PaymentAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('source', models.CharField(choices=[('payment', 'payment'), ('document', 'document'), ('opening', 'opening'), ('reconcile', 'reconcile')], default='payment', max_length=20)),
+                ('user', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expense', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocations', to='inventory.purchaseexpense')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocations', to='inventory.order')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='inventory.payment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['customer', 'paid_at'], name='payment_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['supplier', 'paid_at'], name='payment_supplier_idx'),
+        ),
+        migrations.RunPython(opening_allocations, migrations.RunPython.noop),
+    ]
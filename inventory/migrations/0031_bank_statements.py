@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0030_payments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('source', models.CharField(blank=True, max_length=50, null=True)),
+                ('line_count', models.IntegerField(default=0)),
+                ('duplicate_count', models.IntegerField(default=0)),
+                ('imported_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.CharField(blank=True, default='User', max_length=255, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatementLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.IntegerField()),
+                ('line_hash', models.CharField(max_length=64, unique=True)),
+                ('transaction_date', models.DateField(blank=True, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('reference', models.CharField(blank=True, max_length=255, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('counterparty', models.CharField(blank=True, max_length=255, null=True)),
+                ('phone', models.CharField(blank=True, max_length=50, null=True)),
+                ('tin_number', models.CharField(blank=True, max_length=50, null=True)),
+                ('status', models.CharField(choices=[('Unmatched', 'Unmatched'), ('Proposed', 'Proposed'), ('Applied', 'Applied')], default='Unmatched', max_length=20)),
+                ('match_kind', models.CharField(blank=True, choices=[('order', 'order'), ('customer', 'customer'), ('expense', 'expense'), ('supplier', 'supplier')], max_length=20, null=True)),
+                ('match_reason', models.CharField(blank=True, max_length=50, null=True)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inventory.customerinfo')),
+                ('expense', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inventory.purchaseexpense')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inventory.order')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='statement_lines', to='inventory.payment')),
+                ('purchase_supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inventory.purchasesupplier')),
+                ('statement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='inventory.bankstatement')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['statement', 'status'], name='statement_line_status_idx')],
+            },
+        ),
+    ]
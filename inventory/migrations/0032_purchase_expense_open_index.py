@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0031_bank_statements'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchaseexpense',
+            index=models.Index(fields=['payment_status', 'supplier_level'], name='expense_open_idx'),
+        ),
+    ]
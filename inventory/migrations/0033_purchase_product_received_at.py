@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0032_purchase_expense_open_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseproduct',
+            name='received_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0033_purchase_product_received_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='costlayer',
+            name='opening',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-19 05:40
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def mark_layered_lines_received(apps, schema_editor):
+    # Lines that got a cost layer when they were linked are counted in the stock already;
+    # receiving them again would add their quantity twice
+    PurchaseProduct = apps.get_model('inventory', 'PurchaseProduct')
+    CostLayer = apps.get_model('inventory', 'CostLayer')
+    first_layer = CostLayer.objects.filter(purchase_product=OuterRef('pk')).order_by('received_at').values('received_at')[:1]
+    PurchaseProduct.objects.filter(received_at__isnull=True, cost_layers__isnull=False).update(received_at=Subquery(first_layer))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0035_background_job_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_layered_lines_received, migrations.RunPython.noop),
+    ]
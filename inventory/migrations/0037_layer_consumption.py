@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-19 05:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0036_received_layered_purchase_lines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayerConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumptions', to='inventory.costlayer')),
+                ('order_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='layer_consumptions', to='inventory.orderitem')),
+            ],
+        ),
+    ]
@@ -2,12 +2,14 @@ from itertools import product
 from django.db import models
 from user.models import UserAccount
 from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, post_init
 from django.db.models import UniqueConstraint
 from django.core.exceptions import ValidationError
 from django.db.models import Sum
 from decimal import Decimal
+from datetime import datetime
 from django.db import transaction
+from django.utils import timezone
 
 
 
@@ -36,6 +38,7 @@ class OrderLog(models.Model):
 
 class Category(models.Model):
     name = models.CharField(max_length=100, default='', unique=True)
+    reorder_point = models.IntegerField(null=True, blank=True)  # default for its products
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
 
     def __str__(self):
@@ -45,6 +48,7 @@ class Supplier(models.Model):
     name = models.CharField(max_length=200, blank=True, null=True)
     contact_info = models.CharField(max_length=50, null=True, blank=True)
     tin_number = models.CharField(max_length=50, null=True, blank=True)
+    lead_time_days = models.PositiveIntegerField(null=True, blank=True)  # falls back to REORDER_LEAD_TIME_DAYS
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
 
     def __str__(self):
@@ -60,7 +64,10 @@ class Product(models.Model):
     buying_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     unit = models.CharField(max_length=255, null=True, blank=True)
     selling_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)  # maintained by the costing engine
     stock = models.IntegerField(null=True, blank=True)
+    reorder_point = models.IntegerField(null=True, blank=True)  # falls back to the category, then DEFAULT_REORDER_POINT
+    is_low_stock = models.BooleanField(default=False, db_index=True)  # maintained by inventory.stock_alerts
     supplier = models.ForeignKey(Supplier, on_delete=models.SET_NULL, null=True, blank=True)
     receipt_no = models.IntegerField(null=True, blank=True)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
@@ -70,6 +77,11 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # Keep the loaded stock/valuation state used by the ledger signals current
+        remember_product_state(Product, self)
+
 class Bundle(models.Model):
     bundle = models.ForeignKey(Product, related_name='bundle_components', on_delete=models.CASCADE)
     
@@ -161,6 +173,14 @@ class Order(models.Model):
     user_role = models.CharField(max_length=255, default="Salesman", null=True, blank=True)
     item_pending = models.PositiveIntegerField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Sales/profit reports filter completed orders by date range
+            models.Index(fields=['status', 'order_date'], name='order_status_date_idx'),
+            # Receivables read the unpaid / pending orders per customer
+            models.Index(fields=['payment_status', 'customer'], name='order_open_idx'),
+        ]
+
     def str(self):
         return self.customer
     
@@ -197,13 +217,14 @@ class OrderItem(models.Model):
         return self.price  # Now it returns the stored price
     
     def get_cost(self):
-        """Calculate the total price of this item."""
-        if self.product.buying_price is not None:
+        """Calculate the total cost of this item from the product's current unit cost."""
+        unit_cost = self.product.unit_cost if self.product.unit_cost is not None else self.product.buying_price
+        if unit_cost is not None:
             if self.package is not None and self.product.piece is not None:
-                cost = self.product.buying_price * (self.package * self.product.piece)
+                cost = unit_cost * (self.package * self.product.piece)
             elif self.quantity is not None:
-                cost = self.product.buying_price * self.quantity
-            return cost
+                cost = unit_cost * self.quantity
+            return Decimal(cost).quantize(Decimal('0.01'))
         else:
             # If buying_price is None, return 0 or handle as needed
             return Decimal('0.00')
@@ -334,7 +355,7 @@ class PurchaseExpense(models.Model):
         ('Unpaid','Unpaid'),
         ('Pending','Pending')
     )
-    purchase_date = models.DateField(auto_now_add=True)
+    purchase_date = models.DateField(default=timezone.localdate)
     supplier = models.CharField(max_length=255, null=True, blank=True)
     number_of_items = models.IntegerField(null=True, blank=True)
     total = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
@@ -344,6 +365,12 @@ class PurchaseExpense(models.Model):
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
     supplier_level = models.ForeignKey(PurchaseSupplier, related_name='expenses', on_delete=models.CASCADE, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Payables aging reads the unpaid / pending expenses per supplier
+            models.Index(fields=['payment_status', 'supplier_level'], name='expense_open_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user}"
 
@@ -355,11 +382,390 @@ class PurchaseProduct(models.Model):
     unit_price = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
     total_price = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
     expense = models.ForeignKey(PurchaseExpense, related_name='products', on_delete=models.CASCADE, null=True, blank=True)
+    linked_product = models.ForeignKey(Product, related_name='purchase_lines', on_delete=models.SET_NULL, null=True, blank=True)
+    received_at = models.DateTimeField(null=True, blank=True)  # set when the line's quantity was added to the product stock (inventory.receiving)
 
     def __str__(self):
         return f"{self.description} - {self.total_price}"
 
 
+class CostLayer(models.Model):
+    product = models.ForeignKey(Product, related_name='cost_layers', on_delete=models.CASCADE)
+    purchase_product = models.ForeignKey(PurchaseProduct, related_name='cost_layers', on_delete=models.CASCADE, null=True, blank=True)
+    received_at = models.DateTimeField()
+    quantity = models.IntegerField()
+    remaining = models.IntegerField()
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4)
+    opening = models.BooleanField(default=False)  # stock on hand before the product's first purchase layer
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'received_at'], name='costlayer_product_received_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} - {self.remaining}/{self.quantity} @ {self.unit_cost}"
+
+
+class LayerConsumption(models.Model):
+    # FIFO quantity an order item took from a cost layer; given back when the item is reduced, cancelled or deleted
+    order_item = models.ForeignKey(OrderItem, related_name='layer_consumptions', on_delete=models.CASCADE)
+    layer = models.ForeignKey(CostLayer, related_name='consumptions', on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.order_item_id} <- layer {self.layer_id} x {self.quantity}"
+
+
+class StockMovement(models.Model):
+    SALE = 'Sale'
+    RETURN = 'Return'
+    PURCHASE = 'Purchase'
+    ADJUSTMENT = 'Adjustment'
+    IMPORT = 'Import'
+    KIND_CHOICES = [
+        (SALE, 'Sale'),
+        (RETURN, 'Return'),
+        (PURCHASE, 'Purchase'),
+        (ADJUSTMENT, 'Adjustment'),
+        (IMPORT, 'Import'),
+    ]
+
+    # Append-only: rows are written by inventory.ledger and never updated
+    product = models.ForeignKey(Product, related_name='movements', on_delete=models.SET_NULL, null=True, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()  # signed change of stock
+    stock_after = models.IntegerField(null=True, blank=True)
+    model_name = models.CharField(max_length=50, null=True, blank=True)
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    user = models.CharField(max_length=255, null=True, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'timestamp'], name='movement_product_time_idx'),
+            models.Index(fields=['timestamp'], name='movement_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity} - {self.product} at {self.timestamp}"
+
+
+class StockSnapshot(models.Model):
+    product = models.ForeignKey(Product, related_name='snapshots', on_delete=models.CASCADE)
+    date = models.DateField()
+    stock = models.IntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['product', 'date'], name='unique_product_snapshot_date'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'taken_at'], name='snapshot_product_taken_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} - {self.stock} on {self.date}"
+
+
+class StockLot(models.Model):
+    product = models.ForeignKey(Product, related_name='lots', on_delete=models.CASCADE)
+    lot_number = models.CharField(max_length=100, null=True, blank=True)
+    expiry_date = models.DateField(null=True, blank=True)
+    quantity = models.IntegerField()
+    remaining = models.IntegerField()
+    received_at = models.DateTimeField(default=timezone.now)
+    user = models.CharField(max_length=255, default="User", null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'expiry_date'], name='lot_product_expiry_idx'),
+            models.Index(fields=['expiry_date', 'remaining'], name='lot_expiry_remaining_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} - {self.lot_number} ({self.remaining}/{self.quantity}) exp {self.expiry_date}"
+
+
+class LotAllocation(models.Model):
+    order_item = models.ForeignKey(OrderItem, related_name='lot_allocations', on_delete=models.CASCADE)
+    lot = models.ForeignKey(StockLot, related_name='allocations', on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.order_item_id} <- {self.lot} x {self.quantity}"
+
+
+class StockAlertEvent(models.Model):
+    LOW = 'Low'
+    RESTOCKED = 'Restocked'
+    KIND_CHOICES = [
+        (LOW, 'Low'),
+        (RESTOCKED, 'Restocked'),
+    ]
+
+    # Appended whenever a product crosses its reorder point; clients poll by id
+    product = models.ForeignKey(Product, related_name='stock_alerts', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    stock = models.IntegerField(null=True, blank=True)
+    reorder_point = models.IntegerField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.kind} - {self.product} ({self.stock}/{self.reorder_point})"
+
+
+class StockValuation(models.Model):
+    # 'total' or one row per category/supplier bucket, maintained by inventory.valuation
+    key = models.CharField(max_length=50, unique=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, null=True, blank=True)
+    quantity = models.BigIntegerField(default=0)
+    value = models.DecimalField(max_digits=24, decimal_places=4, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.quantity} / {self.value}"
+
+
+class Counter(models.Model):
+    # Maintained row count per key ('orders', 'orders:credit=0', 'products:is_bundle=1', ...), see inventory.counters
+    key = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.value}"
+
+
+class BackgroundJob(models.Model):
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    SUCCEEDED = 'Succeeded'
+    FAILED = 'Failed'
+    CANCELLED = 'Cancelled'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    # Picked up by the run_jobs worker command, see inventory.jobs
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    params = models.JSONField(default=dict, blank=True)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    input_file = models.FileField(upload_to='jobs/input/', null=True, blank=True)
+    result_file = models.FileField(upload_to='jobs/results/', null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=255, null=True, blank=True)
+    user = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # lease renewed by the running worker
+    attempts = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class DataVersion(models.Model):
+    # Watermark per data scope ('products', 'customers', 'orders:<date>', 'supplier:<id>'), bumped on change; see inventory.report_cache
+    key = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+
+class ArchivedMonth(models.Model):
+    # A closed month of sales written to Parquet by `manage.py archive_sales`, see inventory.archive
+    month = models.DateField(unique=True)  # first day of the month
+    data_version = models.PositiveBigIntegerField(default=0)  # order data version when it was archived
+    rows = models.JSONField(default=dict)  # table -> rows written
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} ({self.orders} orders)"
+
+
+class DemandForecast(models.Model):
+    # Rebuilt for every product by the demand_forecast job, see inventory.forecast
+    product = models.OneToOneField(Product, related_name='forecast', on_delete=models.CASCADE)
+    avg_7 = models.FloatField(default=0)  # average units sold per day over the last 7/28/90 days
+    avg_28 = models.FloatField(default=0)
+    avg_90 = models.FloatField(default=0)
+    trend = models.FloatField(default=0)  # change in daily demand per day (90-day least squares slope)
+    daily_demand = models.FloatField(default=0)
+    demand_std = models.FloatField(default=0)
+    stock = models.IntegerField(default=0)
+    days_of_cover = models.FloatField(null=True, blank=True)  # empty when nothing is selling
+    lead_time_days = models.PositiveIntegerField(default=0)
+    reorder_quantity = models.IntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['reorder_quantity'], name='forecast_reorder_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.daily_demand:.2f}/day, reorder {self.reorder_quantity}"
+
+
+class ProductHealth(models.Model):
+    # Rebuilt nightly by `manage.py refresh_product_health`, see inventory.health
+    ABC_CHOICES = [('A', 'A'), ('B', 'B'), ('C', 'C')]
+
+    product = models.OneToOneField(Product, related_name='health', on_delete=models.CASCADE)
+    abc_class = models.CharField(max_length=1, choices=ABC_CHOICES, db_index=True)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)  # over the analysis window
+    cogs = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    quantity_sold = models.IntegerField(default=0)
+    revenue_share = models.FloatField(default=0)
+    cumulative_share = models.FloatField(default=0)
+    stock = models.IntegerField(default=0)
+    stock_value = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    turnover = models.FloatField(null=True, blank=True)  # annualised units sold / units on hand
+    days_of_inventory = models.FloatField(null=True, blank=True)
+    last_sale_at = models.DateTimeField(null=True, blank=True)
+    days_since_last_sale = models.IntegerField(null=True, blank=True)
+    is_dead_stock = models.BooleanField(default=False, db_index=True)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.product_id}: {self.abc_class}{' (dead stock)' if self.is_dead_stock else ''}"
+
+
+class CustomerBalance(models.Model):
+    # What a customer owes on open orders, maintained by order signals, see inventory.receivables
+    customer = models.OneToOneField(CustomerInfo, related_name='balance', on_delete=models.CASCADE)
+    outstanding = models.DecimalField(max_digits=20, decimal_places=2, default=0.00, db_index=True)
+    open_orders = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.customer_id}: {self.outstanding} on {self.open_orders} orders"
+
+
+class Payment(models.Model):
+    # Money received from a customer or paid to a supplier, allocated to open documents by inventory.payments
+    RECEIPT = 'Receipt'
+    DISBURSEMENT = 'Disbursement'
+    KIND_CHOICES = [(RECEIPT, RECEIPT), (DISBURSEMENT, DISBURSEMENT)]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    customer = models.ForeignKey(CustomerInfo, related_name='payments', on_delete=models.SET_NULL, null=True, blank=True)
+    supplier = models.ForeignKey(PurchaseSupplier, related_name='payments', on_delete=models.SET_NULL, null=True, blank=True)
+    amount = models.DecimalField(max_digits=20, decimal_places=2)
+    unallocated = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)  # left over once every open document was paid
+    method = models.CharField(max_length=50, null=True, blank=True)
+    reference = models.CharField(max_length=255, null=True, blank=True)
+    note = models.TextField(null=True, blank=True)
+    paid_at = models.DateTimeField(default=timezone.now)
+    user = models.CharField(max_length=255, default="User", null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'paid_at'], name='payment_customer_idx'),
+            models.Index(fields=['supplier', 'paid_at'], name='payment_supplier_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.amount}"
+
+
+class PaymentAllocation(models.Model):
+    # One change of an order's or purchase expense's paid amount; their sum per document is its paid amount
+    PAYMENT = 'payment'      # part of a Payment
+    DOCUMENT = 'document'    # paid amount edited on the order / expense itself
+    OPENING = 'opening'      # paid before allocations were recorded
+    RECONCILE = 'reconcile'  # correction written by `manage.py reconcile_payments`
+    SOURCE_CHOICES = [(PAYMENT, PAYMENT), (DOCUMENT, DOCUMENT), (OPENING, OPENING), (RECONCILE, RECONCILE)]
+
+    payment = models.ForeignKey(Payment, related_name='allocations', on_delete=models.CASCADE, null=True, blank=True)
+    order = models.ForeignKey(Order, related_name='allocations', on_delete=models.SET_NULL, null=True, blank=True)
+    expense = models.ForeignKey(PurchaseExpense, related_name='allocations', on_delete=models.SET_NULL, null=True, blank=True)
+    amount = models.DecimalField(max_digits=20, decimal_places=2)  # negative when a paid amount is reduced
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default=PAYMENT)
+    user = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.amount} to {'order ' + str(self.order_id) if self.order_id else 'expense ' + str(self.expense_id)}"
+
+
+class BankStatement(models.Model):
+    # An imported bank / mobile money statement, reconciled by inventory.statements
+    name = models.CharField(max_length=255, null=True, blank=True)
+    source = models.CharField(max_length=50, null=True, blank=True)  # e.g. the bank or wallet; used as the payment method
+    line_count = models.IntegerField(default=0)
+    duplicate_count = models.IntegerField(default=0)  # lines skipped because an earlier statement had them
+    imported_at = models.DateTimeField(auto_now_add=True)
+    user = models.CharField(max_length=255, default="User", null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.line_count} lines)"
+
+
+class StatementLine(models.Model):
+    UNMATCHED = 'Unmatched'
+    PROPOSED = 'Proposed'
+    APPLIED = 'Applied'
+    STATUS_CHOICES = [(UNMATCHED, UNMATCHED), (PROPOSED, PROPOSED), (APPLIED, APPLIED)]
+
+    # What a line was matched to; 'customer' / 'supplier' pay the party's open documents oldest first
+    ORDER = 'order'
+    CUSTOMER = 'customer'
+    EXPENSE = 'expense'
+    SUPPLIER = 'supplier'
+    MATCH_CHOICES = [(ORDER, ORDER), (CUSTOMER, CUSTOMER), (EXPENSE, EXPENSE), (SUPPLIER, SUPPLIER)]
+
+    statement = models.ForeignKey(BankStatement, related_name='lines', on_delete=models.CASCADE)
+    row = models.IntegerField()
+    line_hash = models.CharField(max_length=64, unique=True)  # the same transfer imported twice is skipped
+    transaction_date = models.DateField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=20, decimal_places=2)  # positive received, negative paid out
+    reference = models.CharField(max_length=255, null=True, blank=True)
+    description = models.TextField(null=True, blank=True)
+    counterparty = models.CharField(max_length=255, null=True, blank=True)
+    phone = models.CharField(max_length=50, null=True, blank=True)
+    tin_number = models.CharField(max_length=50, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=UNMATCHED)
+    match_kind = models.CharField(max_length=20, choices=MATCH_CHOICES, null=True, blank=True)
+    match_reason = models.CharField(max_length=50, null=True, blank=True)
+    customer = models.ForeignKey(CustomerInfo, on_delete=models.SET_NULL, null=True, blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
+    purchase_supplier = models.ForeignKey(PurchaseSupplier, on_delete=models.SET_NULL, null=True, blank=True)
+    expense = models.ForeignKey(PurchaseExpense, on_delete=models.SET_NULL, null=True, blank=True)
+    payment = models.ForeignKey(Payment, related_name='statement_lines', on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['statement', 'status'], name='statement_line_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_date} {self.amount} {self.reference or ''}"
+
+
 class SupplierPaymentLog(models.Model):
     supplier = models.ForeignKey(PurchaseSupplier, on_delete=models.SET_NULL, related_name='logs', null=True, blank=True)
     change_type = models.CharField(max_length=255)
@@ -434,35 +840,42 @@ def update_order_items_status_on_order_update(sender, instance, **kwargs):
 
         items_to_update = []  # List to collect OrderItems for bulk update
 
-        for item_data in items_data:
-            product = item_data.product  # Access related product
-            receipt = item_data.item_receipt  # Access receipt type
-            quantity = item_data.quantity  # Access quantity
-            package = item_data.package  # Access package
-
-
-            if item_data.status != 'Cancelled':  # Check if item is not already cancelled
-                product.stock += item_data.quantity  # Restock the product
-                item_data.quantity = 0 
-                item_data.price = 0
-                item_data.unit_price = 0 
-                item_data.cost = 0
-                item_data.status = 'Cancelled'  # Mark item as cancelled
-                if product.package is not None and package is not None:
-                    product.package += package
-                    item_data.package = 0
-                if receipt == "Receipt":
-                    if product.receipt_no is not None:
-                        product.receipt_no += quantity
-                items_to_update.append(item_data)  # Collect for bulk update
-
-                # Save the updated product and order item
-                product.save()  # Save the updated product
-                # item_data.save()  # Save the updated order item but it causes the multiple save issue
+        from .ledger import stock_movement
+        with stock_movement(StockMovement.RETURN, 'Order', instance.id):
+            for item_data in items_data:
+                product = item_data.product  # Access related product
+                receipt = item_data.item_receipt  # Access receipt type
+                quantity = item_data.quantity  # Access quantity
+                package = item_data.package  # Access package
+
+
+                if item_data.status != 'Cancelled':  # Check if item is not already cancelled
+                    product.stock += item_data.quantity  # Restock the product
+                    item_data.quantity = 0 
+                    item_data.price = 0
+                    item_data.unit_price = 0 
+                    item_data.cost = 0
+                    item_data.status = 'Cancelled'  # Mark item as cancelled
+                    if product.package is not None and package is not None:
+                        product.package += package
+                        item_data.package = 0
+                    if receipt == "Receipt":
+                        if product.receipt_no is not None:
+                            product.receipt_no += quantity
+                    items_to_update.append(item_data)  # Collect for bulk update
+
+                    # Save the updated product and order item
+                    product.save()  # Save the updated product
+                    # item_data.save()  # Save the updated order item but it causes the multiple save issue
 
         # Bulk update all OrderItems at once
         OrderItem.objects.bulk_update(items_to_update, ['quantity', 'status', 'price', 'unit_price', 'cost', 'package'])
 
+        from .lots import release_items
+        release_items(items_to_update)
+        from .costing import release_consumption
+        release_consumption(items_to_update)
+
 @receiver([post_save, post_delete], sender=OrderItem)
 def update_order_item_pending_count(sender, instance, **kwargs):
     order = instance.order
@@ -525,3 +938,368 @@ def update_order_item_count(sender, instance, **kwargs):
     order.number_of_items = items_count
     order.save(update_fields=['number_of_items'])
 
+
+@receiver(post_save, sender=OrderItem)
+def consume_cost_layers_on_sale(sender, instance, **kwargs):
+    """Under FIFO costing a sale takes its quantity off the oldest cost layers, and gives it back when reduced or cancelled."""
+    if instance.product_id:
+        from .costing import sync_consumption
+        sync_consumption(instance)
+
+
+@receiver(pre_delete, sender=OrderItem)
+def release_cost_layers_on_delete(sender, instance, **kwargs):
+    from .costing import release_consumption
+    release_consumption([instance])
+
+
+@receiver(post_save, sender=OrderItem)
+def allocate_lots_on_sale(sender, instance, **kwargs):
+    """Take the item's quantity from the product's lots, earliest expiry first."""
+    from .lots import sync_allocation
+    sync_allocation(instance)
+
+
+@receiver(post_save, sender=PurchaseProduct)
+def sync_cost_layer_on_purchase(sender, instance, created, **kwargs):
+    """Keep the cost layer of a received purchase line in step with the line (layers are added by inventory.receiving)."""
+    from .costing import add_layer, rebuild_costs
+
+    if instance.received_at is None:
+        return
+    layer = instance.cost_layers.first() if not created else None
+    if layer is None:
+        if instance.linked_product_id and instance.quantity and instance.quantity > 0:
+            add_layer(
+                instance.linked_product,
+                instance.quantity,
+                instance.unit_price,
+                received_at=instance.received_at,
+                purchase_product=instance,
+            )
+        return
+
+    affected = {layer.product_id}
+    if instance.linked_product_id is None or not instance.quantity or instance.quantity <= 0:
+        layer.delete()
+    elif (layer.product_id, layer.quantity, layer.unit_cost) != (instance.linked_product_id, instance.quantity, instance.unit_price):
+        layer.product_id = instance.linked_product_id
+        layer.quantity = instance.quantity
+        layer.unit_cost = instance.unit_price
+        layer.save(update_fields=['product', 'quantity', 'unit_cost'])
+        affected.add(instance.linked_product_id)
+    else:
+        return
+    rebuild_costs(affected)
+
+
+@receiver(post_delete, sender=PurchaseProduct)
+def rebuild_costs_on_purchase_delete(sender, instance, **kwargs):
+    if instance.linked_product_id:
+        from .costing import rebuild_costs
+        rebuild_costs([instance.linked_product_id])
+
+
+@receiver(post_init, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    # Deferred fields are left alone so .only()/.defer() querysets stay one query
+    from .valuation import product_state
+    instance._loaded_stock = instance.__dict__.get('stock')
+    instance._loaded_valuation = product_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def record_stock_movement(sender, instance, created, **kwargs):
+    """Write the stock change of every product save to the movement ledger."""
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'stock' not in update_fields:
+        return
+    if not created and 'stock' not in instance.__dict__:
+        return
+    from .ledger import record_product_change
+
+    record_product_change(instance, 0 if created else instance._loaded_stock)
+    instance._loaded_stock = instance.stock
+
+
+@receiver(pre_save, sender=Product)
+def remember_stored_valuation(sender, instance, **kwargs):
+    # A partially loaded instance does not know its old figures: read them from the row
+    instance._stored_valuation = None
+    if instance.pk and not instance._state.adding and getattr(instance, '_loaded_valuation', None) is None:
+        from .valuation import stored_state
+        instance._stored_valuation = stored_state(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_stock_valuation(sender, instance, created, **kwargs):
+    """Move the maintained valuation by the change in this product's stock x cost."""
+    from .valuation import apply_product_changes, product_state, stored_state
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'category', 'supplier', 'stock', 'unit_cost', 'buying_price'} & set(update_fields):
+        return
+    new_state = product_state(instance) or stored_state(instance.pk)
+    old_state = None if created else (instance._loaded_valuation or instance._stored_valuation)
+    apply_product_changes([(old_state, new_state)])
+    instance._loaded_valuation = product_state(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_stock_valuation(sender, instance, **kwargs):
+    from .valuation import apply_product_changes, product_state
+    apply_product_changes([(product_state(instance), None)])
+
+
+@receiver([pre_delete], sender=Category)
+@receiver([pre_delete], sender=Supplier)
+def remember_valuation_buckets(sender, instance, **kwargs):
+    # The bucket rows go with the category / supplier (CASCADE)
+    from .valuation import bucket_rows
+    field = 'category_id' if sender is Category else 'supplier_id'
+    instance._valuation_buckets = bucket_rows(**{field: instance.pk})
+
+
+@receiver([post_delete], sender=Category)
+@receiver([post_delete], sender=Supplier)
+def move_valuation_buckets(sender, instance, **kwargs):
+    # Products were moved to the empty bucket by SET_NULL without signals: so do their figures
+    from .valuation import move_bucket_rows
+    field = 'category_id' if sender is Category else 'supplier_id'
+    move_bucket_rows(getattr(instance, '_valuation_buckets', []), **{field: None})
+
+
+@receiver(post_save, sender=Product)
+def update_low_stock_flag(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'stock', 'reorder_point', 'category'} & set(update_fields):
+        return
+    from .stock_alerts import sync_low_stock
+    sync_low_stock(instance)
+
+
+@receiver(post_save, sender=Category)
+def refresh_low_stock_on_category_change(sender, instance, created, **kwargs):
+    """A category reorder point applies to its products that have none of their own."""
+    if created:
+        return
+    from .stock_alerts import refresh_low_stock
+    refresh_low_stock(instance.product_set.filter(reorder_point__isnull=True))
+
+
+@receiver([post_save, post_delete], sender=Report)
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderItem)
+def bump_order_report_version(sender, instance, **kwargs):
+    # Order data is versioned per (local) order day; the sales archive relies on this as well
+    from .report_cache import bump, order_day_key
+    if sender is OrderItem:
+        order = instance._state.fields_cache.get('order')
+        order_date = order.order_date if order is not None else (
+            Order.objects.filter(pk=instance.order_id).values_list('order_date', flat=True).first()
+        )
+    else:
+        order_date = instance.order_date
+    if isinstance(order_date, datetime):
+        order_date = timezone.localdate(order_date)
+    if order_date:
+        bump(order_day_key(order_date))
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def bump_product_report_version(sender, instance, **kwargs):
+    from .report_cache import bump, PRODUCTS
+    bump(PRODUCTS)
+
+
+@receiver([post_save, post_delete], sender=CustomerInfo)
+def bump_customer_version(sender, instance, **kwargs):
+    from .report_cache import bump, CUSTOMERS
+    bump(CUSTOMERS)
+
+
+@receiver([post_save, post_delete], sender=Supplier)
+def bump_supplier_name_versions(sender, instance, **kwargs):
+    # The supplier name shows up in the product report and in its purchase supplier's report
+    from .report_cache import bump, supplier_key, PRODUCTS
+    purchase_supplier_ids = PurchaseSupplier.objects.filter(supplier_id=instance.pk).values_list('id', flat=True)
+    bump(PRODUCTS, *[supplier_key(pk) for pk in purchase_supplier_ids])
+
+
+@receiver([post_save, post_delete], sender=PurchaseSupplier)
+@receiver([post_save, post_delete], sender=PurchaseExpense)
+@receiver([post_save, post_delete], sender=PurchaseProduct)
+@receiver([post_save, post_delete], sender=SupplierPaymentLog)
+@receiver([post_save, post_delete], sender=ExpensePaymentLog)
+def bump_supplier_report_version(sender, instance, **kwargs):
+    from .report_cache import bump, supplier_key
+    if sender is PurchaseSupplier:
+        supplier_id = instance.pk
+    elif sender is PurchaseExpense:
+        supplier_id = instance.supplier_level_id
+    elif sender is SupplierPaymentLog:
+        supplier_id = instance.supplier_id
+    else:
+        supplier_id = (
+            PurchaseExpense.objects.filter(pk=instance.expense_id).values_list('supplier_level_id', flat=True).first()
+            if instance.expense_id else None
+        )
+    if supplier_id:
+        bump(supplier_key(supplier_id))
+
+
+@receiver(post_init, sender=Order)
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=CustomerInfo)
+@receiver(post_init, sender=Supplier)
+@receiver(post_init, sender=Category)
+def remember_counted_state(sender, instance, **kwargs):
+    from .counters import instance_state
+    instance._loaded_counters = instance_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=CustomerInfo)
+@receiver(post_save, sender=Supplier)
+@receiver(post_save, sender=Category)
+def update_counters(sender, instance, created, **kwargs):
+    """Move the maintained row counts (inventory.counters) with this row."""
+    from .counters import COUNTED, instance_state, rebuild_counters, track
+
+    update_fields = kwargs.get('update_fields')
+    if not created and update_fields is not None and not set(COUNTED[sender][1]) & set(update_fields):
+        return
+    new_state = instance_state(instance)
+    old_state = None if created else getattr(instance, '_loaded_counters', None)
+    if new_state is None or (old_state is None and not created):
+        # Saved from a partially loaded instance: the previous values are unknown
+        rebuild_counters([sender])
+    elif old_state != new_state:
+        track(sender, old_state, new_state)
+    instance._loaded_counters = new_state
+
+
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=CustomerInfo)
+@receiver(post_delete, sender=Supplier)
+@receiver(post_delete, sender=Category)
+def remove_from_counters(sender, instance, **kwargs):
+    from .counters import instance_state, rebuild_counters, track
+    state = getattr(instance, '_loaded_counters', None) or instance_state(instance)
+    if state is None:
+        rebuild_counters([sender])
+    else:
+        track(sender, state, None)
+
+
+@receiver(post_init, sender=Order)
+def remember_receivable_state(sender, instance, **kwargs):
+    from .receivables import receivable_state
+    instance._loaded_receivable = receivable_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Order)
+def update_customer_balance(sender, instance, created, **kwargs):
+    """Move the customer's maintained balance (inventory.receivables) by the change in this order's open amount."""
+    from .receivables import apply_order_changes, rebuild_customer_balances, receivable_state
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'customer', 'status', 'payment_status', 'unpaid_amount'} & set(update_fields):
+        return
+    new_state = receivable_state(instance)
+    old_state = None if created else getattr(instance, '_loaded_receivable', None)
+    if new_state is None or (old_state is None and not created):
+        # Saved from a partially loaded instance: the previous customer and amount are unknown
+        rebuild_customer_balances()
+    else:
+        apply_order_changes([(old_state, new_state)])
+    instance._loaded_receivable = new_state
+
+
+@receiver(post_delete, sender=Order)
+def remove_from_customer_balance(sender, instance, **kwargs):
+    # Deleting the items first re-saves the order through other instances, so this
+    # instance's amount may be stale: recount the customer from what is left instead
+    from .receivables import rebuild_customer_balances
+    state = getattr(instance, '_loaded_receivable', None)
+    customer_id = state[0] if state else instance.__dict__.get('customer_id')
+    if customer_id:
+        rebuild_customer_balances([customer_id])
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=PurchaseExpense)
+def record_payment_allocation(sender, instance, **kwargs):
+    """Keep the document's allocations (inventory.payments) summing to its paid amount."""
+    from .payments import record_paid_change
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'paid_amount' not in update_fields:
+        return
+    record_paid_change(instance)
+
+
+@receiver(pre_save, sender=PurchaseProduct)
+@receiver(pre_delete, sender=PurchaseProduct)
+def remember_stored_line(sender, instance, **kwargs):
+    # Read from the row, not post_init: the purchase flows save a line through several instances
+    from .purchase_totals import deleted_directly
+    if instance.pk and ('origin' not in kwargs or deleted_directly(PurchaseProduct, kwargs['origin'])):
+        instance._stored_line = PurchaseProduct.objects.filter(pk=instance.pk).values_list('expense_id', 'total_price').first()
+    else:
+        instance._stored_line = None
+
+
+@receiver(post_save, sender=PurchaseProduct)
+def update_expense_total(sender, instance, **kwargs):
+    """Move the expense and supplier totals (inventory.purchase_totals) by the change in this line."""
+    from .purchase_totals import money, record_line_change
+    old_expense_id, old_total = getattr(instance, '_stored_line', None) or (None, 0)
+    if old_expense_id and old_expense_id != instance.expense_id:
+        record_line_change(old_expense_id, -money(old_total))
+        old_total = 0
+    if instance.expense_id:
+        record_line_change(instance.expense_id, money(instance.total_price) - money(old_total))
+
+
+@receiver(post_delete, sender=PurchaseProduct)
+def remove_from_expense_total(sender, instance, origin=None, **kwargs):
+    # Lines deleted with their expense or supplier leave nothing to update
+    from .purchase_totals import deleted_directly, money, record_line_change
+    stored = getattr(instance, '_stored_line', None)
+    if stored and stored[0] and deleted_directly(PurchaseProduct, origin):
+        record_line_change(stored[0], -money(stored[1]))
+
+
+@receiver(pre_save, sender=PurchaseExpense)
+@receiver(pre_delete, sender=PurchaseExpense)
+def remember_stored_expense(sender, instance, **kwargs):
+    from .purchase_totals import EXPENSE_FIELDS, deleted_directly, stored_expense
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'supplier_level', *EXPENSE_FIELDS} & set(update_fields):
+        instance._stored_expense = False
+    elif instance.pk and ('origin' not in kwargs or deleted_directly(PurchaseExpense, kwargs['origin'])):
+        instance._stored_expense = stored_expense(instance.pk)
+    else:
+        instance._stored_expense = None
+
+
+@receiver(post_save, sender=PurchaseExpense)
+def update_supplier_totals(sender, instance, **kwargs):
+    """Move the purchase supplier's amounts (inventory.purchase_totals) by the change in this expense."""
+    from .purchase_totals import apply_supplier_changes, expense_changes, expense_row, stored_expense
+    stored = getattr(instance, '_stored_expense', None)
+    if stored is False:
+        return
+    # The new amounts are read back too: line changes may have moved the row under this instance
+    apply_supplier_changes(expense_changes(stored, stored_expense(instance.pk) or expense_row(instance)))
+
+
+@receiver(post_delete, sender=PurchaseExpense)
+def remove_from_supplier_totals(sender, instance, origin=None, **kwargs):
+    from .purchase_totals import apply_supplier_changes, deleted_directly, expense_changes
+    stored = getattr(instance, '_stored_expense', None)
+    if stored and deleted_directly(PurchaseExpense, origin):
+        apply_supplier_changes(expense_changes(stored, None))
@@ -0,0 +1,105 @@
+"""
+Accounts payable: what is still owed to purchase suppliers.
+
+A purchase expense is open while it is not marked Paid and has an unpaid
+amount. `aging` splits the open amounts of every purchase supplier by purchase
+age (the buckets of inventory.receivables) in one grouped query over the open
+expenses, which the (payment_status, supplier_level) index narrows down.
+`aging_totals` sums the same buckets over every supplier.
+
+The rows are paged with a cursor on the sort column rather than page numbers
+(see PayablesAgingAPIView), so a page does not need a count of the groups and
+does not repeat or skip suppliers when balances change between requests.
+
+`supplier_report_payload` is the data behind the supplier report, shared by
+SupplierReportView and the background export (inventory.tasks). The expenses
+are filtered to the date range before their products and logs are
+prefetched, so the prefetch covers exactly the rows that are serialized.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, When
+from django.utils import timezone
+
+from .models import PurchaseExpense, SupplierPaymentLog
+from .receivables import AGING_BUCKETS, MONEY
+
+
+ZERO = Decimal('0.00')
+
+OPEN_EXPENSES = Q(unpaid_amount__gt=0) & ~Q(payment_status='Paid')
+
+# Columns the aging can be sorted by (prefix '-' for descending)
+ORDERING_FIELDS = ('total', *(name for name, _, _ in AGING_BUCKETS), 'open_expenses', 'oldest_purchase')
+DEFAULT_ORDERING = '-total'
+
+
+def open_expenses(purchase_supplier_id=None):
+    expenses = PurchaseExpense.objects.filter(OPEN_EXPENSES)
+    if purchase_supplier_id is not None:
+        expenses = expenses.filter(supplier_level_id=purchase_supplier_id)
+    return expenses
+
+
+def supplier_report_payload(supplier, start_date=None, end_date=None):
+    """The supplier, its payment logs and its expenses (purchased within the dates when both are given)."""
+    expenses = PurchaseExpense.objects.filter(supplier_level=supplier)
+    if start_date and end_date:
+        expenses = expenses.filter(purchase_date__range=(start_date, end_date))
+    return {
+        "supplier": supplier,
+        "payment_logs": SupplierPaymentLog.objects.filter(supplier_id=supplier.pk).order_by('-timestamp'),
+        "expenses": expenses.prefetch_related("products", "logs"),
+    }
+
+
+def _bucket_filters(today):
+    """{bucket: Q} on purchase_date, so that a purchase `n` days old falls in the bucket covering n."""
+    filters = {}
+    for name, first, last in AGING_BUCKETS:
+        age = Q()
+        if first:
+            age &= Q(purchase_date__lte=today - timedelta(days=first))
+        if last is not None:
+            age &= Q(purchase_date__gt=today - timedelta(days=last + 1))
+        filters[name] = age
+    return filters
+
+
+def _aging_sums(today):
+    sums = {
+        name: Sum(Case(When(age, then=F('unpaid_amount')), default=ZERO, output_field=MONEY))
+        for name, age in _bucket_filters(today).items()
+    }
+    return {**sums, 'total': Sum('unpaid_amount'), 'open_expenses': Count('id')}
+
+
+def ordering(value=None):
+    """The aging ordering for a ?ordering value, with the supplier id as tie-breaker. Raises ValueError."""
+    value = value or DEFAULT_ORDERING
+    if value.lstrip('-') not in ORDERING_FIELDS:
+        raise ValueError(f"ordering must be one of {', '.join(ORDERING_FIELDS)}, optionally prefixed with '-'.")
+    return value, 'supplier_level_id'
+
+
+def aging(purchase_supplier_id=None, today=None):
+    """
+    Open amounts per purchase supplier split by purchase age, as a values
+    queryset (one grouped query; order and page it). Expenses without a
+    supplier are grouped under supplier None.
+    """
+    today = today or timezone.localdate()
+    return (
+        open_expenses(purchase_supplier_id)
+        .values('supplier_level_id', 'supplier_level__supplier__name')
+        .annotate(**_aging_sums(today), oldest_purchase=Min('purchase_date'), latest_purchase=Max('purchase_date'))
+        .order_by()
+    )
+
+
+def aging_totals(purchase_supplier_id=None, today=None):
+    """The aging buckets summed over every purchase supplier."""
+    today = today or timezone.localdate()
+    totals = open_expenses(purchase_supplier_id).aggregate(**_aging_sums(today))
+    return {key: value if value is not None else ZERO for key, value in totals.items()}
@@ -0,0 +1,301 @@
+"""
+Payments and their allocation to orders and purchase expenses.
+
+A Payment is money received from a customer or paid to a supplier. It is
+allocated to the party's open documents (orders, or the purchase expenses of a
+purchase supplier), oldest first, in one transaction: the documents are locked
+in that order, their paid / unpaid amounts and payment status are written with
+one bulk UPDATE, and one PaymentAllocation per document records the amount.
+Whatever is left once every open document is paid stays on the payment as
+`unallocated`. Several payments (a statement import) are written in one go. Bulk updates skip the model signals, so the customer balances,
+row counters, report versions and payment logs are updated here.
+
+PaymentAllocation is also the ledger of every other change of a paid amount:
+after a save that may change `paid_amount`, the Order and PurchaseExpense
+signals write the difference between the stored paid amount and the sum of the
+document's allocations (source 'document'). Serializers wrap their work in
+`payment_capture()`, which settles the documents once at the end of the
+request instead of after each of their saves. The allocations of a document
+therefore sum to its paid amount, which `reconcile_payments` checks.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from . import counters
+from .models import (
+    ExpensePaymentLog, Order, OrderPaymentLog, Payment, PaymentAllocation, PurchaseExpense,
+    SupplierPaymentLog,
+)
+from .purchase_totals import apply_supplier_changes
+from .receivables import apply_order_changes, open_orders, receivable_state
+from .report_cache import bump, order_day_key
+
+
+ZERO = Decimal('0.00')
+BATCH_SIZE = 500
+
+_capture = ContextVar('payment_capture', default=None)
+
+
+def money(value):
+    return Decimal(str(value or 0)).quantize(ZERO)
+
+
+@contextmanager
+def payment_capture(user=None):
+    """
+    Collect the orders and expenses whose paid amount is saved inside the
+    block and bring their allocations in line once it ends, one row per
+    document however often it was saved. Works as a decorator too; nested
+    blocks add to the outermost one.
+    """
+    if _capture.get() is not None:
+        yield _capture.get()
+        return
+    pending = {'user': user, 'order': set(), 'expense': set()}
+    token = _capture.set(pending)
+    try:
+        yield pending
+    finally:
+        _capture.reset(token)
+    for field in ('order', 'expense'):
+        sync_allocations(field, pending[field], PaymentAllocation.DOCUMENT, pending['user'])
+
+
+def record_paid_change(document):
+    """Called by the Order / PurchaseExpense post_save signals when the paid amount may have changed."""
+    field = 'order' if isinstance(document, Order) else 'expense'
+    pending = _capture.get()
+    if pending is not None:
+        pending[field].add(document.pk)
+    else:
+        sync_allocations(field, [document.pk], PaymentAllocation.DOCUMENT)
+
+
+def sync_allocations(field, ids, source, user=None):
+    """
+    Write one allocation per document of `ids` ('order' or 'expense') whose
+    allocations do not add up to its paid amount, for the difference. The
+    paid amounts are read back from the table, so documents saved several
+    times or through several instances are settled once. Without `user` the
+    rows take the document's user.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    model = Order if field == 'order' else PurchaseExpense
+    allocated = allocated_totals(field, ids)
+    rows = []
+    for pk, paid, saved_by in model.objects.filter(pk__in=ids).values_list('pk', 'paid_amount', 'user'):
+        difference = money(paid) - money(allocated.get(pk))
+        if difference:
+            rows.append(PaymentAllocation(
+                **{f'{field}_id': pk}, amount=difference, source=source, user=user or saved_by,
+            ))
+    return PaymentAllocation.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def _allocate(documents, amount, total_field):
+    """
+    Spread `amount` over `documents` in order. Returns [(document, allocated,
+    old paid)] for the documents it reached and what is left.
+    """
+    remaining, touched = amount, []
+    for document in documents:
+        if remaining <= 0:
+            break
+        unpaid = money(document.unpaid_amount)
+        allocated = min(unpaid, remaining)
+        if allocated <= 0:
+            continue
+        touched.append((document, allocated, money(document.paid_amount)))
+        document.paid_amount = money(document.paid_amount) + allocated
+        document.unpaid_amount = max(money(getattr(document, total_field)) - document.paid_amount, ZERO)
+        document.payment_status = 'Paid' if document.unpaid_amount == ZERO else 'Pending'
+        remaining -= allocated
+    return touched, remaining
+
+
+def _clean_entries(entries):
+    entries = [(party, money(amount), details or {}, ids) for party, amount, details, ids in entries]
+    if any(amount <= 0 for _, amount, _, _ in entries):
+        raise ValueError("The payment amount must be positive.")
+    return entries
+
+
+def _create_payments(payments):
+    if connection.features.can_return_rows_from_bulk_insert:
+        Payment.objects.bulk_create(payments, batch_size=BATCH_SIZE)
+    else:
+        # The allocations need the payment ids
+        for payment in payments:
+            payment.save()
+
+
+def allocate_customer_payments(entries, user=None):
+    """
+    Record several customer payments in one transaction. `entries` are
+    (customer, amount, details, order ids): `details` are Payment fields
+    (method, reference, note, paid_at) and order ids, unless None, limit the
+    payment to those orders. Each payment settles the customer's open orders
+    oldest first, after the payments before it in `entries`. Returns the
+    Payments in the same order.
+    """
+    entries = _clean_entries(entries)
+    with transaction.atomic():
+        orders = list(
+            open_orders().filter(customer_id__in={customer.pk for customer, *_ in entries})
+            .select_for_update().order_by('order_date', 'id')
+        )
+        old_states = {order.pk: (receivable_state(order), counters.instance_state(order)) for order in orders}
+        by_customer = defaultdict(list)
+        for order in orders:
+            by_customer[order.customer_id].append(order)
+
+        payments, touched = [], []
+        for customer, amount, details, order_ids in entries:
+            payment = Payment(kind=Payment.RECEIPT, customer=customer, amount=amount, user=user, **details)
+            candidates = [order for order in by_customer[customer.pk] if order_ids is None or order.pk in order_ids]
+            reached, payment.unallocated = _allocate(candidates, amount, 'total_amount')
+            payments.append(payment)
+            touched.extend((payment, *row) for row in reached)
+        _create_payments(payments)
+
+        updated = list({order.pk: order for _, order, _, _ in touched}.values())
+        Order.objects.bulk_update(updated, ['paid_amount', 'unpaid_amount', 'payment_status'], batch_size=BATCH_SIZE)
+        PaymentAllocation.objects.bulk_create([
+            PaymentAllocation(payment=payment, order=order, amount=allocated, user=user, created_at=payment.paid_at)
+            for payment, order, allocated, _ in touched
+        ], batch_size=BATCH_SIZE)
+        OrderPaymentLog.objects.bulk_create([
+            OrderPaymentLog(
+                order=order, customer=payment.customer.name, change_type="Payment Allocation",
+                field_name="paid_amount", old_value=old_paid, new_value=old_paid + allocated, user=user,
+            )
+            for payment, order, allocated, old_paid in touched
+        ], batch_size=BATCH_SIZE)
+
+        # Bulk updates skip the order signals
+        apply_order_changes([(old_states[order.pk][0], receivable_state(order)) for order in updated])
+        counters.track_changes(Order, [(old_states[order.pk][1], counters.instance_state(order)) for order in updated])
+        for order in updated:
+            order._loaded_receivable = receivable_state(order)
+            order._loaded_counters = counters.instance_state(order)
+        bump(*{order_day_key(timezone.localdate(order.order_date)) for order in updated})
+    return payments
+
+
+def allocate_customer_payment(customer, amount, user=None, **details):
+    """Record `amount` received from `customer` and settle their open orders, oldest first. Returns the Payment."""
+    return allocate_customer_payments([(customer, amount, details, None)], user=user)[0]
+
+
+def refresh_supplier_totals(touched, old_unpaid, user=None):
+    """
+    Move the purchase suppliers' amounts (inventory.purchase_totals) by what
+    the allocations `touched` changed on their expenses and log the paid change.
+    """
+    changes, expenses = defaultdict(lambda: [ZERO, ZERO, ZERO]), {}
+    for _, expense, allocated, _ in touched:
+        changes[expense.supplier_level_id][1] += allocated
+        expenses[expense.pk] = expense
+    for expense in expenses.values():
+        changes[expense.supplier_level_id][2] += money(expense.unpaid_amount) - old_unpaid[expense.pk]
+    paid = apply_supplier_changes({pk: tuple(change) for pk, change in changes.items()})
+    SupplierPaymentLog.objects.bulk_create([
+        SupplierPaymentLog(
+            supplier_id=pk, change_type="Payment Allocation", field_name="paid_amount",
+            old_value=str(old_paid), new_value=str(new_paid), user=user,
+        )
+        for pk, (old_paid, new_paid) in paid.items()
+    ], batch_size=BATCH_SIZE)
+
+
+def allocate_supplier_payments(entries, user=None):
+    """
+    Record several payments to purchase suppliers in one transaction, as
+    `allocate_customer_payments` does for customers: `entries` are
+    (purchase supplier, amount, details, expense ids) and each payment settles
+    the supplier's open purchase expenses oldest purchase first. The supplier
+    totals are then moved by the change in their expenses. Returns the Payments.
+    """
+    entries = _clean_entries(entries)
+    with transaction.atomic():
+        expenses = list(
+            PurchaseExpense.objects.select_for_update()
+            .filter(supplier_level__in={supplier.pk for supplier, *_ in entries}, unpaid_amount__gt=0)
+            .exclude(payment_status='Paid')
+            .order_by('purchase_date', 'id')
+        )
+        by_supplier = defaultdict(list)
+        old_unpaid = {}
+        for expense in expenses:
+            by_supplier[expense.supplier_level_id].append(expense)
+            old_unpaid[expense.pk] = money(expense.unpaid_amount)
+
+        payments, touched = [], []
+        for purchase_supplier, amount, details, expense_ids in entries:
+            payment = Payment(kind=Payment.DISBURSEMENT, supplier=purchase_supplier, amount=amount, user=user, **details)
+            candidates = [
+                expense for expense in by_supplier[purchase_supplier.pk] if expense_ids is None or expense.pk in expense_ids
+            ]
+            reached, payment.unallocated = _allocate(candidates, amount, 'total')
+            payments.append(payment)
+            touched.extend((payment, *row) for row in reached)
+        _create_payments(payments)
+
+        updated = list({expense.pk: expense for _, expense, _, _ in touched}.values())
+        PurchaseExpense.objects.bulk_update(updated, ['paid_amount', 'unpaid_amount', 'payment_status'], batch_size=BATCH_SIZE)
+        PaymentAllocation.objects.bulk_create([
+            PaymentAllocation(payment=payment, expense=expense, amount=allocated, user=user, created_at=payment.paid_at)
+            for payment, expense, allocated, _ in touched
+        ], batch_size=BATCH_SIZE)
+        ExpensePaymentLog.objects.bulk_create([
+            ExpensePaymentLog(
+                expense=expense, supplier=expense.supplier, change_type="Payment Allocation", field_name="paid_amount",
+                old_value=str(old_paid), entered_value=str(allocated), new_value=str(old_paid + allocated), user=user,
+            )
+            for _, expense, allocated, old_paid in touched
+        ], batch_size=BATCH_SIZE)
+        refresh_supplier_totals(touched, old_unpaid, user=user)
+    return payments
+
+
+def allocate_supplier_payment(purchase_supplier, amount, user=None, **details):
+    """Record `amount` paid to `purchase_supplier` and settle its open purchase expenses, oldest first. Returns the Payment."""
+    return allocate_supplier_payments([(purchase_supplier, amount, details, None)], user=user)[0]
+
+
+def allocated_totals(field, ids=None):
+    """{document id: sum of its allocations} for field 'order' or 'expense', one grouped query."""
+    allocations = PaymentAllocation.objects.filter(**{f'{field}__isnull': False})
+    if ids is not None:
+        allocations = allocations.filter(**{f'{field}_id__in': ids})
+    return dict(allocations.values_list(f'{field}_id').annotate(total=Sum('amount')).order_by())
+
+
+def payment_drift(field):
+    """[(document id, paid amount, allocated)] for the documents whose allocations do not add up."""
+    model = Order if field == 'order' else PurchaseExpense
+    allocated = allocated_totals(field)
+    documents = model.objects.filter(Q(paid_amount__gt=0) | Q(paid_amount__lt=0) | Q(pk__in=list(allocated)))
+    drift = []
+    for pk, paid in documents.values_list('pk', 'paid_amount').iterator(chunk_size=2000):
+        if money(paid) != money(allocated.get(pk)):
+            drift.append((pk, money(paid), money(allocated.get(pk))))
+    return drift
+
+
+def reconcile_payments(fix=False):
+    """Documents whose allocations drifted from their paid amount; with `fix`, write correcting allocations."""
+    drift = {field: payment_drift(field) for field in ('order', 'expense')}
+    if fix:
+        for field, rows in drift.items():
+            sync_allocations(field, [pk for pk, _, _ in rows], PaymentAllocation.RECONCILE, 'reconcile')
+    return drift
@@ -0,0 +1,168 @@
+"""
+Pivot tables over sales facts.
+
+The completed order lines of a date window are loaded once into a pandas
+DataFrame (one row per line; money as integer cents so sums stay exact) and
+kept in a small in-process LRU keyed by the window, so every pivot over the
+same slice reuses it; a frame loaded at an older data version is dropped the
+first time the window is asked for again. Pivots are plain vectorised
+groupby/unstack calls on that frame. The API response itself is cached on
+disk per data version by inventory.report_cache.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+from threading import Lock
+
+import pandas as pd
+from django.conf import settings
+
+from .analytics import sales_items
+from .report_cache import CUSTOMERS, PRODUCTS, data_version, order_window_keys
+
+
+# Each dimension is a column of the fact frame ('period' is derived from order_date per request)
+DIMENSIONS = ('product', 'category', 'customer', 'zone', 'city', 'user', 'receipt', 'period')
+MEASURES = ('quantity', 'revenue', 'cost', 'profit')
+PERIODS = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+FACT_COLUMNS = {
+    'order_id': 'order_id',
+    'order__order_date': 'order_date',
+    'product__name': 'product_name',
+    'product__specification': 'specification',
+    'product__category__name': 'category',
+    'order__customer__name': 'customer',
+    'order__customer__zone': 'zone',
+    'order__customer__city': 'city',
+    'order__user': 'user',
+    'order__receipt': 'receipt',
+    'quantity': 'quantity',
+    'price': 'revenue',
+    'cost': 'cost',
+}
+
+CHUNK_SIZE = 5000
+FRAME_CACHE_SIZE = 4
+
+_frames = OrderedDict()  # (start, end) -> (data version, frame)
+_frames_lock = Lock()
+
+
+def version_keys(start, end):
+    return order_window_keys(start, end) + [PRODUCTS, CUSTOMERS]
+
+
+def _cents(series):
+    return (pd.to_numeric(series, errors='coerce').fillna(0) * 100).round().astype('int64')
+
+
+def load_facts(start, end):
+    """Completed order lines of start..end as a DataFrame (one query, fetched in chunks)."""
+    items = sales_items(start=start, end=end)
+    rows = items.values_list(*FACT_COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+    facts = pd.DataFrame.from_records(rows, columns=list(FACT_COLUMNS.values()))
+
+    facts['order_date'] = pd.to_datetime(facts['order_date'], utc=True).dt.tz_convert(settings.TIME_ZONE)
+    facts['quantity'] = pd.to_numeric(facts['quantity'], errors='coerce').fillna(0).astype('int64')
+    facts['revenue'] = _cents(facts['revenue'])
+    facts['cost'] = _cents(facts['cost'])
+    facts['profit'] = facts['revenue'] - facts['cost']
+
+    specification = facts['specification'].fillna('')
+    facts['product'] = facts['product_name'].fillna('(deleted product)').where(
+        specification == '', facts['product_name'].fillna('') + ' (' + specification + ')'
+    )
+    for column in ('product', 'category', 'customer', 'zone', 'city', 'user', 'receipt'):
+        facts[column] = facts[column].fillna('(none)').astype('category')
+    return facts.drop(columns=['product_name', 'specification'])
+
+
+def facts_for(start, end):
+    """The fact frame for start..end, loaded at most once per data version."""
+    window, version = (start, end), data_version(version_keys(start, end))
+    with _frames_lock:
+        cached = _frames.get(window)
+        if cached is not None and cached[0] == version:
+            _frames.move_to_end(window)
+            return cached[1]
+        # The window's data changed since it was loaded: drop the stale frame now
+        _frames.pop(window, None)
+    facts = load_facts(start, end)
+    with _frames_lock:
+        _frames[window] = (version, facts)
+        _frames.move_to_end(window)
+        while len(_frames) > FRAME_CACHE_SIZE:
+            _frames.popitem(last=False)
+    return facts
+
+
+def _with_period(facts, period):
+    facts = facts.copy(deep=False)
+    periods = facts['order_date'].dt.tz_localize(None).dt.to_period(PERIODS[period])
+    if period == 'week':
+        facts['period'] = periods.dt.start_time.dt.strftime('%Y-%m-%d')
+    else:
+        facts['period'] = periods.astype(str)
+    return facts
+
+
+def _money(cents):
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+
+def _measure_values(row, measures):
+    return {measure: int(row[measure]) if measure == 'quantity' else _money(row[measure]) for measure in measures}
+
+
+def pivot(facts, rows, columns=(), measures=MEASURES, period='month'):
+    """
+    Aggregate `facts` by the `rows` dimensions, spread over the `columns`
+    dimensions when given. Returns the row results, per-column totals and the
+    grand total.
+    """
+    rows, columns, measures = list(rows), list(columns), list(measures)
+    if 'period' in rows + columns:
+        facts = _with_period(facts, period)
+
+    grand_total = _measure_values(facts[measures].sum(), measures)
+    if facts.empty or not rows + columns:
+        return {'columns': [], 'results': [], 'column_totals': [], 'total': grand_total}
+
+    grouped = facts.groupby(rows + columns, observed=True, sort=True)[measures].sum()
+    if not columns:
+        results = [
+            {**dict(zip(rows, key if isinstance(key, tuple) else (key,))), **_measure_values(values, measures)}
+            for key, values in grouped.iterrows()
+        ]
+        return {'columns': [], 'results': results, 'column_totals': [], 'total': grand_total}
+
+    column_totals = facts.groupby(columns, observed=True, sort=True)[measures].sum()
+    column_keys = [key if isinstance(key, tuple) else (key,) for key in column_totals.index]
+    labels = [' / '.join(str(part) for part in key) for key in column_keys]
+
+    results = []
+    if rows:
+        # One row per row key, one (measure, column key) column per cell
+        wide = grouped.unstack(list(range(len(rows), len(rows) + len(columns))), fill_value=0)
+        row_totals = facts.groupby(rows, observed=True, sort=True)[measures].sum()
+        for key, values in wide.iterrows():
+            key = key if isinstance(key, tuple) else (key,)
+            cells = {}
+            for column_key, label in zip(column_keys, labels):
+                cell = {measure: values.get((measure, *column_key), 0) for measure in measures}
+                cells[label] = _measure_values(cell, measures)
+            results.append({
+                **dict(zip(rows, key)),
+                'cells': cells,
+                'total': _measure_values(row_totals.loc[key if len(key) > 1 else key[0]], measures),
+            })
+
+    return {
+        'columns': labels,
+        'results': results,
+        'column_totals': [
+            {'column': label, **_measure_values(values, measures)}
+            for label, (_, values) in zip(labels, column_totals.iterrows())
+        ],
+        'total': grand_total,
+    }
@@ -0,0 +1,231 @@
+"""
+Purchase expense and purchase supplier totals kept up to date incrementally.
+
+An expense's total is the sum of its purchase lines; a purchase supplier's
+total, paid and unpaid amounts are the sums over its expenses. Instead of
+re-summing those on every edit:
+
+* a purchase line saved or deleted moves its expense's total and unpaid
+  amount, and its supplier's, by the change in the line total: two F()
+  updates, however many expenses the supplier has;
+* an expense saved or deleted moves its supplier's amounts by the change in
+  its own. The previous amounts are read from the row in pre_save, because
+  the purchase flows save an expense through several instances.
+
+An expense or supplier marked Paid that gains an unpaid amount goes back to
+Pending, as when products are added to it; one whose unpaid amount drops to
+zero becomes Paid.
+
+Serializers that create an expense with its total already worked out and then
+its lines wrap their work in `purchase_totals()`. Line changes are only
+collected there, and when the block ends each touched expense is brought in
+line with the sum of its lines (one grouped query over those expenses' lines),
+so the lines are not counted twice. `rebuild_purchase_totals` recomputes
+everything with one grouped query per table for the `reconcile_purchase_totals`
+command.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, QuerySet, Sum
+
+from .models import PurchaseExpense, PurchaseProduct, PurchaseSupplier
+from .report_cache import bump, supplier_key
+
+
+ZERO = Decimal('0.00')
+BATCH_SIZE = 1000
+
+# Expense fields the supplier amounts depend on, in the order of `stored_expense`
+EXPENSE_FIELDS = ('supplier_level_id', 'total', 'paid_amount', 'unpaid_amount')
+SUPPLIER_FIELDS = ('total_amount', 'paid_amount', 'unpaid_amount')
+
+_capture = ContextVar('purchase_totals', default=None)
+
+
+def money(value):
+    return Decimal(str(value or 0)).quantize(ZERO)
+
+
+def payment_status(status, unpaid_change, unpaid):
+    if unpaid_change < 0 and unpaid <= 0:
+        return 'Paid'
+    if unpaid_change > 0 and status == 'Paid':
+        return 'Pending'
+    return status
+
+
+def deleted_directly(model, origin):
+    """Whether a post_delete of `model` comes from deleting it, not from a cascade."""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+def apply_supplier_changes(changes):
+    """
+    Add {purchase supplier id: (total, paid, unpaid)} to the suppliers, one
+    UPDATE each. Returns {id: (paid before, paid after)} of the changed suppliers.
+    """
+    changes = {pk: change for pk, change in changes.items() if pk and any(change)}
+    if not changes:
+        return {}
+    paid = {}
+    with transaction.atomic():
+        rows = (
+            PurchaseSupplier.objects.select_for_update().filter(pk__in=changes).order_by('pk')
+            .values_list('pk', 'paid_amount', 'unpaid_amount', 'payment_status')
+        )
+        for pk, old_paid, old_unpaid, status in rows:
+            total, paid_change, unpaid_change = changes[pk]
+            PurchaseSupplier.objects.filter(pk=pk).update(
+                total_amount=F('total_amount') + total,
+                paid_amount=F('paid_amount') + paid_change,
+                unpaid_amount=F('unpaid_amount') + unpaid_change,
+                payment_status=payment_status(status, unpaid_change, money(old_unpaid) + unpaid_change),
+            )
+            paid[pk] = (money(old_paid), money(old_paid) + paid_change)
+        bump(*[supplier_key(pk) for pk in paid])
+    return paid
+
+
+def expense_changes(old, new):
+    """{purchase supplier id: (total, paid, unpaid)} for an expense going from `old` to `new` (EXPENSE_FIELDS rows or None)."""
+    changes = defaultdict(lambda: [ZERO, ZERO, ZERO])
+    for row, sign in ((old, -1), (new, 1)):
+        if row is None or row[0] is None:
+            continue
+        change = changes[row[0]]
+        for index, value in enumerate(row[1:]):
+            change[index] += sign * money(value)
+    return {pk: tuple(change) for pk, change in changes.items()}
+
+
+def expense_row(expense):
+    return tuple(getattr(expense, field) for field in EXPENSE_FIELDS)
+
+
+def stored_expense(pk):
+    return PurchaseExpense.objects.filter(pk=pk).values_list(*EXPENSE_FIELDS).first()
+
+
+def apply_line_changes(changes):
+    """
+    Add {expense id: change in its lines' total} to the expenses' total and
+    unpaid amount and to their suppliers, one UPDATE per row.
+    """
+    changes = {pk: money(change) for pk, change in changes.items() if pk and change}
+    if not changes:
+        return
+    suppliers = defaultdict(lambda: [ZERO, ZERO, ZERO])
+    with transaction.atomic():
+        rows = (
+            PurchaseExpense.objects.select_for_update().filter(pk__in=changes).order_by('pk')
+            .values_list('pk', 'supplier_level_id', 'unpaid_amount', 'payment_status')
+        )
+        for pk, supplier_id, unpaid, status in rows:
+            change = changes[pk]
+            new_unpaid = max(money(unpaid) + change, ZERO)
+            PurchaseExpense.objects.filter(pk=pk).update(
+                total=F('total') + change,
+                unpaid_amount=new_unpaid,
+                payment_status=payment_status(status, new_unpaid - money(unpaid), new_unpaid),
+            )
+            if supplier_id:
+                suppliers[supplier_id][0] += change
+                suppliers[supplier_id][2] += new_unpaid - money(unpaid)
+        apply_supplier_changes({pk: tuple(change) for pk, change in suppliers.items()})
+
+
+@contextmanager
+def purchase_totals():
+    """
+    Collect the expenses whose lines change inside the block and set their
+    totals from their lines when it ends. Works as a decorator too; nested
+    blocks add to the outermost one.
+    """
+    if _capture.get() is not None:
+        yield _capture.get()
+        return
+    touched = set()
+    token = _capture.set(touched)
+    try:
+        yield touched
+    finally:
+        _capture.reset(token)
+    sync_expense_totals(touched)
+
+
+def record_line_change(expense_id, change):
+    """Called by the PurchaseProduct signals with the change in a line's total."""
+    touched = _capture.get()
+    if touched is not None:
+        touched.add(expense_id)
+    elif change:
+        apply_line_changes({expense_id: change})
+
+
+def line_totals(expense_ids=None):
+    """{expense id: sum of its lines} in one grouped query."""
+    lines = PurchaseProduct.objects.filter(expense__isnull=False)
+    if expense_ids is not None:
+        lines = lines.filter(expense_id__in=expense_ids)
+    return {pk: money(total) for pk, total in lines.values_list('expense_id').annotate(total=Sum('total_price')).order_by()}
+
+
+def sync_expense_totals(expense_ids):
+    """Move the totals of `expense_ids` (and their suppliers) to the sum of their lines."""
+    expense_ids = [pk for pk in expense_ids if pk]
+    if not expense_ids:
+        return
+    lines = line_totals(expense_ids)
+    stored = PurchaseExpense.objects.filter(pk__in=expense_ids).values_list('pk', 'total')
+    apply_line_changes({pk: lines.get(pk, ZERO) - money(total) for pk, total in stored})
+
+
+def rebuild_purchase_totals():
+    """
+    Set the total of every expense that has lines to the sum of its lines (and
+    its unpaid amount to what is left after the paid amount), then every
+    supplier's amounts to the sums over its expenses. Returns
+    {('expense' | 'supplier', id): (stored, actual)} for the rows that drifted.
+    """
+    drift = {}
+    with transaction.atomic():
+        lines = line_totals()
+        expenses = list(
+            PurchaseExpense.objects.select_for_update().filter(pk__in=list(lines))
+            .only('id', 'total', 'paid_amount', 'unpaid_amount')
+        )
+        changed = []
+        for expense in expenses:
+            total = lines[expense.pk]
+            unpaid = max(total - money(expense.paid_amount), ZERO)
+            if (money(expense.total), money(expense.unpaid_amount)) != (total, unpaid):
+                drift['expense', expense.pk] = ((money(expense.total), money(expense.unpaid_amount)), (total, unpaid))
+                expense.total, expense.unpaid_amount = total, unpaid
+                changed.append(expense)
+        PurchaseExpense.objects.bulk_update(changed, ['total', 'unpaid_amount'], batch_size=BATCH_SIZE)
+
+        sums = {
+            pk: (money(total), money(paid), money(unpaid))
+            for pk, total, paid, unpaid in PurchaseExpense.objects.filter(supplier_level__isnull=False)
+            .values_list('supplier_level_id')
+            .annotate(total=Sum('total'), paid=Sum('paid_amount'), unpaid=Sum('unpaid_amount'))
+            .order_by()
+        }
+        suppliers = list(PurchaseSupplier.objects.select_for_update().only('id', *SUPPLIER_FIELDS))
+        changed = []
+        for supplier in suppliers:
+            actual = sums.get(supplier.pk, (ZERO, ZERO, ZERO))
+            stored = tuple(money(getattr(supplier, field)) for field in SUPPLIER_FIELDS)
+            if stored != actual:
+                drift['supplier', supplier.pk] = (stored, actual)
+                supplier.total_amount, supplier.paid_amount, supplier.unpaid_amount = actual
+                changed.append(supplier)
+        PurchaseSupplier.objects.bulk_update(changed, list(SUPPLIER_FIELDS), batch_size=BATCH_SIZE)
+        bump(*[supplier_key(pk) for kind, pk in drift if kind == 'supplier'])
+    return drift
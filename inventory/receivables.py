@@ -0,0 +1,178 @@
+"""
+Customer receivables.
+
+An order is open while it is not cancelled, not marked Paid and has an unpaid
+amount; Order.unpaid_amount is what is still owed on it. CustomerBalance keeps
+per customer the sum of those amounts and the number of open orders. Order
+signals apply the difference between an order's previous and new open amount
+with F() updates, so a customer's balance is a single-row lookup instead of a
+sum over their orders. `rebuild_customer_balances` recomputes the rows with
+one grouped query and is what the `reconcile_customer_balances` command runs.
+
+`aging` splits the open amounts of every customer by order age (0-30, 31-60,
+61-90 and over 90 days) in one grouped query over the open orders, which the
+(payment_status, customer) index narrows down to the unpaid and pending ones.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, Q, Sum, When
+from django.utils import timezone
+
+from .models import CustomerBalance, Order
+
+
+ZERO = Decimal('0.00')
+MONEY = DecimalField(max_digits=20, decimal_places=2)
+
+OPEN_ORDERS = Q(unpaid_amount__gt=0) & ~Q(status='Cancelled') & ~Q(payment_status='Paid')
+
+# (bucket, first day, last day) of order age; the last bucket is open ended
+AGING_BUCKETS = (
+    ('current', 0, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('over_90', 91, None),
+)
+
+# Order fields the open amount depends on, in the order read by `receivable_state`
+STATE_FIELDS = ('customer_id', 'status', 'payment_status', 'unpaid_amount')
+
+
+def open_amount(status, payment_status, unpaid_amount):
+    if status == 'Cancelled' or payment_status == 'Paid' or not unpaid_amount:
+        return ZERO
+    return max(Decimal(str(unpaid_amount)).quantize(ZERO), ZERO)
+
+
+def receivable_state(order):
+    """(customer_id, open amount) of an order instance, or None if some fields were not loaded."""
+    try:
+        customer_id, status, payment_status, unpaid_amount = tuple(order.__dict__[field] for field in STATE_FIELDS)
+    except KeyError:
+        return None
+    return customer_id, open_amount(status, payment_status, unpaid_amount)
+
+
+def apply_order_changes(changes):
+    """
+    Apply [(old_state, new_state), ...] to the customer balances; either state
+    may be None for a created or deleted order. One UPDATE per touched customer.
+    """
+    deltas = defaultdict(lambda: [ZERO, 0])
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None or state[0] is None or not state[1]:
+                continue
+            delta = deltas[state[0]]
+            delta[0] += sign * state[1]
+            delta[1] += sign
+
+    deltas = {customer_id: delta for customer_id, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+    with transaction.atomic():
+        for customer_id in sorted(deltas):
+            amount, orders = deltas[customer_id]
+            change = {'outstanding': F('outstanding') + amount, 'open_orders': F('open_orders') + orders}
+            if not CustomerBalance.objects.filter(customer_id=customer_id).update(**change):
+                CustomerBalance.objects.get_or_create(customer_id=customer_id)
+                CustomerBalance.objects.filter(customer_id=customer_id).update(**change)
+
+
+def customer_balance(customer_id):
+    """(outstanding, open orders) of one customer."""
+    row = CustomerBalance.objects.filter(customer_id=customer_id).values_list('outstanding', 'open_orders').first()
+    return row or (ZERO, 0)
+
+
+def open_orders(customer_id=None):
+    orders = Order.objects.filter(OPEN_ORDERS)
+    if customer_id is not None:
+        orders = orders.filter(customer_id=customer_id)
+    return orders
+
+
+def rebuild_customer_balances(customer_ids=None):
+    """
+    Recompute the balances (of `customer_ids`, or every customer) and replace
+    the stored rows. Returns {customer_id: (stored, actual)} for the balances
+    that drifted, each as (outstanding, open orders).
+    """
+    orders = open_orders().filter(customer__isnull=False)
+    balances = CustomerBalance.objects.all()
+    if customer_ids is not None:
+        orders = orders.filter(customer_id__in=customer_ids)
+        balances = balances.filter(customer_id__in=customer_ids)
+    actual = {
+        customer_id: (outstanding, count)
+        for customer_id, outstanding, count in orders.values('customer_id')
+        .annotate(outstanding=Sum('unpaid_amount'), count=Count('id'))
+        .values_list('customer_id', 'outstanding', 'count')
+        .order_by()
+    }
+
+    with transaction.atomic():
+        stored = {
+            customer_id: (outstanding, count)
+            for customer_id, outstanding, count in balances.select_for_update().values_list(
+                'customer_id', 'outstanding', 'open_orders'
+            )
+        }
+        balances.delete()
+        CustomerBalance.objects.bulk_create([
+            CustomerBalance(customer_id=customer_id, outstanding=outstanding, open_orders=count)
+            for customer_id, (outstanding, count) in actual.items()
+        ], batch_size=1000)
+
+    empty = (ZERO, 0)
+    return {
+        customer_id: (stored.get(customer_id, empty), actual.get(customer_id, empty))
+        for customer_id in sorted(set(stored) | set(actual))
+        if stored.get(customer_id, empty) != actual.get(customer_id, empty)
+    }
+
+
+def _bucket_filters(now):
+    """{bucket: Q} on order_date, so that an order `n` whole days old falls in the bucket covering n."""
+    filters = {}
+    for name, first, last in AGING_BUCKETS:
+        age = Q()
+        if first:
+            age &= Q(order_date__lte=now - timedelta(days=first))
+        if last is not None:
+            age &= Q(order_date__gt=now - timedelta(days=last + 1))
+        filters[name] = age
+    return filters
+
+
+def _aging_sums(now):
+    sums = {
+        name: Sum(Case(When(age, then=F('unpaid_amount')), default=ZERO, output_field=MONEY))
+        for name, age in _bucket_filters(now).items()
+    }
+    return {**sums, 'total': Sum('unpaid_amount'), 'open_orders': Count('id')}
+
+
+def aging(customer_id=None, now=None):
+    """
+    Open amounts per customer split by order age, largest total first, as a
+    values queryset (one grouped query; paginate it). Orders without a
+    customer are grouped under customer None.
+    """
+    now = now or timezone.now()
+    return (
+        open_orders(customer_id)
+        .values('customer_id', 'customer__name', 'customer__phone')
+        .annotate(**_aging_sums(now), oldest_order=Min('order_date'), latest_order=Max('order_date'))
+        .order_by('-total', 'customer_id')
+    )
+
+
+def aging_totals(customer_id=None, now=None):
+    """The aging buckets summed over every customer."""
+    now = now or timezone.now()
+    totals = open_orders(customer_id).aggregate(**_aging_sums(now))
+    return {key: value if value is not None else ZERO for key, value in totals.items()}
@@ -0,0 +1,122 @@
+"""
+Goods received: purchase lines into product stock.
+
+A purchase line is free text until it is linked to a Product
+(PurchaseProduct.linked_product). Receiving an expense takes every linked line
+not received yet, optionally linking more lines on the way, and in one
+transaction:
+
+* gives every line received its cost layer, dated now, before the stock
+  moves (costing.add_layers), so the products' unit cost moves incrementally
+  from the stock on hand; sales already made keep their cost;
+* adds the line quantities (in the product's stock unit) to Product.stock with
+  one bulk UPDATE of F('stock') + quantity, recomputing the package count from
+  the pieces per package;
+* writes one ProductLog batch and one StockMovement batch (kind Purchase);
+* marks the lines received.
+
+A line only gets a cost layer once it is received, so linking a line to
+another product before that moves no costs. The buying price is left as
+entered: the cost of the stock is Product.unit_cost.
+
+Bulk writes skip the Product signals, so the valuation, low-stock flags and
+report versions are updated here, as in inventory.imports.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .costing import add_layers
+from .ledger import record_movements
+from .models import Product, ProductLog, PurchaseProduct, StockMovement
+from .report_cache import PRODUCTS, bump, supplier_key
+from .stock_alerts import refresh_low_stock
+from .valuation import apply_product_changes, product_state
+
+
+BATCH_SIZE = 1000
+
+
+def _link_lines(lines, links):
+    """Apply {line id: product id} to `lines` (the expense's lines by id). Returns (relinked lines, errors)."""
+    errors = []
+    products = Product.objects.in_bulk(set(links.values()))
+    linked = []
+    for line_id, product_id in links.items():
+        line = lines.get(line_id)
+        if line is None:
+            errors.append({'line': line_id, 'error': "is not a line of this purchase"})
+        elif line.received_at is not None:
+            errors.append({'line': line_id, 'error': "was already received"})
+        elif product_id not in products:
+            errors.append({'line': line_id, 'error': f"product {product_id} does not exist"})
+        elif line.linked_product_id != product_id:
+            line.linked_product = products[product_id]
+            linked.append(line)
+    return linked, errors
+
+
+def receive_expense(expense, links=None, user=None):
+    """
+    Receive the linked, not yet received lines of `expense`. `links` is
+    {line id: product id} for lines to link first. Returns (result, errors):
+    result is {'received': line ids, 'unlinked': ids of the lines left out for
+    want of a product, 'products': number of products updated}; when a link is
+    invalid nothing is received and errors lists the lines.
+    """
+    links = links or {}
+    now = timezone.now()
+    with transaction.atomic():
+        lines = {line.pk: line for line in PurchaseProduct.objects.select_for_update().filter(expense=expense).order_by('pk')}
+        relinked, errors = _link_lines(lines, links)
+        if errors:
+            return None, errors
+        PurchaseProduct.objects.bulk_update(relinked, ['linked_product'], batch_size=BATCH_SIZE)
+
+        pending = [line for line in lines.values() if line.received_at is None]
+        receiving = [line for line in pending if line.linked_product_id]
+        quantities = defaultdict(int)
+        for line in receiving:
+            quantities[line.linked_product_id] += max(line.quantity or 0, 0)
+
+        products = list(Product.objects.select_for_update().filter(pk__in=list(quantities)).order_by('pk'))
+        by_id = {product.pk: product for product in products}
+        # Before the stock moves: the average weighs the receipts against the stock on hand
+        unit_costs = add_layers(
+            [(by_id[line.linked_product_id], line.quantity, line.unit_price, line) for line in receiving],
+            received_at=now,
+        )
+        valuation_changes, movements, logs = [], [], []
+        for product in products:
+            # add_layers moved the valuation of the stock on hand to the new cost already
+            product.unit_cost = unit_costs.get(product.pk, product.unit_cost)
+            quantity = quantities[product.pk]
+            old_state, old_stock = product_state(product), product.stock
+            new_stock = (old_stock or 0) + quantity
+            if product.piece:
+                product.package = new_stock // product.piece
+            product.stock = new_stock
+            valuation_changes.append((old_state, product_state(product)))
+            movements.append((product.pk, quantity, new_stock))
+            if quantity:
+                logs.append(ProductLog(product=product, change_type="Purchase Receive", field_name="Stock",
+                                       old_value=old_stock, new_value=new_stock, user=user))
+            # Added in SQL so stock written since the read above is kept
+            product.stock = Coalesce(F('stock'), 0) + quantity
+        Product.objects.bulk_update(products, ['stock', 'package'], batch_size=BATCH_SIZE)
+
+        ProductLog.objects.bulk_create(logs, batch_size=BATCH_SIZE)
+        record_movements(movements, StockMovement.PURCHASE, model_name='PurchaseExpense', object_id=expense.pk, user=user)
+        apply_product_changes(valuation_changes)
+
+        PurchaseProduct.objects.filter(pk__in=[line.pk for line in receiving]).update(received_at=now)
+        refresh_low_stock(list(quantities))
+        bump(PRODUCTS, *([supplier_key(expense.supplier_level_id)] if expense.supplier_level_id else []))
+    return {
+        'received': [line.pk for line in receiving],
+        'unlinked': [line.pk for line in pending if not line.linked_product_id],
+        'products': len(products),
+    }, []
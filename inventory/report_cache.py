@@ -0,0 +1,162 @@
+"""
+Disk cache for generated reports.
+
+A cached report is stored under the sha256 of its name, its parameters and the
+data-version watermark of the data it reads. Every change to that data bumps a
+DataVersion row (from the model signals, or explicitly on bulk paths), so a
+changed report simply gets a new key and stale files are never served; they age
+out of the cache instead. Order data is versioned per order date, so reports
+for past periods keep their key while new sales come in and are served from
+disk until something in that period changes.
+
+The directory is bounded by REPORT_CACHE_MAX_BYTES: after each write the least
+recently used files (by mtime, refreshed on every hit) are removed until the
+total fits.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .models import DataVersion
+
+
+PRODUCTS = 'products'
+CUSTOMERS = 'customers'
+
+
+def order_day_key(day):
+    return f'orders:{day.isoformat()}'
+
+
+def supplier_key(purchase_supplier_id):
+    return f'supplier:{purchase_supplier_id}'
+
+
+def order_window_keys(start, end):
+    return [order_day_key(start + timedelta(days=offset)) for offset in range((end - start).days + 1)]
+
+
+def _bump_now(keys):
+    for key in keys:
+        if DataVersion.objects.filter(key=key).update(version=F('version') + 1, updated_at=timezone.now()):
+            continue
+        try:
+            with transaction.atomic():
+                DataVersion.objects.create(key=key, version=1)
+        except IntegrityError:
+            DataVersion.objects.filter(key=key).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def bump(*keys):
+    """
+    Mark the data behind `keys` as changed once the current transaction commits,
+    so the version rows are not held locked for the length of e.g. an order save.
+    """
+    keys = sorted({key for key in keys if key})
+    if keys:
+        transaction.on_commit(lambda: _bump_now(keys))
+
+
+def data_version(keys):
+    """Watermark for a set of keys; it grows whenever any of them is bumped."""
+    return DataVersion.objects.filter(key__in=keys).aggregate(total=Sum('version'))['total'] or 0
+
+
+def cache_dir():
+    return getattr(settings, 'REPORT_CACHE_DIR', os.path.join(settings.BASE_DIR, 'report_cache'))
+
+
+def max_bytes():
+    return getattr(settings, 'REPORT_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+
+
+def cache_key(name, params, version):
+    payload = json.dumps({'report': name, 'params': params, 'version': version}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _path(key, suffix):
+    return os.path.join(cache_dir(), f'{key}{suffix}')
+
+
+def get(key, suffix='.json'):
+    """Path of the cached file for `key`, or None. A hit counts as a use for LRU eviction."""
+    path = _path(key, suffix)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def put(key, content, suffix='.json'):
+    directory = cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    # Write next to the final name and rename, so readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as target:
+        target.write(content)
+    os.replace(tmp, _path(key, suffix))
+    evict()
+    return _path(key, suffix)
+
+
+def evict(limit=None):
+    """Remove the least recently used files until the cache fits in `limit` bytes."""
+    limit = max_bytes() if limit is None else limit
+    entries, total = [], 0
+    with os.scandir(cache_dir()) as scan:
+        for entry in scan:
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def cached_json_response(request, name, params, version_keys, build):
+    """
+    Serve the JSON report `name` from the cache, calling `build()` for its data
+    on a miss. The cache key doubles as the ETag.
+    """
+    key = cache_key(name, params, data_version(version_keys))
+    etag = f'"{key}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    response = None
+    path = get(key)
+    if path is not None:
+        try:
+            response = FileResponse(open(path, 'rb'), content_type='application/json')
+            response['X-Report-Cache'] = 'HIT'
+        except FileNotFoundError:
+            # Evicted by another process in between
+            response = None
+    if response is None:
+        content = JSONRenderer().render(build())
+        put(key, content)
+        response = HttpResponse(content, content_type='application/json')
+        response['X-Report-Cache'] = 'MISS'
+    response['ETag'] = etag
+    return response
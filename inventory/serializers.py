@@ -5,7 +5,8 @@ from .models import (
     OtherExpenses, OrderPaymentLog, ProductLog, Bundle, Component,
     PerformaCustomer, PerformaPerforma, PerformaProduct,
     PurchaseSupplier, PurchaseExpense, PurchaseProduct,
-    SupplierPaymentLog, ExpensePaymentLog
+    SupplierPaymentLog, ExpensePaymentLog, StockMovement, StockAlertEvent, StockLot,
+    BackgroundJob, ProductHealth, CustomerBalance, Payment, PaymentAllocation, BankStatement, StatementLine
 )
 
 from django.db import transaction
@@ -16,10 +17,14 @@ from user.serializers import UserSerializer
 from django.utils import timezone
 from .utils import create_order_log, create_order_report
 from decimal import Decimal
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Count
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from .utils import update_payment_status_on_new_expense_or_product
+from .ledger import stock_movement, tag_movements
+from .counters import count, field_key, ORDERS
+from .payments import payment_capture
+from .purchase_totals import purchase_totals
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -153,7 +158,7 @@ class ProductGetSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'category', 'category_name', 'specification', 'description', 'package', 'piece', 'unit', 'buying_price', 'selling_price', 'receipt_no', 'specification', 'stock', 'supplier_name', 'image', 'is_bundle', 'bundle_components', 'user']
+        fields = ['id', 'name', 'category', 'category_name', 'specification', 'description', 'package', 'piece', 'unit', 'buying_price', 'selling_price', 'receipt_no', 'specification', 'stock', 'reorder_point', 'is_low_stock', 'supplier_name', 'image', 'is_bundle', 'bundle_components', 'user']
         constraints = [
             UniqueConstraint(fields=['name', 'category_name', 'specification'], name='unique_product_category_specification')
         ]
@@ -163,7 +168,7 @@ class ProductPostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'category', 'description', 'package', 'piece', 'unit', 'buying_price', 'selling_price', 'receipt_no', 'specification', 'stock', 'supplier', 'image', 'is_bundle', 'user']
+        fields = ['id', 'name', 'category', 'description', 'package', 'piece', 'unit', 'buying_price', 'selling_price', 'receipt_no', 'specification', 'stock', 'reorder_point', 'supplier', 'image', 'is_bundle', 'user']
         constraints = [
             UniqueConstraint(fields=['name', 'category', 'specification'], name='unique_product_category_specification')
         ]
@@ -420,7 +425,10 @@ class OrderItemSerializer(serializers.ModelSerializer):
             return "0"
         
 
+    @stock_movement(StockMovement.SALE, 'OrderItem')
+    @payment_capture()
     def update(self, instance, validated_data):
+        tag_movements(object_id=instance.id)
         # user = self.context['request'].user
         # user_role = user.role
         # user_name = user.name
@@ -683,6 +691,8 @@ class OrderSerializer(serializers.ModelSerializer):
             'total_amount': {'read_only': True}, # Make 'total_amount' read-only
         }
     
+    @stock_movement(StockMovement.SALE, 'Order')
+    @payment_capture()
     def create(self, validated_data, user=None):
         # user = self.context["request"].user
         # if user:
@@ -693,9 +703,8 @@ class OrderSerializer(serializers.ModelSerializer):
         
         receipt = validated_data['receipt']
 
-        all_order = Order.objects.all().count()
-        receipt_order = Order.objects.filter(receipt="Receipt").count()
-        no_receipt_order = Order.objects.filter(receipt="No Receipt").count()
+        all_order = count(ORDERS)
+        no_receipt_order = count(field_key(Order, 'receipt', "No Receipt"))
         if receipt == "Receipt":
             id = all_order - no_receipt_order
             id = str(id).zfill(4)
@@ -732,6 +741,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
             # Create the Order instance           
             order = Order.objects.create(**validated_data)
+            tag_movements(object_id=order.id)
 
             # Create each OrderItem
             for item_data in items_data:
@@ -1012,6 +1022,8 @@ class OrderSerializer(serializers.ModelSerializer):
         return order
 
 
+    @stock_movement(StockMovement.SALE, 'Order')
+    @payment_capture()
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items', None)
         print("items", items_data)
@@ -1019,6 +1031,7 @@ class OrderSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         user_role = user.role
         user_name = user.name
+        tag_movements(object_id=instance.id, user=user_name)
         # Update order fields directly
         instance.customer = validated_data.get('customer', instance.customer)
         instance.status = validated_data.get('status', instance.status)
@@ -1497,6 +1510,123 @@ class OrderPaymentLogSerializer(serializers.ModelSerializer):
         model = OrderPaymentLog
         fields = '__all__'
 
+class StockMovementSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'product', 'product_name', 'kind', 'quantity', 'stock_after', 'model_name', 'object_id', 'user', 'timestamp']
+
+class ProductHealthSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    product_specification = serializers.CharField(source='product.specification', read_only=True)
+
+    class Meta:
+        model = ProductHealth
+        fields = ['product', 'product_name', 'product_specification', 'abc_class', 'revenue', 'cogs', 'quantity_sold',
+                  'revenue_share', 'cumulative_share', 'stock', 'stock_value', 'turnover', 'days_of_inventory',
+                  'last_sale_at', 'days_since_last_sale', 'is_dead_stock', 'computed_at']
+
+class CustomerBalanceSerializer(serializers.ModelSerializer):
+    customer_name = serializers.CharField(source='customer.name', read_only=True)
+    customer_phone = serializers.CharField(source='customer.phone', read_only=True)
+
+    class Meta:
+        model = CustomerBalance
+        fields = ['customer', 'customer_name', 'customer_phone', 'outstanding', 'open_orders', 'updated_at']
+
+class PaymentAllocationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentAllocation
+        fields = ['id', 'order', 'expense', 'amount', 'source', 'user', 'created_at']
+
+class PaymentSerializer(serializers.ModelSerializer):
+    customer_name = serializers.CharField(source='customer.name', read_only=True)
+    supplier_name = serializers.CharField(source='supplier.supplier.name', read_only=True)
+    allocations = PaymentAllocationSerializer(many=True, read_only=True)
+    paid_at = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = Payment
+        fields = ['id', 'kind', 'customer', 'customer_name', 'supplier', 'supplier_name', 'amount', 'unallocated',
+                  'method', 'reference', 'note', 'paid_at', 'user', 'created_at', 'allocations']
+        read_only_fields = ['kind', 'customer', 'supplier', 'unallocated', 'user', 'created_at']
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("The payment amount must be positive.")
+        return value
+
+class BankStatementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BankStatement
+        fields = ['id', 'name', 'source', 'line_count', 'duplicate_count', 'imported_at', 'user']
+
+class StatementLineSerializer(serializers.ModelSerializer):
+    customer_name = serializers.CharField(source='customer.name', read_only=True)
+    supplier_name = serializers.CharField(source='purchase_supplier.supplier.name', read_only=True)
+
+    class Meta:
+        model = StatementLine
+        fields = ['id', 'statement', 'row', 'transaction_date', 'amount', 'reference', 'description', 'counterparty',
+                  'phone', 'tin_number', 'status', 'match_kind', 'match_reason', 'order', 'customer', 'customer_name',
+                  'expense', 'purchase_supplier', 'supplier_name', 'payment']
+
+class BackgroundJobSerializer(serializers.ModelSerializer):
+    has_result_file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BackgroundJob
+        fields = ['id', 'kind', 'status', 'params', 'progress', 'total', 'message', 'result', 'error',
+                  'cancel_requested', 'has_result_file', 'user', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_has_result_file(self, obj):
+        return bool(obj.result_file)
+
+
+class StockLotSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    product_specification = serializers.CharField(source='product.specification', read_only=True)
+
+    class Meta:
+        model = StockLot
+        fields = ['id', 'product', 'product_name', 'product_specification', 'lot_number', 'expiry_date', 'quantity', 'remaining', 'received_at', 'user']
+        read_only_fields = ['remaining', 'received_at']
+
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity must be greater than zero.")
+        return value
+
+    def create(self, validated_data):
+        """Receiving a lot adds its quantity to the product stock."""
+        validated_data['remaining'] = validated_data['quantity']
+        with transaction.atomic():
+            lot = super().create(validated_data)
+            product = Product.objects.select_for_update().get(pk=lot.product_id)
+            with stock_movement(StockMovement.PURCHASE, 'StockLot', lot.id, validated_data.get('user')):
+                product.stock = (product.stock or 0) + lot.quantity
+                if product.piece:
+                    product.package = product.stock // product.piece
+                product.save()
+        return lot
+
+    def update(self, instance, validated_data):
+        # Quantities move through sales; only the identification can be corrected
+        validated_data.pop('quantity', None)
+        validated_data.pop('product', None)
+        return super().update(instance, validated_data)
+
+
+class StockAlertEventSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    product_specification = serializers.CharField(source='product.specification', read_only=True)
+
+    class Meta:
+        model = StockAlertEvent
+        fields = ['id', 'product', 'product_name', 'product_specification', 'kind', 'stock', 'reorder_point', 'timestamp']
+
 class ProductLogSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_specification = serializers.CharField(source='product.specification', read_only=True)
@@ -1758,14 +1888,22 @@ class PerformaCustomerSerializer(serializers.ModelSerializer):
 
 class PurchaseProductSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
+    received_at = serializers.DateTimeField(read_only=True)
 
     class Meta:
         model = PurchaseProduct
-        fields = ['id', 'product', 'unit', 'description', 'quantity', 'unit_price', 'total_price']
+        fields = ['id', 'product', 'linked_product', 'unit', 'description', 'quantity', 'unit_price', 'total_price', 'received_at']
     
     def update(self, instance, validated_data):
         new_quantity = validated_data.get('quantity', instance.quantity)
+        # Received lines are in the product stock already (inventory.receiving)
+        if instance.received_at and (
+            new_quantity != instance.quantity
+            or validated_data.get('linked_product', instance.linked_product) != instance.linked_product
+        ):
+            raise serializers.ValidationError({"error": "The quantity and product of a received line can't be changed."})
         instance.product = validated_data.get('product', instance.product)
+        instance.linked_product = validated_data.get('linked_product', instance.linked_product)
         instance.unit_price = validated_data.get('unit_price', instance.unit_price)
         instance.unit = validated_data.get('unit', instance.unit)
         instance.description = validated_data.get('description', instance.description)
@@ -1778,10 +1916,8 @@ class PurchaseProductSerializer(serializers.ModelSerializer):
         # instance.save()
 
         instance.quantity = new_quantity
-        
-        # instance.expense.total = instance.expense.products.aggregate(total_price=Sum('total_price'))['total_price'] or Decimal('0.00')
-        instance.expense.total = instance.expense.products.aggregate(total=Sum('total_price'))['total'] or Decimal('0.00')
-        instance.expense.save()
+
+        # The expense and supplier totals follow the line in its post_save signal (inventory.purchase_totals)
         instance.save()
 
         return instance
@@ -1798,12 +1934,14 @@ class PurchaseExpenseLightSerializer(serializers.ModelSerializer):
 class PurchaseExpenseSerializer(serializers.ModelSerializer):
     products = PurchaseProductSerializer(many=True)
     id = serializers.IntegerField(required=False)
-    purchase_date = serializers.DateField(read_only=True)
+    purchase_date = serializers.DateField(required=False)  # may be back-dated; cost layers are replayed
 
     class Meta:
         model = PurchaseExpense
         fields = ['id', 'purchase_date', 'supplier', 'number_of_items', 'total', 'payment_status', 'paid_amount', 'unpaid_amount', 'user', 'products']
 
+    @payment_capture()
+    @purchase_totals()
     def create(self, validated_data):
         user = self.context["request"].user
         if user:
@@ -1818,8 +1956,12 @@ class PurchaseExpenseSerializer(serializers.ModelSerializer):
             PurchaseProduct.objects.create(expense=expense, **product_data)
         return expense
     
+    @payment_capture()
+    @purchase_totals()
     def update(self, instance, validated_data):
         products_data = validated_data.pop('products', [])
+        # The total follows the lines (inventory.purchase_totals)
+        validated_data.pop('total', None)
 
         # At the start of the update method, add:
         is_adding_new_products = any(not item.get('id') for item in products_data)
@@ -1849,10 +1991,8 @@ class PurchaseExpenseSerializer(serializers.ModelSerializer):
                 unit_price = Decimal(str(product_data.get('unit_price', 0)))
                 total_price = quantity * unit_price
                 PurchaseProduct.objects.create(expense=instance, total_price=total_price, **product_data)
+                instance.total = Decimal(str(instance.total or 0)) + total_price
 
-
-        instance.total = instance.products.aggregate(Sum('total_price'))['total_price__sum'] or Decimal('0.00')
-        instance.total = Decimal(str(instance.total))
         instance.save()
 
         if 'paid_amount' in validated_data and instance.payment_status != 'Paid' and not is_adding_new_products:
@@ -1928,6 +2068,8 @@ class PurchaseSupplierSerializer(serializers.ModelSerializer):
             UniqueConstraint(fields=['supplier'], name='unique_supplier')
         ]
     
+    @payment_capture()
+    @purchase_totals()
     def create(self, validated_data):
         user = self.context["request"].user
         if user:
@@ -1981,9 +2123,8 @@ class PurchaseSupplierSerializer(serializers.ModelSerializer):
                     PurchaseProduct.objects.create(expense=expense, total_price=total_price, **product_data)
 
 
-            # After all expenses, update supplier's total_amount
-            supplier.total_amount = total_amount
-            supplier.save(update_fields=['total_amount'])
+            # The expenses' signals added their amounts to the supplier (inventory.purchase_totals)
+            supplier.refresh_from_db(fields=['total_amount', 'paid_amount', 'unpaid_amount', 'payment_status'])
 
             return supplier
 
@@ -1991,8 +2132,13 @@ class PurchaseSupplierSerializer(serializers.ModelSerializer):
             # Optional: rollback or raise a validation error
             raise serializers.ValidationError({"detail": f"Failed to create supplier: {str(e)}"})
 
+    @payment_capture()
+    @purchase_totals()
     def update(self, instance, validated_data):
         expenses_data = validated_data.pop('expenses', [])
+        # The amounts are the sums over the expenses, kept by their signals (inventory.purchase_totals)
+        for field in ('total_amount', 'paid_amount', 'unpaid_amount'):
+            validated_data.pop(field, None)
         # Capture original values before update
         old_status = instance.payment_status
         old_paid = instance.paid_amount
@@ -2046,9 +2192,7 @@ class PurchaseSupplierSerializer(serializers.ModelSerializer):
                         PurchaseProduct.objects.create(expense=expense, total_price=total_price, **product_data)
 
         # Syncronizing the total, paid and unpaid with the expenses
-        instance.total_amount = sum(expense.total for expense in instance.expenses.all())
-        instance.paid_amount = sum(expense.paid_amount for expense in instance.expenses.all())        
-        instance.unpaid_amount = sum(expense.unpaid_amount for expense in instance.expenses.all())
+        instance.refresh_from_db(fields=['total_amount', 'paid_amount', 'unpaid_amount'])
         
         # Updating the status of supplier
         total_amount = Decimal(str(instance.total_amount or 0))
@@ -0,0 +1,415 @@
+"""
+Bank / mobile money statement reconciliation.
+
+`read_statement` streams an uploaded CSV statement row by row and validates
+every row before anything is written, as the product import does. Column names
+are matched loosely (amount or credit/debit, date, reference, description,
+name, phone, TIN). Each line gets a hash of its content, so lines already
+imported with an earlier statement are skipped instead of being paid twice.
+
+Matching loads the open orders, the open purchase expenses and the phone / TIN
+of every customer and supplier with one query each, indexes them in dicts by
+receipt id, open amount, customer and supplier, then proposes a match for
+every line in a single pass of dict lookups:
+
+* money in: an open order whose receipt id appears in the reference or
+  description; else, for a customer found by TIN or phone, their open order
+  of exactly that amount, or the customer (paid oldest order first); else the
+  only open order of exactly that amount;
+* money out: for a purchase supplier found by TIN, phone or name, its open
+  expense of exactly that amount, or the supplier; else the only open expense
+  of exactly that amount.
+
+A document matched to one line is not proposed for another. `apply_statement`
+turns the confirmed lines into payments with the bulk allocators of
+inventory.payments, in one transaction.
+"""
+import csv
+import hashlib
+import io
+import re
+from collections import Counter, defaultdict
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import BankStatement, CustomerInfo, Order, PurchaseExpense, PurchaseSupplier, StatementLine
+from .payments import allocate_customer_payments, allocate_supplier_payments, money
+from .receivables import open_orders
+
+
+BATCH_SIZE = 1000
+
+# Line field -> accepted CSV headers (lower case, spaces and dashes as underscores)
+COLUMNS = {
+    'date': ('date', 'transaction_date', 'value_date', 'posting_date', 'booking_date'),
+    'amount': ('amount', 'transaction_amount'),
+    'credit': ('credit', 'deposit', 'money_in', 'received'),
+    'debit': ('debit', 'withdrawal', 'money_out', 'sent'),
+    'reference': ('reference', 'ref', 'transaction_id', 'transaction_reference', 'txn_id'),
+    'description': ('description', 'narration', 'narrative', 'details', 'remark', 'remarks'),
+    'counterparty': ('name', 'counterparty', 'payer', 'payee', 'account_name', 'party'),
+    'phone': ('phone', 'phone_number', 'msisdn', 'mobile'),
+    'tin_number': ('tin', 'tin_number'),
+}
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d')
+
+PHONE_DIGITS = 9  # 0911..., +251911... and 251911... are the same number
+
+
+def _header(name):
+    return re.sub(r'[\s\-]+', '_', str(name or '').strip().lower())
+
+
+def phone_key(value):
+    digits = re.sub(r'\D', '', str(value or ''))
+    return digits[-PHONE_DIGITS:] if len(digits) >= PHONE_DIGITS else None
+
+
+def text_key(value):
+    value = re.sub(r'\s+', ' ', str(value or '')).strip().upper()
+    return value or None
+
+
+def tokens(*values):
+    return {token for value in values for token in re.findall(r'[A-Z0-9][A-Z0-9\-/]*', str(value or '').upper())}
+
+
+def _amount(value):
+    value = str(value).strip().replace(',', '')
+    negative = value.startswith('(') and value.endswith(')')
+    value = re.sub(r'[^\d.\-]', '', value)
+    amount = Decimal(value).quantize(Decimal('0.01'))
+    return -amount if negative else amount
+
+
+def _date(value):
+    value = str(value).strip()
+    parsed = parse_date(value[:10]) if re.match(r'\d{4}-\d{2}-\d{2}', value) else None
+    if parsed is None and parse_datetime(value):
+        parsed = parse_datetime(value).date()
+    for date_format in DATE_FORMATS if parsed is None else ():
+        try:
+            parsed = datetime.strptime(value.split(' ')[0], date_format).date()
+            break
+        except ValueError:
+            continue
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def clean_line(data):
+    """Return ({line field: value}, errors) for one statement row keyed by normalised header."""
+    fields, errors = {}, {}
+    values = {}
+    for field, headers in COLUMNS.items():
+        for header in headers:
+            value = data.get(header)
+            if value is not None and str(value).strip() != '':
+                values[field] = str(value).strip()
+                break
+
+    try:
+        if 'amount' in values:
+            fields['amount'] = _amount(values['amount'])
+        else:
+            credit = _amount(values['credit']) if 'credit' in values else Decimal('0.00')
+            debit = _amount(values['debit']) if 'debit' in values else Decimal('0.00')
+            fields['amount'] = abs(credit) - abs(debit)
+        if not fields['amount']:
+            errors['amount'] = "amount is required"
+    except (ValueError, InvalidOperation):
+        errors['amount'] = f"invalid amount '{values.get('amount') or values.get('credit') or values.get('debit')}'"
+
+    if 'date' in values:
+        try:
+            fields['transaction_date'] = _date(values['date'])
+        except ValueError:
+            errors['date'] = f"invalid date '{values['date']}'"
+    for field, max_length in (('reference', 255), ('counterparty', 255), ('phone', 50), ('tin_number', 50)):
+        fields[field] = values[field][:max_length] if field in values else None
+    fields['description'] = values.get('description')
+    return fields, errors
+
+
+def line_hash(fields, occurrence):
+    """
+    Content hash of a line. Lines with a reference are the same transfer
+    whenever it comes back; identical lines without one are told apart by
+    their position among the identical lines of the file.
+    """
+    parts = [
+        str(fields.get('transaction_date') or ''), str(fields['amount']), text_key(fields.get('reference')) or '',
+        phone_key(fields.get('phone')) or '', text_key(fields.get('tin_number')) or '',
+    ]
+    if not fields.get('reference'):
+        parts += [text_key(fields.get('description')) or '', text_key(fields.get('counterparty')) or '', str(occurrence)]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def read_statement(file):
+    """
+    Stream and validate a CSV statement. Returns ([(row number, {field: value})], errors);
+    every line carries its `line_hash`.
+    """
+    if isinstance(file, (bytes, bytearray)):
+        file = io.BytesIO(file)
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    lines, errors, seen = [], [], Counter()
+    try:
+        reader = csv.reader(text)
+        headers = [_header(cell) for cell in next(reader, [])]
+        for number, row in enumerate(reader, start=2):
+            if all(not str(cell).strip() for cell in row):
+                continue
+            fields, row_errors = clean_line(dict(zip(headers, row)))
+            for field, message in row_errors.items():
+                errors.append({'row': number, 'field': field, 'error': message})
+            if row_errors:
+                continue
+            key = line_hash(fields, 0)
+            seen[key] += 1
+            fields['line_hash'] = line_hash(fields, seen[key] - 1) if seen[key] > 1 else key
+            lines.append((number, fields))
+    finally:
+        text.detach()
+    if not lines and not errors:
+        errors.append({'row': 1, 'field': None, 'error': "the statement has no lines"})
+    return lines, errors
+
+
+class OpenItems:
+    """The open orders and purchase expenses indexed for matching, built with one query per table."""
+
+    def __init__(self):
+        self.claimed = set()  # (kind, id) already proposed for a line
+
+        self.order_customer = {}
+        self.order_by_reference = {}
+        self.orders_by_amount = defaultdict(list)
+        self.customer_orders_by_amount = defaultdict(list)
+        for pk, customer_id, receipt_id, unpaid in (
+            open_orders().order_by('order_date', 'id').values_list('id', 'customer_id', 'receipt_id', 'unpaid_amount')
+        ):
+            self.order_customer[pk] = customer_id
+            if text_key(receipt_id):
+                self.order_by_reference.setdefault(text_key(receipt_id), pk)
+            self.orders_by_amount[money(unpaid)].append(pk)
+            if customer_id:
+                self.customer_orders_by_amount[customer_id, money(unpaid)].append(pk)
+
+        self.customer_by_phone, self.customer_by_tin = {}, {}
+        for pk, phone, tin in CustomerInfo.objects.values_list('id', 'phone', 'tin_number'):
+            self._index(self.customer_by_phone, phone_key(phone), pk)
+            self._index(self.customer_by_tin, text_key(tin), pk)
+
+        self.expense_supplier = {}
+        self.expenses_by_amount = defaultdict(list)
+        self.supplier_expenses_by_amount = defaultdict(list)
+        for pk, supplier_id, unpaid in (
+            PurchaseExpense.objects.filter(unpaid_amount__gt=0).exclude(payment_status='Paid')
+            .order_by('purchase_date', 'id').values_list('id', 'supplier_level_id', 'unpaid_amount')
+        ):
+            self.expense_supplier[pk] = supplier_id
+            self.expenses_by_amount[money(unpaid)].append(pk)
+            if supplier_id:
+                self.supplier_expenses_by_amount[supplier_id, money(unpaid)].append(pk)
+
+        self.supplier_by_phone, self.supplier_by_tin, self.supplier_by_name = {}, {}, {}
+        for pk, phone, tin, name in PurchaseSupplier.objects.values_list(
+            'id', 'supplier__contact_info', 'supplier__tin_number', 'supplier__name'
+        ):
+            self._index(self.supplier_by_phone, phone_key(phone), pk)
+            self._index(self.supplier_by_tin, text_key(tin), pk)
+            self._index(self.supplier_by_name, text_key(name), pk)
+
+    @staticmethod
+    def _index(index, key, pk):
+        # A key shared by several parties identifies none of them
+        if key:
+            index[key] = pk if index.get(key, pk) == pk else None
+
+    def _first_unclaimed(self, kind, ids, only_one=False):
+        ids = [pk for pk in ids if (kind, pk) not in self.claimed]
+        if not ids or (only_one and len(ids) > 1):
+            return None
+        self.claimed.add((kind, ids[0]))
+        return ids[0]
+
+    def match_received(self, fields, amount):
+        for token in tokens(fields.get('reference'), fields.get('description')):
+            pk = self.order_by_reference.get(token)
+            if pk and (StatementLine.ORDER, pk) not in self.claimed:
+                self.claimed.add((StatementLine.ORDER, pk))
+                return StatementLine.ORDER, pk, 'reference'
+        customer_id = (
+            self.customer_by_tin.get(text_key(fields.get('tin_number')))
+            or self.customer_by_phone.get(phone_key(fields.get('phone')))
+        )
+        if customer_id:
+            pk = self._first_unclaimed(StatementLine.ORDER, self.customer_orders_by_amount.get((customer_id, amount), ()))
+            if pk:
+                return StatementLine.ORDER, pk, 'party and amount'
+            return StatementLine.CUSTOMER, customer_id, 'party'
+        pk = self._first_unclaimed(StatementLine.ORDER, self.orders_by_amount.get(amount, ()), only_one=True)
+        if pk:
+            return StatementLine.ORDER, pk, 'amount'
+        return None
+
+    def match_paid(self, fields, amount):
+        supplier_id = (
+            self.supplier_by_tin.get(text_key(fields.get('tin_number')))
+            or self.supplier_by_phone.get(phone_key(fields.get('phone')))
+            or self.supplier_by_name.get(text_key(fields.get('counterparty')))
+        )
+        if supplier_id:
+            pk = self._first_unclaimed(StatementLine.EXPENSE, self.supplier_expenses_by_amount.get((supplier_id, amount), ()))
+            if pk:
+                return StatementLine.EXPENSE, pk, 'party and amount'
+            return StatementLine.SUPPLIER, supplier_id, 'party'
+        pk = self._first_unclaimed(StatementLine.EXPENSE, self.expenses_by_amount.get(amount, ()), only_one=True)
+        if pk:
+            return StatementLine.EXPENSE, pk, 'amount'
+        return None
+
+    def match(self, fields):
+        """(kind, id, reason) proposed for a line, or None."""
+        amount = money(fields['amount'])
+        return self.match_received(fields, amount) if amount > 0 else self.match_paid(fields, -amount)
+
+
+def set_match(line, kind, pk, reason, items=None):
+    """Point `line` at document / party `pk` of `kind` (the order's customer or the expense's supplier too)."""
+    line.match_kind, line.match_reason = kind, reason
+    line.order_id = pk if kind == StatementLine.ORDER else None
+    line.expense_id = pk if kind == StatementLine.EXPENSE else None
+    line.customer_id = pk if kind == StatementLine.CUSTOMER else None
+    line.purchase_supplier_id = pk if kind == StatementLine.SUPPLIER else None
+    if items is not None and kind == StatementLine.ORDER:
+        line.customer_id = items.order_customer.get(pk)
+    if items is not None and kind == StatementLine.EXPENSE:
+        line.purchase_supplier_id = items.expense_supplier.get(pk)
+    line.status = StatementLine.PROPOSED if kind else StatementLine.UNMATCHED
+
+
+def propose_matches(lines):
+    """Unsaved StatementLines for [(row number, fields)], each with its proposed match."""
+    items = OpenItems()
+    proposed = []
+    for number, fields in lines:
+        line = StatementLine(row=number, **fields)
+        set_match(line, *(items.match(fields) or (None, None, None)), items=items)
+        proposed.append(line)
+    return proposed
+
+
+def import_statement(file, name=None, source=None, user=None):
+    """
+    Read, match and store a statement. Returns (statement, errors, duplicates);
+    nothing is stored when some rows are invalid.
+    """
+    lines, errors = read_statement(file)
+    if errors:
+        return None, errors, 0
+
+    hashes = [fields['line_hash'] for _, fields in lines]
+    known = set()
+    for start in range(0, len(hashes), BATCH_SIZE):
+        known.update(StatementLine.objects.filter(line_hash__in=hashes[start:start + BATCH_SIZE]).values_list('line_hash', flat=True))
+    new_lines = []
+    for number, fields in lines:
+        # A reference repeated within the file is the same transfer too
+        if fields['line_hash'] not in known:
+            known.add(fields['line_hash'])
+            new_lines.append((number, fields))
+
+    proposed = propose_matches(new_lines)
+    with transaction.atomic():
+        statement = BankStatement.objects.create(
+            name=name, source=source, line_count=len(proposed), duplicate_count=len(lines) - len(new_lines), user=user,
+        )
+        for line in proposed:
+            line.statement = statement
+        StatementLine.objects.bulk_create(proposed, batch_size=BATCH_SIZE)
+    return statement, [], len(lines) - len(new_lines)
+
+
+def _paid_at(line):
+    if not line.transaction_date:
+        return timezone.now()
+    return timezone.make_aware(datetime.combine(line.transaction_date, time.min))
+
+
+def apply_statement(statement, decisions=None, user=None):
+    """
+    Turn statement lines into payments. `decisions` is {line id: (kind, id)}
+    confirming or overriding matches, or {line id: None} to accept the
+    proposal; without it every proposed line is applied. Returns (applied
+    line count, errors); nothing is written when there are errors.
+    """
+    errors = []
+    with transaction.atomic():
+        lines = statement.lines.select_for_update().exclude(status=StatementLine.APPLIED).order_by('id')
+        if decisions is None:
+            lines = lines.filter(status=StatementLine.PROPOSED)
+        else:
+            lines = lines.filter(id__in=list(decisions))
+        lines = list(lines)
+        if decisions is not None:
+            missing = set(decisions) - {line.pk for line in lines}
+            errors += [{'line': pk, 'error': "not an unapplied line of this statement"} for pk in sorted(missing)]
+            for line in lines:
+                if decisions[line.pk] is not None:
+                    set_match(line, *decisions[line.pk], 'confirmed')
+
+        orders = Order.objects.select_related('customer').in_bulk([line.order_id for line in lines if line.order_id])
+        expenses = PurchaseExpense.objects.select_related('supplier_level').in_bulk(
+            [line.expense_id for line in lines if line.expense_id]
+        )
+        customers = CustomerInfo.objects.in_bulk([line.customer_id for line in lines if line.customer_id])
+        suppliers = PurchaseSupplier.objects.in_bulk([line.purchase_supplier_id for line in lines if line.purchase_supplier_id])
+
+        received, paid = [], []  # (line, payment entry)
+        for line in lines:
+            details = {
+                'method': statement.source or 'Bank statement', 'reference': line.reference,
+                'note': line.description, 'paid_at': _paid_at(line),
+            }
+            amount = abs(line.amount)
+            if line.match_kind in (StatementLine.ORDER, StatementLine.CUSTOMER):
+                order = orders.get(line.order_id)
+                customer = order.customer if order else customers.get(line.customer_id)
+                if line.amount < 0 or customer is None or (line.order_id and order is None):
+                    errors.append({'line': line.pk, 'error': "needs money received and an order with a customer, or a customer"})
+                    continue
+                line.customer_id = customer.pk
+                received.append((line, (customer, amount, details, {order.pk} if order else None)))
+            elif line.match_kind in (StatementLine.EXPENSE, StatementLine.SUPPLIER):
+                expense = expenses.get(line.expense_id)
+                supplier = expense.supplier_level if expense else suppliers.get(line.purchase_supplier_id)
+                if line.amount > 0 or supplier is None or (line.expense_id and expense is None):
+                    errors.append({'line': line.pk, 'error': "needs money paid out and an expense with a supplier, or a supplier"})
+                    continue
+                line.purchase_supplier_id = supplier.pk
+                paid.append((line, (supplier, amount, details, {expense.pk} if expense else None)))
+            else:
+                errors.append({'line': line.pk, 'error': "has no match to apply"})
+        if errors:
+            return 0, errors
+
+        payments = allocate_customer_payments([entry for _, entry in received], user=user) if received else []
+        payments += allocate_supplier_payments([entry for _, entry in paid], user=user) if paid else []
+        applied = [line for line, _ in received + paid]
+        for line, payment in zip(applied, payments):
+            line.payment = payment
+            line.status = StatementLine.APPLIED
+        StatementLine.objects.bulk_update(
+            applied,
+            ['status', 'match_kind', 'match_reason', 'customer', 'order', 'purchase_supplier', 'expense', 'payment'],
+            batch_size=BATCH_SIZE,
+        )
+    return len(applied), []
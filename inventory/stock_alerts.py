@@ -0,0 +1,99 @@
+"""
+Low-stock tracking.
+
+A product is low on stock when its stock is at or below its reorder point: the
+product's own `reorder_point`, else its category's, else
+``settings.DEFAULT_REORDER_POINT``. `Product.is_low_stock` is kept current by
+the Product and Category signals so the shortage endpoints read an indexed
+flag, and every time a product crosses the threshold a StockAlertEvent is
+appended for clients to poll by id.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, F, Value, BooleanField, Q
+from django.db.models.functions import Coalesce
+
+from .models import Product, StockAlertEvent
+
+
+def default_reorder_point():
+    return getattr(settings, 'DEFAULT_REORDER_POINT', 3)
+
+
+def reorder_point_for(product):
+    if product.reorder_point is not None:
+        return product.reorder_point
+    if product.category_id and product.category.reorder_point is not None:
+        return product.category.reorder_point
+    return default_reorder_point()
+
+
+def is_low(stock, reorder_point):
+    return stock is not None and stock <= reorder_point
+
+
+def _event(product_id, low, stock, reorder_point):
+    return StockAlertEvent(
+        product_id=product_id,
+        kind=StockAlertEvent.LOW if low else StockAlertEvent.RESTOCKED,
+        stock=stock,
+        reorder_point=reorder_point,
+    )
+
+
+def sync_low_stock(product):
+    """Called after a product save: flip the flag and record the crossing if the threshold was crossed."""
+    reorder_point = reorder_point_for(product)
+    low = is_low(product.stock, reorder_point)
+    if 'is_low_stock' in product.__dict__:
+        current = product.is_low_stock
+    else:
+        current = Product.objects.filter(pk=product.pk).values_list('is_low_stock', flat=True).first()
+    if current == low:
+        return None
+
+    with transaction.atomic():
+        Product.objects.filter(pk=product.pk).update(is_low_stock=low)
+        event = _event(product.pk, low, product.stock, reorder_point)
+        event.save()
+    product.is_low_stock = low
+    return event
+
+
+def refresh_low_stock(products=None):
+    """
+    Recompute the flag for `products` (a queryset or ids, all products when omitted)
+    in bulk, e.g. after a category reorder point or the default changes, or after
+    stock was written with queryset/bulk updates. Returns the number of products flipped.
+    """
+    if products is None:
+        products = Product.objects.all()
+    elif not hasattr(products, 'filter'):
+        products = Product.objects.filter(pk__in=list(products))
+
+    reorder_point = Coalesce('reorder_point', 'category__reorder_point', Value(default_reorder_point()))
+    should_be_low = Case(
+        When(Q(stock__isnull=False) & Q(stock__lte=reorder_point), then=Value(True)),
+        default=Value(False),
+        output_field=BooleanField(),
+    )
+    flipped = (
+        products.annotate(threshold=reorder_point, should_be_low=should_be_low)
+        .exclude(is_low_stock=F('should_be_low'))
+        .values_list('id', 'stock', 'threshold', 'should_be_low')
+    )
+
+    rows = list(flipped)
+    if not rows:
+        return 0
+    with transaction.atomic():
+        for low in (True, False):
+            ids = [pk for pk, _, _, flag in rows if flag == low]
+            if ids:
+                Product.objects.filter(pk__in=ids).update(is_low_stock=low)
+        StockAlertEvent.objects.bulk_create(
+            [_event(pk, low, stock, threshold) for pk, stock, threshold, low in rows],
+            batch_size=1000,
+        )
+    return len(rows)
+
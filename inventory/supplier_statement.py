@@ -0,0 +1,200 @@
+"""
+Supplier statement: opening balance, dated purchases and payments with a
+running balance, and the closing balance for a date range.
+
+The entries of a purchase supplier are its purchase expenses (debits, on the
+purchase date) and the payment allocations to those expenses (credits, on the
+local date of the allocation; see inventory.payments). Both halves are built as
+ORM querysets so the date truncation is right for the backend and time zone,
+and combined into one SQL statement: a CTE over their UNION ALL, and
+SUM(debit - credit) OVER (ORDER BY date, purchases before payments, id) for the
+running balance. The window runs over the whole history, so the balances in
+the range are true balances without reading earlier rows into Python.
+
+A statement costs two queries whatever the length of the history: one for the
+opening / period / closing totals and one whose cursor is read in chunks while
+the response streams (JSON or XLSX).
+"""
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import CharField, DecimalField, F, IntegerField, Value
+from django.db.models.functions import TruncDate
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .exports import stream_xlsx
+from .models import PaymentAllocation, PurchaseExpense
+
+
+CHUNK_SIZE = 2000
+ZERO = Decimal('0.00')
+MONEY = DecimalField(max_digits=20, decimal_places=2)
+
+ENTRY_COLUMNS = ('entry_date', 'entry_order', 'entry_id', 'entry_type', 'expense_id', 'payment_id', 'reference', 'debit', 'credit')
+PURCHASE, PAYMENT = 0, 1
+
+# Allocation source -> statement entry type
+PAYMENT_TYPES = {
+    PaymentAllocation.PAYMENT: 'Payment',
+    PaymentAllocation.DOCUMENT: 'Payment',
+    PaymentAllocation.OPENING: 'Payment (opening)',
+    PaymentAllocation.RECONCILE: 'Adjustment',
+}
+
+
+def money(value):
+    return Decimal(str(value or 0)).quantize(ZERO)
+
+
+def entries_sql(purchase_supplier_id):
+    """(sql, params) of the UNION ALL of the supplier's purchases and payments, columns as ENTRY_COLUMNS."""
+    # Same annotations in the same order on both sides: they are the select list of the union
+    purchases = PurchaseExpense.objects.filter(supplier_level_id=purchase_supplier_id).annotate(
+        entry_date=F('purchase_date'),
+        entry_order=Value(PURCHASE, output_field=IntegerField()),
+        entry_id=F('id'),
+        entry_type=Value('Purchase', output_field=CharField()),
+        entry_expense=F('id'),
+        entry_payment=Value(None, output_field=IntegerField()),
+        entry_reference=Value(None, output_field=CharField()),
+        debit=F('total'),
+        credit=Value(ZERO, output_field=MONEY),
+    )
+    payments = PaymentAllocation.objects.filter(expense__supplier_level_id=purchase_supplier_id).annotate(
+        entry_date=TruncDate('created_at', tzinfo=timezone.get_current_timezone()),
+        entry_order=Value(PAYMENT, output_field=IntegerField()),
+        entry_id=F('id'),
+        entry_type=F('source'),
+        entry_expense=F('expense_id'),
+        entry_payment=F('payment_id'),
+        entry_reference=F('payment__reference'),
+        debit=Value(ZERO, output_field=MONEY),
+        credit=F('amount'),
+    )
+    names = ['entry_date', 'entry_order', 'entry_id', 'entry_type', 'entry_expense', 'entry_payment', 'entry_reference', 'debit', 'credit']
+    union = purchases.values_list(*names).order_by().union(payments.values_list(*names).order_by(), all=True)
+    return union.query.sql_with_params()
+
+
+def _with_entries(purchase_supplier_id, sql, params):
+    entries, entry_params = entries_sql(purchase_supplier_id)
+    return f"WITH entries ({', '.join(ENTRY_COLUMNS)}) AS ({entries}) {sql}", (*entry_params, *params)
+
+
+def _period(start, end):
+    """SQL condition on entry_date for start..end (either may be None) and its params."""
+    conditions, params = [], []
+    if start:
+        conditions.append("entry_date >= %s")
+        params.append(start)
+    if end:
+        conditions.append("entry_date <= %s")
+        params.append(end)
+    return ' AND '.join(conditions) or '1 = 1', params
+
+
+def statement_totals(purchase_supplier_id, start=None, end=None):
+    """{opening_balance, debits, credits, closing_balance, entry_count} for start..end, in one query."""
+    period, period_params = _period(start, end)
+    before = "entry_date < %s" if start else "1 = 0"
+    before_params = [start] if start else []
+    until, until_params = _period(None, end)
+    sql, params = _with_entries(purchase_supplier_id, f"""
+        SELECT
+            COALESCE(SUM(CASE WHEN {before} THEN debit - credit ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN {period} THEN debit ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN {period} THEN credit ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN {until} THEN debit - credit ELSE 0 END), 0),
+            COUNT(CASE WHEN {period} THEN 1 END)
+        FROM entries
+    """, [*before_params, *period_params, *period_params, *until_params, *period_params])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        opening, debits, credits, closing, count = cursor.fetchone()
+    return {
+        'opening_balance': money(opening),
+        'debits': money(debits),
+        'credits': money(credits),
+        'closing_balance': money(closing),
+        'entry_count': count,
+    }
+
+
+def statement_entries(purchase_supplier_id, start=None, end=None):
+    """Yield the entries of start..end in statement order, each with its running balance."""
+    period, period_params = _period(start, end)
+    sql, params = _with_entries(purchase_supplier_id, f"""
+        , ledger AS (
+            SELECT entries.*, SUM(debit - credit) OVER (
+                ORDER BY entry_date, entry_order, entry_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ) AS balance
+            FROM entries
+        )
+        SELECT {', '.join(ENTRY_COLUMNS)}, balance FROM ledger
+        WHERE {period}
+        ORDER BY entry_date, entry_order, entry_id
+    """, period_params)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            for entry_date, order, pk, entry_type, expense_id, payment_id, reference, debit, credit, balance in rows:
+                yield {
+                    # SQLite hands dates back as text
+                    'date': parse_date(entry_date) if isinstance(entry_date, str) else entry_date,
+                    'type': 'Purchase' if order == PURCHASE else PAYMENT_TYPES.get(entry_type, entry_type),
+                    'expense': expense_id,
+                    'payment': payment_id,
+                    'reference': reference,
+                    'debit': money(debit),
+                    'credit': money(credit),
+                    'balance': money(balance),
+                }
+
+
+def _json(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def stream_statement_json(header, entries):
+    """The statement as one JSON document, written entry by entry."""
+    def chunks():
+        yield _json(header)[:-1] + ', "entries": ['
+        for index, entry in enumerate(entries):
+            yield (', ' if index else '') + _json(entry)
+        yield ']}'
+    return StreamingHttpResponse(chunks(), content_type='application/json')
+
+
+def statement_sheet_rows(header, entries):
+    yield ['Supplier', header['supplier_name']]
+    yield ['From', header['start_date'], 'To', header['end_date']]
+    yield []
+    yield ['Date', 'Type', 'Expense', 'Payment', 'Reference', 'Debit', 'Credit', 'Balance']
+    yield [header['start_date'], 'Opening balance', None, None, None, None, None, header['opening_balance']]
+    for entry in entries:
+        yield [entry['date'], entry['type'], entry['expense'], entry['payment'], entry['reference'],
+               entry['debit'], entry['credit'], entry['balance']]
+    yield [header['end_date'], 'Closing balance', None, None, None, header['debits'], header['credits'], header['closing_balance']]
+
+
+def statement_response(purchase_supplier, start=None, end=None, output='json'):
+    header = {
+        'supplier': purchase_supplier.pk,
+        'supplier_name': purchase_supplier.supplier.name if purchase_supplier.supplier else None,
+        'start_date': start,
+        'end_date': end,
+        **statement_totals(purchase_supplier.pk, start, end),
+    }
+    entries = statement_entries(purchase_supplier.pk, start, end)
+    if output == 'xlsx':
+        return stream_xlsx(
+            statement_sheet_rows(header, entries), f'supplier_statement_{purchase_supplier.pk}.xlsx', title='Statement'
+        )
+    return stream_statement_json(header, entries)
@@ -0,0 +1,108 @@
+"""
+Background job handlers (see inventory.jobs, which lists them by import path
+in JOB_HANDLERS). Each returns a JSON-serialisable summary stored on the job;
+file output is attached with `save_result_file`.
+"""
+import json
+import tempfile
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.files.base import ContentFile
+from django.utils.dateparse import parse_date
+
+from .exports import ORDER_REPORT_COLUMNS, export_to_file, product_rows, queryset_rows
+from .imports import plan_import, apply_import
+from .yearly_report import build_yearly_report
+from .forecast import build_forecasts
+from .health import refresh_product_health
+from .models import Product, Report, PurchaseSupplier
+from .payables import supplier_report_payload
+
+
+def _counted(rows, context, total, every=1000):
+    """Pass rows through while reporting progress (the header row is not counted)."""
+    for done, row in enumerate(rows):
+        if done and done % every == 0:
+            context.progress(done, total)
+        yield row
+
+
+def import_products(context):
+    job = context.job
+    with job.input_file.open('rb') as workbook:
+        result = plan_import(workbook, progress=lambda n: context.progress(n, message="Validating rows"))
+    if result.errors:
+        raise ValueError(f"The file has {len(result.errors)} invalid rows; nothing was imported.")
+    if context.params.get('dry_run'):
+        return json.loads(json.dumps(result.summary(with_changes=True), cls=DjangoJSONEncoder))
+
+    total = len(result.created) + len(result.updated)
+    context.progress(0, total, message="Writing products", force=True)
+    apply_import(result, user=job.user, progress=lambda n: context.progress(n, total))
+    return result.summary()
+
+
+def export_products(context):
+    output = context.params.get('output', 'xlsx')
+    products = Product.objects.all()
+    total = products.count()
+    context.progress(0, total, message="Exporting products", force=True)
+    result = export_to_file(_counted(product_rows(products), context, total), output, title='Products')
+    context.save_result_file(f'products.{output}', result)
+    return {'rows': total}
+
+
+def export_order_report(context):
+    output = context.params.get('output', 'xlsx')
+    start = parse_date(context.params.get('start_date') or '')
+    end = parse_date(context.params.get('end_date') or '')
+    if not (start and end):
+        raise ValueError("start_date and end_date are required.")
+    reports = (
+        Report.objects.filter(order_date__gte=start, order_date__lt=end + timedelta(days=1))
+        .order_by('order_date', 'id')
+    )
+
+    total = reports.count()
+    context.progress(0, total, message="Exporting order report", force=True)
+    rows = queryset_rows(reports, ORDER_REPORT_COLUMNS)
+    result = export_to_file(_counted(rows, context, total), output, title='Order Report')
+    context.save_result_file(f'order_report.{output}', result)
+    return {'rows': total}
+
+
+def supplier_report(context):
+    from .serializers import Supplier2ReportSerializer
+
+    params = context.params
+    supplier = PurchaseSupplier.objects.get(pk=params['supplier_id'])
+    payload = supplier_report_payload(
+        supplier, parse_date(params.get('start_date') or ''), parse_date(params.get('end_date') or ''),
+    )
+    data = Supplier2ReportSerializer(payload).data
+    content = json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+    context.save_result_file(f'supplier_{supplier.pk}_report.json', ContentFile(content))
+    return {'supplier_id': supplier.pk, 'expenses': len(data.get('expenses', []))}
+
+
+def yearly_report(context):
+    year = int(context.params['year'])
+    context.progress(0, 12, message=f"Building the {year} workbook", force=True)
+    with tempfile.TemporaryFile() as target:
+        summary = build_yearly_report(
+            year, target, workers=context.params.get('workers'),
+            progress=lambda done: context.progress(done, 12, force=True),
+        )
+        target.seek(0)
+        context.save_result_file(f'yearly_report_{year}.xlsx', target)
+    return json.loads(json.dumps({'year': year, 'months': summary}, cls=DjangoJSONEncoder))
+
+
+def demand_forecast(context):
+    products = build_forecasts(progress=lambda done, total, message=None: context.progress(done, total, message))
+    return {'products': products}
+
+
+def product_health(context):
+    return {'products': refresh_product_health(progress=lambda done, total: context.progress(done, total))}
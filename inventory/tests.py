@@ -1,3 +1,286 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .costing import add_layer, rebuild_costs
+from .ledger import stock_on_date, take_snapshot
+from .models import (
+    CostLayer, CustomerInfo, LayerConsumption, Order, OrderItem, Product, PurchaseExpense, PurchaseProduct, PurchaseSupplier,
+    StockMovement, StockSnapshot,
+)
+from .payments import allocate_customer_payment, allocate_supplier_payment, payment_drift
+from .purchase_totals import rebuild_purchase_totals
+from .receivables import rebuild_customer_balances
+from .receiving import receive_expense
+from .report_cache import data_version, order_day_key
+
+
+def sell(product, quantity, unit_price, when=None):
+    """A completed single-line order of `product`; returns the item as stored."""
+    order = Order.objects.create(status='Done')
+    if when is not None:
+        Order.objects.filter(pk=order.pk).update(order_date=when)
+    item = OrderItem.objects.create(
+        order=order, product=product, quantity=quantity, unit_price=unit_price, price=quantity * unit_price, status='Done'
+    )
+    item.refresh_from_db()
+    return item
+
+
+class CostingTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Milk', buying_price=Decimal('10'), selling_price=Decimal('15'), stock=100)
+        # Sold before any purchase was recorded, at the buying price
+        self.early_sale = sell(self.product, 10, Decimal('15'), when=timezone.now() - timedelta(days=2))
+        self.product.stock = 90
+        self.product.save()
+
+    def unit_cost(self):
+        self.product.refresh_from_db()
+        return self.product.unit_cost
+
+    def test_average_replay_matches_incremental(self):
+        add_layer(self.product, 10, Decimal('50'))
+        incremental = self.unit_cost()
+        self.assertEqual(incremental, Decimal('14.0000'))  # (90 x 10 + 10 x 50) / 100
+
+        rebuild_costs([self.product.pk])
+        self.assertEqual(self.unit_cost(), incremental)
+        opening = CostLayer.objects.get(product=self.product, opening=True)
+        self.assertEqual((opening.quantity, opening.unit_cost), (90, Decimal('10.0000')))
+
+    def test_replay_keeps_cost_of_sales_before_the_first_layer(self):
+        self.assertEqual(self.early_sale.cost, Decimal('100.00'))
+        add_layer(self.product, 10, Decimal('50'))
+        rebuild_costs([self.product.pk])
+        self.early_sale.refresh_from_db()
+        self.assertEqual(self.early_sale.cost, Decimal('100.00'))
+
+    def test_replay_adds_the_opening_layer_for_older_layers(self):
+        add_layer(self.product, 10, Decimal('50'))
+        CostLayer.objects.filter(opening=True).delete()
+        rebuild_costs([self.product.pk])
+        self.assertEqual(CostLayer.objects.filter(product=self.product, opening=True).count(), 1)
+        self.assertEqual(self.unit_cost(), Decimal('14.0000'))
+
+    def test_replay_weighs_stock_adjustments_like_the_incremental_path(self):
+        add_layer(self.product, 10, Decimal('50'))
+        self.product.refresh_from_db()
+        self.product.stock += 50  # an adjustment: no layer, only a stock movement
+        self.product.save()
+        add_layer(self.product, 20, Decimal('20'))
+        incremental = self.unit_cost()
+        self.assertEqual(incremental, Decimal('14.7500'))  # (140 x 14 + 20 x 20) / 160
+
+        rebuild_costs([self.product.pk])
+        self.assertEqual(self.unit_cost(), incremental)
+
+    @override_settings(INVENTORY_COSTING_METHOD='fifo')
+    def test_fifo_replay_matches_incremental(self):
+        layer = add_layer(self.product, 10, Decimal('50'))
+        self.assertEqual(self.unit_cost(), Decimal('10.0000'))  # the opening stock goes first
+        sale = sell(self.product, 95, Decimal('15'))
+        layer.refresh_from_db()
+        incremental = (self.unit_cost(), layer.remaining)
+        self.assertEqual(incremental, (Decimal('50.0000'), 5))
+
+        rebuild_costs([self.product.pk])
+        layer.refresh_from_db()
+        self.assertEqual((self.unit_cost(), layer.remaining), incremental)
+        sale.refresh_from_db()
+        self.assertEqual(sale.cost, Decimal('1150.00'))  # 90 x 10 + 5 x 50
+
+    @override_settings(INVENTORY_COSTING_METHOD='fifo')
+    def test_fifo_reduced_or_cancelled_sale_gives_its_layers_back(self):
+        layer = add_layer(self.product, 10, Decimal('50'))
+        sale = sell(self.product, 95, Decimal('15'))
+        sale.quantity = 92
+        sale.save()
+        layer.refresh_from_db()
+        self.assertEqual((self.unit_cost(), layer.remaining), (Decimal('50.0000'), 8))
+
+        sale.order.status = 'Cancelled'
+        sale.order.save()
+        layer.refresh_from_db()
+        opening = CostLayer.objects.get(product=self.product, opening=True)
+        self.assertEqual((opening.remaining, layer.remaining), (90, 10))
+        self.assertEqual(self.unit_cost(), Decimal('10.0000'))
+        self.assertFalse(LayerConsumption.objects.exists())
+
+    @override_settings(INVENTORY_COSTING_METHOD='fifo')
+    def test_fifo_deleted_sale_gives_its_layers_back_and_matches_a_rebuild(self):
+        layer = add_layer(self.product, 10, Decimal('50'))
+        kept = sell(self.product, 50, Decimal('15'))
+        deleted = sell(self.product, 45, Decimal('15'))
+        deleted.delete()
+        layer.refresh_from_db()
+        opening = CostLayer.objects.get(product=self.product, opening=True)
+        incremental = (opening.remaining, layer.remaining, self.unit_cost())
+        self.assertEqual(incremental, (40, 10, Decimal('10.0000')))
+
+        rebuild_costs([self.product.pk])
+        layer.refresh_from_db()
+        opening.refresh_from_db()
+        self.assertEqual((opening.remaining, layer.remaining, self.unit_cost()), incremental)
+        self.assertEqual(list(kept.layer_consumptions.values_list('layer_id', 'quantity')), [(opening.pk, 50)])
+
+    def test_replay_bumps_the_days_of_recosted_sales(self):
+        layer = add_layer(self.product, 10, Decimal('50'))
+        sale = sell(self.product, 5, Decimal('15'))
+        keys = [order_day_key(timezone.localdate(sale.order.order_date))]
+        CostLayer.objects.filter(pk=layer.pk).update(unit_cost=Decimal('20'))
+        before = data_version(keys)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_costs([self.product.pk])
+        sale.refresh_from_db()
+        self.assertEqual(sale.cost, Decimal('55.00'))  # 5 x (90 x 10 + 10 x 20) / 100
+        self.assertGreater(data_version(keys), before)
+
+
+class PaymentAllocationTests(TestCase):
+    def setUp(self):
+        self.customer = CustomerInfo.objects.create(name='Abebe')
+        self.newer = Order.objects.create(
+            customer=self.customer, total_amount=30, paid_amount=10, unpaid_amount=20, payment_status='Pending'
+        )
+        self.older = Order.objects.create(
+            customer=self.customer, total_amount=40, paid_amount=0, unpaid_amount=40, payment_status='Unpaid'
+        )
+        Order.objects.filter(pk=self.older.pk).update(order_date=timezone.now() - timedelta(days=5))
+
+        self.supplier = PurchaseSupplier.objects.create()
+        self.old_expense = PurchaseExpense.objects.create(
+            supplier_level=self.supplier, total=100, paid_amount=20, unpaid_amount=80,
+            purchase_date=timezone.localdate() - timedelta(days=3),
+        )
+        self.new_expense = PurchaseExpense.objects.create(
+            supplier_level=self.supplier, total=50, paid_amount=0, unpaid_amount=50, payment_status='Unpaid'
+        )
+
+    def amounts(self, document):
+        document.refresh_from_db()
+        return document.payment_status, document.paid_amount, document.unpaid_amount
+
+    def test_customer_payment_settles_the_oldest_order_first(self):
+        payment = allocate_customer_payment(self.customer, Decimal('50'))
+        self.assertEqual(payment.unallocated, Decimal('0.00'))
+        self.assertEqual(self.amounts(self.older), ('Paid', Decimal('40.00'), Decimal('0.00')))
+        self.assertEqual(self.amounts(self.newer), ('Pending', Decimal('20.00'), Decimal('10.00')))
+
+        payment = allocate_customer_payment(self.customer, Decimal('30'))
+        self.assertEqual(payment.unallocated, Decimal('20.00'))
+        self.assertEqual(self.amounts(self.newer), ('Paid', Decimal('30.00'), Decimal('0.00')))
+        self.assertEqual(payment_drift('order'), [])
+        self.assertEqual(rebuild_customer_balances(), {})
+
+    def test_supplier_payment_settles_the_oldest_expense_first(self):
+        payment = allocate_supplier_payment(self.supplier, Decimal('100'))
+        self.assertEqual(payment.unallocated, Decimal('0.00'))
+        self.assertEqual(self.amounts(self.old_expense), ('Paid', Decimal('100.00'), Decimal('0.00')))
+        self.assertEqual(self.amounts(self.new_expense), ('Pending', Decimal('20.00'), Decimal('30.00')))
+
+        payment = allocate_supplier_payment(self.supplier, Decimal('45'))
+        self.assertEqual(payment.unallocated, Decimal('15.00'))
+        self.assertEqual(self.amounts(self.new_expense), ('Paid', Decimal('50.00'), Decimal('0.00')))
+        self.supplier.refresh_from_db()
+        self.assertEqual((self.supplier.paid_amount, self.supplier.unpaid_amount), (Decimal('150.00'), Decimal('0.00')))
+        self.assertEqual(payment_drift('expense'), [])
+        self.assertEqual(rebuild_purchase_totals(), {})
+
+
+class PurchaseTotalsTests(TestCase):
+    def setUp(self):
+        self.supplier = PurchaseSupplier.objects.create()
+        self.expense = PurchaseExpense.objects.create(supplier_level=self.supplier, payment_status='Unpaid')
+        self.line = PurchaseProduct.objects.create(expense=self.expense, quantity=2, unit_price=10, total_price=20)
+        PurchaseProduct.objects.create(expense=self.expense, quantity=3, unit_price=10, total_price=30)
+
+    def totals(self):
+        self.expense.refresh_from_db()
+        self.supplier.refresh_from_db()
+        return (
+            (self.expense.total, self.expense.unpaid_amount),
+            (self.supplier.total_amount, self.supplier.unpaid_amount),
+        )
+
+    def test_new_lines_add_to_the_expense_and_supplier(self):
+        self.assertEqual(self.totals(), ((Decimal('50.00'), Decimal('50.00')), (Decimal('50.00'), Decimal('50.00'))))
+        self.assertEqual(rebuild_purchase_totals(), {})
+
+    def test_line_edit_moves_the_totals_by_the_difference(self):
+        self.line.quantity, self.line.total_price = 5, Decimal('50')
+        self.line.save()
+        self.assertEqual(self.totals(), ((Decimal('80.00'), Decimal('80.00')), (Decimal('80.00'), Decimal('80.00'))))
+        self.assertEqual(rebuild_purchase_totals(), {})
+
+    def test_line_delete_takes_its_total_off(self):
+        self.line.delete()
+        self.assertEqual(self.totals(), ((Decimal('30.00'), Decimal('30.00')), (Decimal('30.00'), Decimal('30.00'))))
+        self.assertEqual(rebuild_purchase_totals(), {})
+
+    def test_line_edit_after_a_payment_keeps_the_paid_amount(self):
+        allocate_supplier_payment(self.supplier, Decimal('50'))
+        self.line.total_price = Decimal('35')
+        self.line.save()
+        self.expense.refresh_from_db()
+        self.assertEqual((self.expense.payment_status, self.expense.paid_amount), ('Pending', Decimal('50.00')))
+        self.assertEqual(self.totals(), ((Decimal('65.00'), Decimal('15.00')), (Decimal('65.00'), Decimal('15.00'))))
+        self.assertEqual(rebuild_purchase_totals(), {})
+        self.assertEqual(payment_drift('expense'), [])
+
+
+class ReceivingTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Milk', buying_price=Decimal('10'), selling_price=Decimal('15'), stock=110)
+        self.sale = sell(self.product, 10, Decimal('15'), when=timezone.now() - timedelta(days=2))
+        self.product.refresh_from_db()
+        self.product.stock = 100
+        self.product.save()
+        self.expense = PurchaseExpense.objects.create(purchase_date=timezone.localdate() - timedelta(days=5))
+        self.line = PurchaseProduct.objects.create(
+            expense=self.expense, quantity=10, unit_price=50, total_price=500, linked_product=self.product
+        )
+
+    def test_a_linked_line_has_no_cost_layer_until_received(self):
+        self.assertFalse(CostLayer.objects.exists())
+        self.product.refresh_from_db()
+        self.assertIsNone(self.product.unit_cost)
+
+    def test_receive_moves_the_cost_from_the_stock_on_hand(self):
+        result, errors = receive_expense(self.expense)
+        self.assertEqual((result['received'], errors), ([self.line.pk], []))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 110)
+        self.assertEqual(self.product.unit_cost, Decimal('13.6364'))  # (100 x 10 + 10 x 50) / 110
+        self.assertEqual(self.product.buying_price, Decimal('10.00'))
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.cost, Decimal('100.00'))
+
+        rebuild_costs([self.product.pk])
+        self.product.refresh_from_db()
+        self.sale.refresh_from_db()
+        self.assertEqual((self.product.unit_cost, self.sale.cost), (Decimal('13.6364'), Decimal('100.00')))
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Milk', buying_price=Decimal('10'), selling_price=Decimal('15'), stock=100)
+        StockMovement.objects.update(timestamp=timezone.now() - timedelta(days=3))
+        self.product.stock = 80
+        self.product.save()
+        self.yesterday = timezone.localdate() - timedelta(days=1)
+
+    def stock_on(self, day):
+        return stock_on_date(day).get(pk=self.product.pk).stock_on_date
+
+    def test_past_snapshot_holds_the_stock_of_that_day(self):
+        take_snapshot(self.yesterday)
+        snapshot = StockSnapshot.objects.get(product=self.product)
+        self.assertEqual((snapshot.date, snapshot.stock), (self.yesterday, 100))
+        self.assertEqual((self.stock_on(self.yesterday), self.stock_on(timezone.localdate())), (100, 80))
+
+    def test_future_snapshot_is_refused(self):
+        with self.assertRaises(ValueError):
+            take_snapshot(timezone.localdate() + timedelta(days=1))
@@ -17,6 +17,9 @@ from .views import (
 
     RetriveRevenueAPIView,
     RetriveProfitAPIView,
+    ProfitAnalyticsAPIView,
+    SalesTrendAPIView,
+    SalesPivotAPIView,
     ExcelReportAPIView,
     OrderLogAPIView,
 
@@ -33,6 +36,7 @@ from .views import (
     OtherExpensesRetrieveUpdateDeleteAPIView,
 
     RetriveTotalProductCostAPIView,
+    StockValuationAPIView,
     ProductExcelReportAPIView,
 
     ProductsPerSupplierAPIView,
@@ -40,6 +44,7 @@ from .views import (
     OrderReceiptAPIView,
     SalesPersonDashboardAPIView,
     RecentOrderLimitedAPIView,
+    DashboardAPIView,
     RetriveSalesPersonRevenueAPIView,
     RetriveTotalOrdersAPIView,
 
@@ -62,9 +67,42 @@ from .views import (
     OrderItemDetailView,
     OrderCreditListAPIView,
     OrderItemCreditListView,
+    CustomerBalanceListView,
+    CustomerBalanceAPIView,
+    ReceivablesAgingAPIView,
+    PayablesAgingAPIView,
+    PurchaseExpenseReceiveAPIView,
+    CustomerPaymentAPIView,
+    SupplierPaymentAPIView,
+    BankStatementListView,
+    BankStatementImportAPIView,
+    StatementLineListView,
+    StatementApplyAPIView,
 
     OrderLogListView,
     ProductLogAPIView,
+    ProductMovementListView,
+    StockAlertEventListAPIView,
+    ImportProductExcelAsyncAPIView,
+    ExportProductExcelAsyncAPIView,
+    ExcelReportAsyncAPIView,
+    YearlyReportAsyncAPIView,
+    DemandForecastAsyncAPIView,
+    ReorderSuggestionAPIView,
+    ProductHealthListView,
+    ProductHealthSummaryAPIView,
+    ProductHealthAsyncAPIView,
+    OrderReportExportAPIView,
+    SupplierReportAsyncView,
+    BackgroundJobListView,
+    BackgroundJobDetailView,
+    BackgroundJobCancelAPIView,
+    BackgroundJobDownloadAPIView,
+    StockLotListCreateView,
+    StockLotDetailView,
+    NearExpiryLotListView,
+    CountNearExpiryProductAPIView,
+    StockAtDateAPIView,
 
     ProductWithBundleAPIView,
     ProductWithOutBundleAPIView,
@@ -89,6 +127,7 @@ from .views import (
     SupplierReport,
     ExpenseReport,
     SupplierReportView,
+    SupplierStatementView,
 
     TotalOrderAPIView,
     TotalProductAPIView,
@@ -113,6 +152,16 @@ urlpatterns = [
 
     path('orders-credit', OrderCreditListAPIView.as_view(), name='orders-credit-list'),
     path('orderitems-credit', OrderItemCreditListView.as_view(), name='orders-credit-items-list'),
+    path('customer-balances/', CustomerBalanceListView.as_view(), name='customer-balances'),
+    path('customers/<int:pk>/balance/', CustomerBalanceAPIView.as_view(), name='customer-balance'),
+    path('receivables/aging/', ReceivablesAgingAPIView.as_view(), name='receivables-aging'),
+    path('payables/aging/', PayablesAgingAPIView.as_view(), name='payables-aging'),
+    path('customers/<int:pk>/payments/', CustomerPaymentAPIView.as_view(), name='customer-payments'),
+    path('purchase-suppliers/<int:pk>/payments/', SupplierPaymentAPIView.as_view(), name='supplier-payments'),
+    path('statements/', BankStatementListView.as_view(), name='statements'),
+    path('statements/import/', BankStatementImportAPIView.as_view(), name='statement-import'),
+    path('statements/<int:pk>/lines/', StatementLineListView.as_view(), name='statement-lines'),
+    path('statements/<int:pk>/apply/', StatementApplyAPIView.as_view(), name='statement-apply'),
     path('customers', CustomerListCreateAPIView.as_view(), name='customers-list'),
     path('customers/<pk>', CustomerRetrieveUpdateDeleteAPIView.as_view(), name='customers-retrieve'),
     
@@ -124,10 +173,26 @@ urlpatterns = [
 
     path('revenue/', RetriveRevenueAPIView.as_view(), name='revenue-retrieve'),
     path('profit/', RetriveProfitAPIView.as_view(), name='profit-retrieve'),
+    path('profit/analytics/', ProfitAnalyticsAPIView.as_view(), name='profit-analytics'),
+    path('sales-trend/', SalesTrendAPIView.as_view(), name='sales-trend'),
+    path('sales-pivot/', SalesPivotAPIView.as_view(), name='sales-pivot'),
     path('report/', ExcelReportAPIView.as_view(), name='report-retrieve'),
+    path('report/async/', ExcelReportAsyncAPIView.as_view(), name='report-async'),
+    path('report/yearly/async/', YearlyReportAsyncAPIView.as_view(), name='report-yearly-async'),
+    path('forecast/async/', DemandForecastAsyncAPIView.as_view(), name='forecast-async'),
+    path('reorder-suggestions/', ReorderSuggestionAPIView.as_view(), name='reorder-suggestions'),
+    path('product-health/', ProductHealthListView.as_view(), name='product-health'),
+    path('product-health/summary/', ProductHealthSummaryAPIView.as_view(), name='product-health-summary'),
+    path('product-health/async/', ProductHealthAsyncAPIView.as_view(), name='product-health-async'),
+    path('report/export/', OrderReportExportAPIView.as_view(), name='report-export'),
     path('order_log/', OrderLogAPIView.as_view(), name='order-log-retrieve'),
     path('stock/', ListOutOFStockProductAPIView.as_view(), name='stock-shortage-retrieve'),
     path('stock_count/', CountNearExpirationDateProductAPIView.as_view(), name='stock-shortage-count-retrieve'),
+    path('stock-alerts/', StockAlertEventListAPIView.as_view(), name='stock-alerts'),
+    path('lots/', StockLotListCreateView.as_view(), name='lots-list'),
+    path('lots/<int:pk>/', StockLotDetailView.as_view(), name='lots-retrieve'),
+    path('near-expiry/', NearExpiryLotListView.as_view(), name='near-expiry-lots'),
+    path('near-expiry/count/', CountNearExpiryProductAPIView.as_view(), name='near-expiry-count'),
 
     path('expense_type', ExpenseTypesListCreateAPIView.as_view(), name='expense_type-list'),
     path('expense_type/<pk>', ExpenseTypesRetrieveUpdateDeleteAPIView.as_view(), name='expense_type-retrieve'),
@@ -136,12 +201,14 @@ urlpatterns = [
     path('other_expenses/<pk>', OtherExpensesRetrieveUpdateDeleteAPIView.as_view(), name='other_expenses-retrieve'),
     path('product_report/', ProductExcelReportAPIView.as_view(), name='product-report-retrieve'),
     path('product_cost/', RetriveTotalProductCostAPIView.as_view(), name='total-product-cost-retrieve'),
+    path('stock-valuation/', StockValuationAPIView.as_view(), name='stock-valuation'),
 
     path('products_supplier/<pk>', ProductsPerSupplierAPIView.as_view(), name='products-per-supplier'),
 
     path('orders/<pk>/receipt/', OrderReceiptAPIView.as_view(), name='order-receipt'),
     path('sales-dashboard/', SalesPersonDashboardAPIView.as_view(), name='salesperson-dashboard'),
     path('recent-orders/', RecentOrderLimitedAPIView.as_view(), name='recent-orders-limited'),
+    path('dashboard/', DashboardAPIView.as_view(), name='dashboard'),
     path('salesperson-revenue/', RetriveSalesPersonRevenueAPIView.as_view(), name='salesperson-revenue-retrieve'),
     path('salesperson-total-orders/', RetriveTotalOrdersAPIView.as_view(), name='total-orders-retrieve'),
     
@@ -157,9 +224,18 @@ urlpatterns = [
 
     path('export/products/', ExportProductExcelAPIView.as_view(), name='export-products-excel'),
     path('import/products/', ImportProductExcelAPIView.as_view(), name='export-products-excel'),
+    path('export/products/async/', ExportProductExcelAsyncAPIView.as_view(), name='export-products-async'),
+    path('import/products/async/', ImportProductExcelAsyncAPIView.as_view(), name='import-products-async'),
+
+    path('jobs/', BackgroundJobListView.as_view(), name='jobs-list'),
+    path('jobs/<int:pk>/', BackgroundJobDetailView.as_view(), name='jobs-retrieve'),
+    path('jobs/<int:pk>/cancel/', BackgroundJobCancelAPIView.as_view(), name='jobs-cancel'),
+    path('jobs/<int:pk>/download/', BackgroundJobDownloadAPIView.as_view(), name='jobs-download'),
 
     path('orders/<int:order_id>/logs', OrderLogListView.as_view(), name='order-logs'),
     path('product_log/', ProductLogAPIView.as_view(), name='product-log-retrieve'),
+    path('products/<int:pk>/movements/', ProductMovementListView.as_view(), name='product-movements'),
+    path('stock-at-date/', StockAtDateAPIView.as_view(), name='stock-at-date'),
 
     path('product_with_bundle/', ProductWithBundleAPIView.as_view(), name='product-with-bundle-retrieve'),
     path('product_with_out_bundle/', ProductWithOutBundleAPIView.as_view(), name='product-with-out-bundle-retrieve'),
@@ -175,12 +251,15 @@ urlpatterns = [
     path('purchase-products/<pk>', PurchaseProductDetailView.as_view(), name='purchase-product-list-create'),
     path('purchase-expenses/', PurchaseExpenseListCreateView.as_view(), name='purchase-expense-list-create'),
     path('purchase-expenses/<pk>', PurchaseExpenseDetailView.as_view(), name='purchase-expense-list-create'),
+    path('purchase-expenses/<int:pk>/receive', PurchaseExpenseReceiveAPIView.as_view(), name='purchase-expense-receive'),
     path('purchase-suppliers/', PurchaseSupplierListCreateView.as_view(), name='purchase-supplier-list-create'),
     path('purchase-suppliers/<pk>', PurchaseSupplierDetailView.as_view(), name='purchase-supplier-list-create'),
 
     path('purchase-suppliers/<int:supplier_id>/logs', SupplierLogListView.as_view(), name='purchase-supplier-logs'),
     # path('purchase-suppliers/<int:supplier_id>/report', SupplierReport.as_view(), name='purchase-supplier-report'),
     path('purchase-suppliers/<int:supplier_id>/report', SupplierReportView.as_view(), name='purchase-supplier-report'),
+    path('purchase-suppliers/<int:supplier_id>/statement', SupplierStatementView.as_view(), name='purchase-supplier-statement'),
+    path('purchase-suppliers/<int:supplier_id>/report/async', SupplierReportAsyncView.as_view(), name='purchase-supplier-report-async'),
     path('purchase-expenses/<int:expense_id>/logs', ExpenseLogListView.as_view(), name='purchase-expense-logs'),
     path('purchase-expenses/<int:expense_id>/report', ExpenseReport.as_view(), name='purchase-expense-report'),
     path('total-order/', TotalOrderAPIView.as_view(), name='total-order'),
@@ -1,5 +1,11 @@
-from .models import OrderLog, Report
+from .models import OrderLog, PurchaseSupplier, Report
+from .report_cache import bump, supplier_key
 from decimal import Decimal
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 def create_log(user, action, model_name, object_id, details=None):
     Log.objects.create(
@@ -64,10 +70,39 @@ def update_payment_status_on_new_expense_or_product(supplier, expense=None, new_
             updated = True
 
     if supplier.payment_status == 'Paid':
+        # The amounts may have moved under this instance (inventory.purchase_totals): update them in SQL
         supplier.payment_status = 'Pending'
-        supplier.unpaid_amount = supplier.total_amount - supplier.paid_amount
-        supplier.save(update_fields=['payment_status', 'unpaid_amount'])
+        PurchaseSupplier.objects.filter(pk=supplier.pk).update(
+            payment_status='Pending', unpaid_amount=F('total_amount') - F('paid_amount')
+        )
+        supplier.refresh_from_db(fields=['unpaid_amount'])
+        bump(supplier_key(supplier.pk))
         updated = True
 
     return updated
 
+
+def report_date_window(start_raw=None, end_raw=None, default_days=None, max_days=None):
+    """
+    Resolve the (start, end) dates of a report, both inclusive. Missing bounds
+    default to the last REPORT_DEFAULT_DAYS days ending today (or ending at the
+    given end_date); windows longer than REPORT_MAX_DAYS are refused.
+    Raises ValueError with a message for the client.
+    """
+    default_days = default_days or getattr(settings, 'REPORT_DEFAULT_DAYS', 30)
+    max_days = max_days or getattr(settings, 'REPORT_MAX_DAYS', 366)
+
+    start = parse_date(start_raw) if start_raw else None
+    end = parse_date(end_raw) if end_raw else None
+    if (start_raw and not start) or (end_raw and not end):
+        raise ValueError("Dates must be in YYYY-MM-DD format.")
+
+    if end is None:
+        end = min(start + timedelta(days=default_days - 1), timezone.localdate()) if start else timezone.localdate()
+    if start is None:
+        start = end - timedelta(days=default_days - 1)
+    if start > end:
+        raise ValueError("start_date must not be after end_date.")
+    if (end - start).days + 1 > max_days:
+        raise ValueError(f"The date range can span at most {max_days} days; use the async report for longer periods.")
+    return start, end
@@ -0,0 +1,205 @@
+"""
+Inventory valuation maintained incrementally.
+
+StockValuation keeps one row per (category, supplier) bucket plus a ``total``
+row holding the on-hand quantity and its value (stock x unit cost, the buying
+price standing in until the costing engine has a cost). Product signals and
+the costing engine apply deltas with F() updates, so reading the figure is a
+single-row lookup. `rebuild_valuation` recomputes everything from the product
+table and is what the `reconcile_valuation` command runs.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, F, DecimalField, ExpressionWrapper, Q
+from django.db.models.functions import Coalesce
+
+from .models import Product, StockValuation
+
+
+TOTAL_KEY = 'total'
+VALUE_PLACES = Decimal('0.0001')
+MONEY_PLACES = Decimal('0.01')
+
+# Product fields a valuation depends on, in the order used by the state tuples
+STATE_FIELDS = ('category_id', 'supplier_id', 'stock', 'unit_cost', 'buying_price')
+
+
+def bucket_key(category_id, supplier_id):
+    return f"c:{category_id or '-'}|s:{supplier_id or '-'}"
+
+
+def product_state(product):
+    """The valuation-relevant fields of a Product instance, or None if some were not loaded."""
+    try:
+        return tuple(product.__dict__[field] for field in STATE_FIELDS)
+    except KeyError:
+        return None
+
+
+def stored_state(product_id):
+    """The valuation-relevant fields of a product as stored, in one single-row query."""
+    return Product.objects.filter(pk=product_id).values_list(*STATE_FIELDS).first()
+
+
+def contribution(state):
+    """(quantity, value) a product adds to its bucket. Negative stock is not valued."""
+    _, _, stock, unit_cost, buying_price = state
+    quantity = max(stock or 0, 0)
+    cost = unit_cost if unit_cost is not None else buying_price
+    return quantity, Decimal(quantity) * Decimal(cost or 0)
+
+
+def apply_product_changes(changes):
+    """
+    Apply [(old_state, new_state), ...] to the valuation rows. Either state may be
+    None for a created or deleted product. Deltas are summed per bucket first so
+    each touched row gets one UPDATE.
+    """
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            quantity, value = contribution(state)
+            bucket = deltas[(state[0], state[1])]
+            bucket[0] += sign * quantity
+            bucket[1] += sign * value
+
+    deltas = {bucket: delta for bucket, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+
+    total_quantity = sum(delta[0] for delta in deltas.values())
+    total_value = sum(delta[1] for delta in deltas.values())
+    with transaction.atomic():
+        for (category_id, supplier_id), (quantity, value) in sorted(deltas.items(), key=lambda d: bucket_key(*d[0])):
+            _add(bucket_key(category_id, supplier_id), quantity, value, category_id=category_id, supplier_id=supplier_id)
+        _add(TOTAL_KEY, total_quantity, total_value)
+
+
+def _add(key, quantity, value, **defaults):
+    StockValuation.objects.get_or_create(key=key, defaults=defaults)
+    StockValuation.objects.filter(key=key).update(
+        quantity=F('quantity') + quantity,
+        value=F('value') + Decimal(value).quantize(VALUE_PLACES),
+    )
+
+
+def bucket_rows(**lookup):
+    """(category_id, supplier_id, quantity, value) of the bucket rows matching `lookup`."""
+    return list(
+        StockValuation.objects.exclude(key=TOTAL_KEY).filter(**lookup)
+        .values_list('category_id', 'supplier_id', 'quantity', 'value')
+    )
+
+
+def move_bucket_rows(rows, **bucket):
+    """
+    Add `rows` (from `bucket_rows`) to the buckets they become with the fields
+    in `bucket` replaced, e.g. category_id=None once their category is deleted.
+    The total row is unchanged.
+    """
+    with transaction.atomic():
+        for category_id, supplier_id, quantity, value in rows:
+            target = {'category_id': category_id, 'supplier_id': supplier_id, **bucket}
+            _add(bucket_key(target['category_id'], target['supplier_id']), quantity, value, **target)
+
+
+def update_unit_costs(costs, batch_size=500):
+    """
+    Write {product_id: unit_cost} with a bulk update (which skips signals) and
+    move the valuation by the resulting change in value.
+    """
+    changes, updates = [], []
+    for pk, *state in Product.objects.filter(pk__in=list(costs)).values_list('id', *STATE_FIELDS):
+        new_cost = costs[pk]
+        if new_cost == state[3]:
+            continue
+        old_state = tuple(state)
+        state[3] = new_cost
+        changes.append((old_state, tuple(state)))
+        updates.append(Product(id=pk, unit_cost=new_cost))
+
+    with transaction.atomic():
+        Product.objects.bulk_update(updates, ['unit_cost'], batch_size=batch_size)
+        apply_product_changes(changes)
+    return len(updates)
+
+
+def _value_expression():
+    return ExpressionWrapper(
+        F('stock') * Coalesce('unit_cost', 'buying_price'),
+        output_field=DecimalField(max_digits=24, decimal_places=4),
+    )
+
+
+def rebuild_valuation():
+    """
+    Recompute every bucket with one grouped query and replace the stored rows.
+    Returns the previous and the recomputed totals so callers can report drift.
+    """
+    grouped = (
+        Product.objects.filter(stock__gt=0)
+        .values('category_id', 'supplier_id')
+        .annotate(quantity=Sum('stock'), value=Coalesce(Sum(_value_expression()), Decimal('0')))
+    )
+    rows = [
+        StockValuation(
+            key=bucket_key(row['category_id'], row['supplier_id']),
+            category_id=row['category_id'],
+            supplier_id=row['supplier_id'],
+            quantity=row['quantity'],
+            value=Decimal(row['value']).quantize(VALUE_PLACES),
+        )
+        for row in grouped
+    ]
+    total = StockValuation(
+        key=TOTAL_KEY,
+        quantity=sum(row.quantity for row in rows),
+        value=sum((row.value for row in rows), Decimal('0')),
+    )
+
+    with transaction.atomic():
+        previous = StockValuation.objects.select_for_update().filter(key=TOTAL_KEY).first()
+        StockValuation.objects.all().delete()
+        StockValuation.objects.bulk_create(rows + [total], batch_size=1000)
+
+    before = (previous.quantity, previous.value) if previous else (0, Decimal('0'))
+    return before, (total.quantity, total.value)
+
+
+def total_valuation():
+    """The maintained total as (quantity, value)."""
+    row = StockValuation.objects.filter(key=TOTAL_KEY).values_list('quantity', 'value').first()
+    if row is None:
+        return 0, Decimal('0.00')
+    return row[0], Decimal(row[1]).quantize(MONEY_PLACES)
+
+
+def valuation_breakdown():
+    """Totals plus per-category and per-supplier figures, read from the bucket rows."""
+    buckets = StockValuation.objects.exclude(key=TOTAL_KEY)
+
+    def by(field, name_field):
+        return [
+            {
+                field: row[field],
+                'name': row[name_field],
+                'quantity': row['quantity'],
+                'value': Decimal(row['value']).quantize(MONEY_PLACES),
+            }
+            for row in buckets.values(field, name_field)
+            .annotate(quantity=Sum('quantity'), value=Sum('value'))
+            .filter(~Q(quantity=0) | ~Q(value=0))
+            .order_by('-value')
+        ]
+
+    quantity, value = total_valuation()
+    return {
+        'total_quantity': quantity,
+        'total_value': value,
+        'by_category': by('category_id', 'category__name'),
+        'by_supplier': by('supplier_id', 'supplier__name'),
+    }
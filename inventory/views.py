@@ -2,7 +2,7 @@ from rest_framework.views import APIView
 from rest_framework import generics
 from django.db.models import Sum, Count
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.http import FileResponse
 from rest_framework import status, permissions
 from rest_framework.permissions import BasePermission
 from rest_framework.parsers import MultiPartParser
@@ -10,17 +10,19 @@ from django.shortcuts import get_object_or_404
 from django.db.models import F, Sum, ExpressionWrapper, DecimalField
 from django.db import IntegrityError
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
 from django.utils.dateparse import parse_date
 import calendar
-import openpyxl
+import os
 from .models import (
     Product, Supplier, Order, OrderItem, Category, 
     CustomerInfo, CompanyInfo, OrderLog, Report, ExpenseTypes, 
     OtherExpenses, OrderPaymentLog, ProductLog, Bundle, Component,
     PerformaCustomer, PerformaPerforma, PerformaProduct,
     PurchaseSupplier, PurchaseExpense, PurchaseProduct,
-    SupplierPaymentLog, ExpensePaymentLog
+    SupplierPaymentLog, ExpensePaymentLog, StockMovement, StockAlertEvent, StockLot,
+    BackgroundJob, DemandForecast, ProductHealth, CustomerBalance, Payment,
+    BankStatement, StatementLine
 )
 from .serializers import (
     ProductPostSerializer, 
@@ -45,22 +47,64 @@ from .serializers import (
     PerformaPerformaLightSerializer, PerformaProductSerializer,PurchaseSupplierSerializer,
     PurchaseExpenseSerializer, PurchaseProductSerializer, PurchaseSupplierLightSerializer,
     PurchaseExpenseLightSerializer, SupplierPaymentLogSerializer, ExpensePaymentLogSerializer, 
-    ExpenseReportSerializer, SupplierReportSerializer, Supplier2ReportSerializer
+    ExpenseReportSerializer, SupplierReportSerializer, Supplier2ReportSerializer,
+    StockMovementSerializer,
+    ProductHealthSerializer, StockAlertEventSerializer, StockLotSerializer, CustomerBalanceSerializer,
+    BackgroundJobSerializer, PaymentSerializer, BankStatementSerializer, StatementLineSerializer
 )
 
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework import filters
 from django.db.models import Q
 from django.core.exceptions import ValidationError
-from .utils import create_order_log
+from .utils import create_order_log, report_date_window
+from .analytics import GROUP_FIELDS, PERIOD_FUNCTIONS, sales_items, profit_breakdown
+from .archive import add_months, month_range, sales_trend
+from .forecast import reorder_suggestions
+from .dashboard import dashboard
+from .receivables import aging, aging_totals, customer_balance, open_orders
+from . import payables
+from .receiving import receive_expense
+from . import counters
+from .payments import allocate_customer_payment, allocate_supplier_payment
+from .statements import apply_statement, import_statement
+from .supplier_statement import statement_response
+from .pivot import (
+    DIMENSIONS as PIVOT_DIMENSIONS, MEASURES as PIVOT_MEASURES, PERIODS as PIVOT_PERIODS,
+    facts_for, pivot, version_keys as pivot_version_keys,
+)
+from .costing import costing_method
+from .valuation import total_valuation, valuation_breakdown
+from .lots import near_expiry_lots
+from .exports import (
+    EXPORT_FORMATS, REPORT_FORMATS, export_response, product_rows,
+    order_report_records, order_report_table, stream_ndjson,
+)
+from .imports import plan_import, apply_import
+from .report_cache import cached_json_response, order_window_keys, supplier_key, PRODUCTS
+from .jobs import enqueue, cancel as cancel_job
+from .ledger import stock_on_date, start_of_day, end_of_day
 
 # ------------------ Pagination ------------------
 class Pagination(PageNumberPagination):
+    django_paginator_class = counters.CountedPaginator  # whole-table and single-flag counts come from the counters
     page_size = 10  # default items per page
     page_size_query_param = 'page_size'  # allow client to override
     max_page_size = 100
 
 
+class PayablesCursorPagination(CursorPagination):
+    """Cursor on the ?ordering column of the payables aging (see inventory.payables)."""
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = payables.DEFAULT_ORDERING
+
+    def get_ordering(self, request, queryset, view):
+        return payables.ordering(request.query_params.get('ordering'))
+
+
 
 class BundleListCreateView(generics.ListCreateAPIView):
     queryset = Bundle.objects.all()
@@ -921,6 +965,251 @@ class OrderItemCreditListView(generics.ListAPIView):
 
 
 
+class CustomerBalanceListView(generics.ListAPIView):
+    """Customers that owe money, largest balance first (?search= on the customer name)."""
+    serializer_class = CustomerBalanceSerializer
+    pagination_class = Pagination
+    filter_backends = [filters.SearchFilter]
+    search_fields = ['customer__name']
+
+    def get_queryset(self):
+        return CustomerBalance.objects.select_related('customer').filter(outstanding__gt=0).order_by('-outstanding', 'customer_id')
+
+
+class CustomerBalanceAPIView(APIView):
+    """One customer's balance with the open amount of each of their open orders, oldest first."""
+    def get(self, request, pk):
+        try:
+            customer = get_object_or_404(CustomerInfo, pk=pk)
+            outstanding, open_order_count = customer_balance(customer.pk)
+            orders = open_orders(customer.pk).order_by('order_date', 'id').values(
+                'id', 'receipt_id', 'order_date', 'total_amount', 'paid_amount', 'unpaid_amount', 'payment_status', 'credit'
+            )
+            return Response({
+                "customer": customer.pk,
+                "customer_name": customer.name,
+                "outstanding": outstanding,
+                "open_orders": open_order_count,
+                "orders": list(orders),
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Customer Balance. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ReceivablesAgingAPIView(APIView):
+    """
+    Open amounts per customer by order age (0-30, 31-60, 61-90, 90+ days),
+    largest total first, with the totals over all customers. Optional ?customer=<id>.
+    """
+    def get(self, request):
+        try:
+            customer_id = request.query_params.get('customer') or None
+            now = timezone.now()
+            paginator = Pagination()
+            page = paginator.paginate_queryset(aging(customer_id, now=now), request, view=self)
+            response = paginator.get_paginated_response(page)
+            response.data['totals'] = aging_totals(customer_id, now=now)
+            response.data['as_of'] = now
+            return response
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Receivables Aging. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class PayablesAgingAPIView(APIView):
+    """
+    Open purchase expense amounts per purchase supplier by purchase age (0-30,
+    31-60, 61-90, 90+ days) with the totals over all suppliers. Sorted by
+    ?ordering (default -total) and paged with ?cursor. Optional ?supplier=<purchase supplier id>.
+    """
+    def get(self, request):
+        try:
+            supplier_id = request.query_params.get('supplier') or None
+            today = timezone.localdate()
+            paginator = PayablesCursorPagination()
+            try:
+                page = paginator.paginate_queryset(payables.aging(supplier_id, today=today), request, view=self)
+            except (ValueError, NotFound) as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            response = paginator.get_paginated_response(page)
+            response.data['totals'] = payables.aging_totals(supplier_id, today=today)
+            response.data['as_of'] = today
+            return response
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Payables Aging. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class PaymentListCreateAPIView(APIView):
+    """
+    Payments of one party, latest first, with their allocations. POST records a
+    payment and allocates it to the party's open documents, oldest first.
+    """
+    party_model = None
+    party_field = None
+    label = None
+    allocator = None
+
+    def get(self, request, pk):
+        try:
+            party = get_object_or_404(self.party_model, pk=pk)
+            payments = (
+                Payment.objects.filter(**{self.party_field: party})
+                .select_related('customer', 'supplier__supplier')
+                .prefetch_related('allocations')
+                .order_by('-paid_at', '-id')
+            )
+            paginator = Pagination()
+            page = paginator.paginate_queryset(payments, request, view=self)
+            return paginator.get_paginated_response(PaymentSerializer(page, many=True).data)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the {self.label} Payments. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def post(self, request, pk):
+        try:
+            party = get_object_or_404(self.party_model, pk=pk)
+            serializer = PaymentSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            details = dict(serializer.validated_data)
+            amount = details.pop('amount')
+            user = getattr(request.user, 'name', None)
+            payment = self.allocator(party, amount, user, **details)
+            payment = Payment.objects.select_related('customer', 'supplier__supplier').prefetch_related('allocations').get(pk=payment.pk)
+            return Response(PaymentSerializer(payment).data, status=status.HTTP_201_CREATED)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while creating the {self.label} Payment. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class CustomerPaymentAPIView(PaymentListCreateAPIView):
+    party_model = CustomerInfo
+    party_field = 'customer'
+    label = 'Customer'
+    allocator = staticmethod(allocate_customer_payment)
+
+
+class SupplierPaymentAPIView(PaymentListCreateAPIView):
+    party_model = PurchaseSupplier
+    party_field = 'supplier'
+    label = 'Supplier'
+    allocator = staticmethod(allocate_supplier_payment)
+
+
+class BankStatementListView(generics.ListAPIView):
+    serializer_class = BankStatementSerializer
+    pagination_class = Pagination
+
+    def get_queryset(self):
+        return BankStatement.objects.order_by('-imported_at', '-id')
+
+
+class BankStatementImportAPIView(APIView):
+    """
+    Imports a CSV bank / mobile money statement (field `file`, optional
+    `source`) and proposes a match for every line against the open orders and
+    purchase expenses. Lines already imported with an earlier statement are
+    skipped. Nothing is paid until the lines are applied.
+    """
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        statement_file = request.FILES.get('file')
+        if not statement_file:
+            return Response({"error": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            statement, errors, duplicates = import_statement(
+                statement_file, name=statement_file.name, source=request.data.get('source') or None,
+                user=getattr(request.user, 'name', None),
+            )
+            if errors:
+                return Response(
+                    {"error": "The file has invalid rows; nothing was imported.", "errors": errors},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            matches = dict(
+                statement.lines.values_list('status').annotate(lines=Count('id')).order_by()
+            )
+            return Response({
+                "message": "Statement imported successfully.",
+                "statement": BankStatementSerializer(statement).data,
+                "duplicates": duplicates,
+                "lines": matches,
+            }, status=status.HTTP_201_CREATED)
+        except Exception as e:
+            return Response({"error": f"Failed to import the statement: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class StatementLineListView(generics.ListAPIView):
+    """The lines of a statement with their proposed or applied match (?status=Proposed|Unmatched|Applied)."""
+    serializer_class = StatementLineSerializer
+    pagination_class = Pagination
+
+    def get_queryset(self):
+        lines = StatementLine.objects.filter(statement_id=self.kwargs['pk']).select_related(
+            'customer', 'purchase_supplier__supplier'
+        )
+        line_status = self.request.query_params.get('status')
+        if line_status:
+            lines = lines.filter(status=line_status)
+        return lines.order_by('row', 'id')
+
+
+class StatementApplyAPIView(APIView):
+    """
+    Pays the confirmed statement lines. Body: {"lines": [...]} where each item
+    is a line id (accept its proposed match) or {"line": id, "order" |
+    "customer" | "expense" | "supplier": id} to match it by hand. Without
+    "lines" every proposed line is applied. All lines are paid in one
+    transaction, or none when one of them can't be.
+    """
+    def post(self, request, pk):
+        statement = get_object_or_404(BankStatement, pk=pk)
+        items = request.data.get('lines')
+        decisions = None
+        if items is not None:
+            decisions = {}
+            try:
+                for item in items:
+                    if isinstance(item, dict):
+                        kinds = [kind for kind, _ in StatementLine.MATCH_CHOICES if item.get(kind)]
+                        if len(kinds) != 1:
+                            raise ValueError(f"line {item.get('line')} needs one of order, customer, expense or supplier")
+                        decisions[int(item['line'])] = (kinds[0], int(item[kinds[0]]))
+                    else:
+                        decisions[int(item)] = None
+            except (KeyError, TypeError, ValueError) as e:
+                return Response({"error": f"Invalid lines: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            applied, errors = apply_statement(statement, decisions, user=getattr(request.user, 'name', None))
+            if errors:
+                return Response(
+                    {"error": "Some lines can't be applied; nothing was paid.", "errors": errors},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response({"message": "Statement lines applied successfully.", "applied": applied}, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while applying the Statement. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+
 class CategoryListCreateAPIView(APIView):
     # permission_classes = (permissions.AllowAny,)
     def get(self, request, format=None):
@@ -1142,29 +1431,18 @@ class RetriveProfitAPIView(APIView):
             paid_done_orders = Order.objects.filter(status="Done", payment_status='Paid')
             
             # Calculate revenue from these orders
-            revenue = paid_done_orders.aggregate(total_revenue=Sum('total_amount'))
-            print(revenue)
-            
-            # Get all order items from these orders
-            order_items = OrderItem.objects.filter(order__in=paid_done_orders)
+            revenue = paid_done_orders.aggregate(total_revenue=Sum('total_amount'))['total_revenue']
 
-            # Calculate cost and profit from these order items
-            cost = order_items.aggregate(total_cost=Sum('cost'))
-            print(cost)
-            
-            # profit = order_items.aggregate(
-            #     total_profit=Sum(revenue['total_revenue'] - cost['total_cost'])
-            # )
-            # profit = profit or 0
-            # if profit['total_profit'] is None:
-            #     profit['total_profit'] = 0
-
-            if revenue['total_revenue'] is None or cost['total_cost'] is None:
+            # Cost of the items of these orders, joined instead of an `order__in` subquery
+            cost = OrderItem.objects.filter(
+                order__status="Done", order__payment_status='Paid'
+            ).aggregate(total_cost=Sum('cost'))['total_cost']
+
+            if revenue is None or cost is None:
                 profit = {'total_profit': 0.00}
             else:
-                profit = {'total_profit': float(revenue['total_revenue']) - float(cost['total_cost'])}
+                profit = {'total_profit': float(revenue - cost)}
 
-            print(profit)
             return Response(profit, status=status.HTTP_200_OK)        
         except KeyError as e:
             return Response(
@@ -1173,6 +1451,162 @@ class RetriveProfitAPIView(APIView):
             )
 
 
+class ProfitAnalyticsAPIView(APIView):
+    """
+    Revenue, COGS, gross profit and margin of completed orders.
+
+    Query params:
+        group_by     comma separated: product, category, customer, salesperson, period
+        period       day, week, month (default) or year, used with group_by=period
+        start_date   YYYY-MM-DD (inclusive)
+        end_date     YYYY-MM-DD (inclusive)
+        paid_only    1/true to only count fully paid orders
+    """
+    def get(self, request):
+        try:
+            group_by = [g.strip() for g in request.query_params.get('group_by', '').split(',') if g.strip()]
+            period = request.query_params.get('period', 'month')
+            paid_only = request.query_params.get('paid_only', '').lower() in ('1', 'true', 'yes')
+
+            unknown = [g for g in group_by if g != 'period' and g not in GROUP_FIELDS]
+            if unknown:
+                return Response(
+                    {"error": f"Unknown group_by value(s): {', '.join(unknown)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if period not in PERIOD_FUNCTIONS:
+                return Response(
+                    {"error": "period must be one of day, week, month or year."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            start_raw = request.query_params.get('start_date')
+            end_raw = request.query_params.get('end_date')
+            start = parse_date(start_raw) if start_raw else None
+            end = parse_date(end_raw) if end_raw else None
+            if (start_raw and not start) or (end_raw and not end):
+                return Response(
+                    {"error": "Dates must be in YYYY-MM-DD format."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            items = sales_items(start=start, end=end, paid_only=paid_only)
+            rows, totals = profit_breakdown(items, group_by=group_by, period=period)
+            return Response({
+                "group_by": group_by,
+                "period": period if 'period' in group_by else None,
+                "start_date": start,
+                "end_date": end,
+                "totals": totals,
+                "results": rows,
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Profit Analytics. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class SalesTrendAPIView(APIView):
+    """
+    Monthly revenue, COGS, gross profit and margin over long ranges. Archived
+    months are read from the Parquet archive instead of the database.
+
+    Query params:
+        start      YYYY-MM (default: 11 months before end)
+        end        YYYY-MM (default: the current month)
+        group_by   comma separated: product, category, customer, salesperson
+    """
+    MAX_MONTHS = 240
+
+    def get(self, request):
+        try:
+            group_by = [g.strip() for g in request.query_params.get('group_by', '').split(',') if g.strip()]
+            unknown = [g for g in group_by if g not in GROUP_FIELDS]
+            if unknown:
+                return Response(
+                    {"error": f"Unknown group_by value(s): {', '.join(unknown)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                end_raw = request.query_params.get('end')
+                end = datetime.strptime(end_raw, '%Y-%m').date() if end_raw else timezone.localdate().replace(day=1)
+                start_raw = request.query_params.get('start')
+                start = datetime.strptime(start_raw, '%Y-%m').date() if start_raw else add_months(end, -11)
+            except ValueError:
+                return Response({"error": "start and end must be in YYYY-MM format."}, status=status.HTTP_400_BAD_REQUEST)
+            if start > end:
+                return Response({"error": "start must not be after end."}, status=status.HTTP_400_BAD_REQUEST)
+            if len(list(month_range(start, end))) > self.MAX_MONTHS:
+                return Response({"error": f"At most {self.MAX_MONTHS} months can be requested."}, status=status.HTTP_400_BAD_REQUEST)
+
+            rows, sources = sales_trend(start, end, group_by=group_by)
+            return Response({
+                "start": f"{start:%Y-%m}",
+                "end": f"{end:%Y-%m}",
+                "group_by": group_by,
+                "archived_months": [f"{month:%Y-%m}" for month in sources['archived_months']],
+                "results": rows,
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Sales Trend. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class SalesPivotAPIView(APIView):
+    """
+    Pivot of completed sales over start_date..end_date (defaulted and capped like the order report).
+
+    Query params:
+        rows        comma separated dimensions: product, category, customer, zone, city, user, receipt, period
+        columns     comma separated dimensions spread across the columns (optional)
+        measures    comma separated: quantity, revenue, cost, profit (default: all)
+        period      day, week, month (default), quarter or year, used with the period dimension
+    """
+    def get(self, request):
+        try:
+            params = request.query_params
+            rows = [d.strip() for d in params.get('rows', '').split(',') if d.strip()]
+            columns = [d.strip() for d in params.get('columns', '').split(',') if d.strip()]
+            measures = [m.strip() for m in params.get('measures', '').split(',') if m.strip()] or list(PIVOT_MEASURES)
+            period = params.get('period', 'month')
+
+            unknown = [d for d in rows + columns if d not in PIVOT_DIMENSIONS] + [m for m in measures if m not in PIVOT_MEASURES]
+            if unknown:
+                return Response({"error": f"Unknown dimension or measure(s): {', '.join(unknown)}."}, status=status.HTTP_400_BAD_REQUEST)
+            if not rows and not columns:
+                return Response({"error": "Provide at least one dimension in rows or columns."}, status=status.HTTP_400_BAD_REQUEST)
+            if len(set(rows + columns)) != len(rows + columns):
+                return Response({"error": "A dimension can only be used once."}, status=status.HTTP_400_BAD_REQUEST)
+            if period not in PIVOT_PERIODS:
+                return Response({"error": "period must be one of day, week, month, quarter or year."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                start, end = report_date_window(params.get('start_date'), params.get('end_date'))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            def build():
+                result = pivot(facts_for(start, end), rows, columns, measures, period=period)
+                return {
+                    "start_date": start, "end_date": end, "rows": rows, "columns_by": columns,
+                    "measures": measures, "period": period if 'period' in rows + columns else None,
+                    **result,
+                }
+
+            return cached_json_response(
+                request, 'sales_pivot',
+                {'start': start, 'end': end, 'rows': rows, 'columns': columns, 'measures': measures, 'period': period},
+                pivot_version_keys(start, end), build,
+            )
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Sales Pivot. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class OrderReceiptAPIView(APIView):
     def get(self, request, pk):
         try:
@@ -1308,28 +1742,23 @@ class ExcelReportAPIView(APIView):
             #         status=status.HTTP_403_FORBIDDEN
             #     )
 
-            # Get query parameters
-            start_date = request.query_params.get('start_date')
-            end_date = request.query_params.get('end_date')
-
-            # Start with base queryset
-            reports = Report.objects.all()
-
-            # Apply date range filter if both dates are provided
-            if start_date and end_date:
-                # Convert string dates to datetime objects for comparison
-                start = parse_date(start_date)
-                end = parse_date(end_date)
+            # Without dates the report covers the last REPORT_DEFAULT_DAYS days, not the whole table
+            try:
+                start, end = report_date_window(
+                    request.query_params.get('start_date'),
+                    request.query_params.get('end_date'),
+                )
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-                if start and end:
-                    # Include records up to the end of the day on end_date
-                    reports = reports.filter(
-                        order_date__gte=start,
-                        order_date__lt=end + timedelta(days=1)
-                    )
+            def build():
+                reports = Report.objects.filter(order_date__gte=start, order_date__lte=end).order_by('order_date', 'id')
+                return OrderReportSerializer(reports, many=True).data
 
-            serializer = OrderReportSerializer(reports, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # Keyed by the versions of the days in the window, so past periods stay cached
+            return cached_json_response(
+                request, 'order_report', {'start': start, 'end': end}, order_window_keys(start, end), build
+            )
         except Exception as e:
             return Response(
                 {"error": f"An error occurred while retrieving the Order Report: {str(e)}"},
@@ -1338,6 +1767,32 @@ class ExcelReportAPIView(APIView):
 
 
 
+class OrderReportExportAPIView(APIView):
+    """
+    Streams the order report for start_date..end_date (defaulted and capped like
+    the report endpoint) as ?output=csv (default), xlsx or ndjson, with per-day
+    subtotals after each day and a grand total at the end.
+    """
+    def get(self, request):
+        output = request.query_params.get('output', 'csv').lower()
+        if output not in REPORT_FORMATS:
+            return Response({"error": "output must be one of csv, tsv, xlsx or ndjson."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start, end = report_date_window(
+                request.query_params.get('start_date'),
+                request.query_params.get('end_date'),
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        reports = Report.objects.filter(order_date__gte=start, order_date__lte=end)
+        records = order_report_records(reports)
+        basename = f'order_report_{start}_{end}'
+        if output == 'ndjson':
+            return stream_ndjson(records, f'{basename}.ndjson')
+        return export_response(order_report_table(records), output, basename, title='Order Report')
+
+
 class ListOutOFStockProductAPIView(APIView):
     def get(self, request):
         try:
@@ -1347,7 +1802,7 @@ class ListOutOFStockProductAPIView(APIView):
             #         {"error": "You are not authorized to retrive the near Stock."},
             #         status=status.HTTP_403_FORBIDDEN
             #     )
-            out_of_stock_products = Product.objects.filter(stock__lte=3)
+            out_of_stock_products = Product.objects.filter(is_low_stock=True)
             serializer = ProductGetSerializer(out_of_stock_products, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -1366,7 +1821,7 @@ class CountNearExpirationDateProductAPIView(APIView):
             #         {"error": "You are not authorized to retrive the Stock Shortage."},
             #         status=status.HTTP_403_FORBIDDEN
             #     )
-            out_of_stock_products = Product.objects.filter(stock__lte=3).aggregate(out_of_stock=Count('name'))
+            out_of_stock_products = Product.objects.filter(is_low_stock=True).aggregate(out_of_stock=Count('id'))
             return Response(out_of_stock_products, status=status.HTTP_200_OK)
 
         except KeyError as e:
@@ -1375,6 +1830,146 @@ class CountNearExpirationDateProductAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class StockAlertEventListAPIView(APIView):
+    """
+    Low-stock threshold crossings in id order. Poll with ?after=<last id seen>
+    (and optionally ?limit=, 1 to 500) and pass back `next_cursor`.
+    """
+    def get(self, request):
+        try:
+            try:
+                after = int(request.query_params.get('after', 0))
+                limit = max(1, min(int(request.query_params.get('limit', 100)), 500))
+            except ValueError:
+                return Response(
+                    {"error": "after and limit must be integers."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            events = list(
+                StockAlertEvent.objects.select_related('product')
+                .filter(id__gt=after)
+                .order_by('id')[:limit]
+            )
+            serializer = StockAlertEventSerializer(events, many=True)
+            return Response({
+                "next_cursor": events[-1].id if events else after,
+                "results": serializer.data,
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Stock Alerts.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class StockLotListCreateView(generics.ListCreateAPIView):
+    """Stock lots (optionally ?product=<id>), earliest expiry first. Creating a lot receives its stock."""
+    serializer_class = StockLotSerializer
+    pagination_class = Pagination
+
+    def get_queryset(self):
+        lots = StockLot.objects.select_related('product')
+        product = self.request.query_params.get('product')
+        if product:
+            lots = lots.filter(product_id=product)
+        if self.request.query_params.get('open', '').lower() in ('1', 'true', 'yes'):
+            lots = lots.filter(remaining__gt=0)
+        return lots.order_by(F('expiry_date').asc(nulls_last=True), 'id')
+
+    def perform_create(self, serializer):
+        serializer.save(user=getattr(self.request.user, 'name', None))
+
+
+class StockLotDetailView(generics.RetrieveUpdateAPIView):
+    queryset = StockLot.objects.select_related('product')
+    serializer_class = StockLotSerializer
+
+
+class NearExpiryLotListView(generics.ListAPIView):
+    """Lots with stock left expiring within ?days= (default NEAR_EXPIRY_DAYS), expired ones included."""
+    serializer_class = StockLotSerializer
+    pagination_class = Pagination
+
+    def get_queryset(self):
+        days = self.request.query_params.get('days')
+        return near_expiry_lots(int(days) if days and days.isdigit() else None)
+
+
+class CountNearExpiryProductAPIView(APIView):
+    def get(self, request):
+        try:
+            days = request.query_params.get('days')
+            lots = near_expiry_lots(int(days) if days and days.isdigit() else None)
+            counts = lots.aggregate(
+                near_expiry_products=Count('product', distinct=True),
+                near_expiry_quantity=Sum('remaining'),
+            )
+            counts['near_expiry_quantity'] = counts['near_expiry_quantity'] or 0
+            return Response(counts, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Near Expiry Count.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class ProductHealthListView(generics.ListAPIView):
+    """
+    Product health from the last nightly refresh, by revenue share.
+    Optional query params: abc_class (A, B or C) and dead_stock=1.
+    """
+    serializer_class = ProductHealthSerializer
+    pagination_class = Pagination
+
+    def get_queryset(self):
+        health = ProductHealth.objects.select_related('product').order_by('-revenue_share', 'product_id')
+        abc_class = self.request.query_params.get('abc_class')
+        if abc_class:
+            health = health.filter(abc_class=abc_class.upper())
+        if self.request.query_params.get('dead_stock', '').lower() in ('1', 'true', 'yes'):
+            health = health.filter(is_dead_stock=True).order_by('-stock_value', 'product_id')
+        return health
+
+
+class ProductHealthSummaryAPIView(APIView):
+    """Products, revenue and stock value per ABC class plus the dead stock totals, for the dashboard."""
+    def get(self, request):
+        try:
+            classes = {
+                row['abc_class']: row for row in
+                ProductHealth.objects.values('abc_class').annotate(
+                    products=Count('id'), revenue=Sum('revenue'), stock_value=Sum('stock_value'),
+                ).order_by('abc_class')
+            }
+            dead = ProductHealth.objects.filter(is_dead_stock=True).aggregate(
+                products=Count('id'), stock=Sum('stock'), stock_value=Sum('stock_value'),
+            )
+            computed_at = ProductHealth.objects.values_list('computed_at', flat=True).first()
+            return Response({
+                "computed_at": computed_at,
+                "classes": [
+                    classes.get(abc_class, {'abc_class': abc_class, 'products': 0, 'revenue': 0, 'stock_value': 0})
+                    for abc_class, _ in ProductHealth.ABC_CHOICES
+                ],
+                "dead_stock": {
+                    "products": dead['products'],
+                    "stock": dead['stock'] or 0,
+                    "stock_value": dead['stock_value'] or 0,
+                },
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Product Health.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ProductHealthAsyncAPIView(APIView):
+    """Queues a product health refresh outside the nightly run."""
+    def post(self, request, *args, **kwargs):
+        job = enqueue('product_health', user=getattr(request.user, 'name', None))
+        return _job_queued(job, "Product health refresh queued.")
+
+
 class ExpenseTypesListCreateAPIView(APIView):
 
     # permission_classes = (permissions.AllowAny,)
@@ -1686,14 +2281,83 @@ class RetriveTotalProductCostAPIView(APIView):
             #         status=status.HTTP_403_FORBIDDEN
             #     ) 
      
-            total_product_cost = Product.objects.aggregate(total_product_cost=Sum('buying_price'))        
-            return Response(total_product_cost, status=status.HTTP_200_OK)         
+            # Stock x cost, maintained incrementally in a single row
+            quantity, value = total_valuation()
+            return Response({"total_product_cost": value, "total_quantity": quantity}, status=status.HTTP_200_OK)
         except KeyError as e:
             return Response(
                 {"error": f"An error occurred while Retriving the Total Product Cost.  {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class StockValuationAPIView(APIView):
+    def get(self, request):
+        try:
+            valuation = valuation_breakdown()
+            valuation['method'] = costing_method()
+            return Response(valuation, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Stock Valuation.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class ProductMovementListView(generics.ListAPIView):
+    """
+    Stock movements of one product, newest first.
+    Optional query params: kind, start_date and end_date (YYYY-MM-DD, inclusive).
+    """
+    serializer_class = StockMovementSerializer
+    pagination_class = Pagination
+
+    def get_queryset(self):
+        movements = StockMovement.objects.select_related('product').filter(product_id=self.kwargs['pk'])
+        kind = self.request.query_params.get('kind')
+        if kind:
+            movements = movements.filter(kind=kind)
+        start = parse_date(self.request.query_params.get('start_date') or '')
+        end = parse_date(self.request.query_params.get('end_date') or '')
+        # Compare against datetimes so the (product, timestamp) index is used
+        if start:
+            movements = movements.filter(timestamp__gte=start_of_day(start))
+        if end:
+            movements = movements.filter(timestamp__lt=end_of_day(end))
+        return movements.order_by('-timestamp', '-id')
+
+
+class StockAtDateAPIView(APIView):
+    """
+    Stock of every product (or ?product=<id>, ?category=<id>) at the end of ?date=YYYY-MM-DD,
+    from the latest snapshot before that date plus the movements since.
+    """
+    def get(self, request):
+        try:
+            day = parse_date(request.query_params.get('date') or '')
+            if not day:
+                return Response(
+                    {"error": "date is required in YYYY-MM-DD format."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            products = Product.objects.all()
+            if request.query_params.get('product'):
+                products = products.filter(id=request.query_params['product'])
+            if request.query_params.get('category'):
+                products = products.filter(category_id=request.query_params['category'])
+
+            rows = stock_on_date(day, products).values(
+                'id', 'name', 'specification', 'stock', 'stock_on_date'
+            ).order_by('name', 'id')
+
+            paginator = Pagination()
+            page = paginator.paginate_queryset(rows, request, view=self)
+            return paginator.get_paginated_response(page)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Stock at Date.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 class ProductExcelReportAPIView(APIView):
     def get(self, request):
         try:
@@ -1703,9 +2367,11 @@ class ProductExcelReportAPIView(APIView):
             #         {"error": "You are not authorized to retrive the Product Report."},
             #         status=status.HTTP_403_FORBIDDEN
             #     )
-            report = Product.objects.all()
-            serializer = ProductGetReportSerializer(report, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                report = Product.objects.select_related('category', 'supplier')
+                return ProductGetReportSerializer(report, many=True).data
+
+            return cached_json_response(request, 'product_report', {}, [PRODUCTS], build)
 
         except KeyError as e:
             return Response(
@@ -1781,6 +2447,17 @@ class RecentOrderLimitedAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class DashboardAPIView(APIView):
+    # Every home screen tile in one response, shared by all requests for DASHBOARD_CACHE_SECONDS
+    def get(self, request):
+        try:
+            return Response(dashboard(), status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Dashboard. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 # ------------------------------------- Total Sales relative to Time --------------------------------------------------
 
 class DailySalesAPIView(APIView):
@@ -2030,72 +2707,200 @@ class YearlySalesEachUserAPIView(APIView):
 
 
 class ExportProductExcelAPIView(APIView):
+    """
+    Streams every product as ?output=xlsx (default), csv or tsv, with the
+    category and supplier names joined in.
+    """
     def get(self, request, *args, **kwargs):
-        # Create workbook and sheet
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Products"
-
-        # Fetch data
-        products = Product.objects.all().values(
-            'id', 'name', 'description', 'package', 'piece', 'buying_price',
-            'selling_price', 'unit', 'stock', 'receipt_no', 'user'
-        )
-        if not products:
-            return Response({"error": "No product data available"}, status=204)
+        output = request.query_params.get('output', 'xlsx').lower()
+        if output not in EXPORT_FORMATS:
+            return Response({"error": "output must be one of xlsx, csv or tsv."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Write headers
-        headers = list(products[0].keys())
-        ws.append(headers)
+        products = Product.objects.all()
+        if not products.exists():
+            return Response({"error": "No product data available"}, status=204)
 
-        # Write data rows
-        for product in products:
-            ws.append(list(product.values()))
-
-        # Prepare HTTP response
-        response = HttpResponse(
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response['Content-Disposition'] = 'attachment; filename=products.xlsx'
-        wb.save(response)
-        return response
+        return export_response(product_rows(products), output, 'products', title='Products')
 
 class ImportProductExcelAPIView(APIView):
+    """
+    Creates/updates products from an uploaded workbook (columns as in the export;
+    rows with an existing id are updated). Every row is validated before anything
+    is written; pass dry_run=true to get the diff without saving.
+    """
     parser_classes = [MultiPartParser]
 
     def post(self, request, *args, **kwargs):
         excel_file = request.FILES.get('file')
         if not excel_file:
             return Response({"error": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', request.query_params.get('dry_run', ''))).lower() in ('1', 'true', 'yes')
 
         try:
-            wb = openpyxl.load_workbook(excel_file)
-            ws = wb.active
-            rows = list(ws.iter_rows(values_only=True))
-            headers = [str(cell).strip() for cell in rows[0]]
-            for row in rows[1:]:
-                data = dict(zip(headers, row))
-                # Adjust field names as needed for your Product model
-                Product.objects.update_or_create(
-                    id=data.get('id'),
-                    defaults={
-                        'name': data.get('name'),
-                        'description': data.get('description'),
-                        'package': data.get('package'),
-                        'piece': data.get('piece'),
-                        'buying_price': data.get('buying_price'),
-                        'selling_price': data.get('selling_price'),
-                        'unit': data.get('unit'),
-                        'stock': data.get('stock'),
-                        'receipt_no': data.get('receipt_no'),
-                        'user': data.get('user'),  # Use FK id or handle lookup
-                    }
+            result = plan_import(excel_file)
+            if result.errors:
+                return Response(
+                    {"error": "The file has invalid rows; nothing was imported.", **result.summary()},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-            return Response({"message": "Products imported successfully."}, status=status.HTTP_201_CREATED)
+            if dry_run:
+                return Response(result.summary(with_changes=True), status=status.HTTP_200_OK)
+
+            apply_import(result, user=getattr(request.user, 'name', None))
+            return Response({"message": "Products imported successfully.", **result.summary()}, status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response({"error": f"Failed to import products: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _job_queued(job, message):
+    return Response(
+        {"message": message, "job": BackgroundJobSerializer(job).data},
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+class ImportProductExcelAsyncAPIView(APIView):
+    """Queues the product import as a background job; poll jobs/<id>/ for the outcome."""
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        excel_file = request.FILES.get('file')
+        if not excel_file:
+            return Response({"error": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', request.query_params.get('dry_run', ''))).lower() in ('1', 'true', 'yes')
+        job = enqueue('product_import', {'dry_run': dry_run}, user=getattr(request.user, 'name', None), input_file=excel_file)
+        return _job_queued(job, "Product import queued.")
+
+
+class ExportProductExcelAsyncAPIView(APIView):
+    def post(self, request, *args, **kwargs):
+        output = str(request.data.get('output', 'xlsx')).lower()
+        if output not in EXPORT_FORMATS:
+            return Response({"error": "output must be one of xlsx, csv or tsv."}, status=status.HTTP_400_BAD_REQUEST)
+        job = enqueue('product_export', {'output': output}, user=getattr(request.user, 'name', None))
+        return _job_queued(job, "Product export queued.")
+
+
+class ExcelReportAsyncAPIView(APIView):
+    """Order report rows for start_date..end_date written to an xlsx/csv/tsv file by a background job."""
+    def post(self, request, *args, **kwargs):
+        output = str(request.data.get('output', 'xlsx')).lower()
+        if output not in EXPORT_FORMATS:
+            return Response({"error": "output must be one of xlsx, csv or tsv."}, status=status.HTTP_400_BAD_REQUEST)
+        start_date = request.data.get('start_date')
+        end_date = request.data.get('end_date')
+        if not start_date or not end_date:
+            return Response({"error": "start_date and end_date are required."}, status=status.HTTP_400_BAD_REQUEST)
+        if not parse_date(start_date) or not parse_date(end_date):
+            return Response({"error": "Dates must be in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+        if parse_date(start_date) > parse_date(end_date):
+            return Response({"error": "start_date must not be after end_date."}, status=status.HTTP_400_BAD_REQUEST)
+        job = enqueue(
+            'order_report',
+            {'output': output, 'start_date': start_date, 'end_date': end_date},
+            user=getattr(request.user, 'name', None),
+        )
+        return _job_queued(job, "Order report queued.")
+
+
+class YearlyReportAsyncAPIView(APIView):
+    """Queues the year-end workbook (a summary plus one sheet per month); download it from jobs/<id>/download/."""
+    def post(self, request, *args, **kwargs):
+        try:
+            year = int(request.data.get('year', timezone.localdate().year))
+        except (TypeError, ValueError):
+            return Response({"error": "year must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 2000 <= year <= timezone.localdate().year:
+            return Response({"error": "year is out of range."}, status=status.HTTP_400_BAD_REQUEST)
+        job = enqueue('yearly_report', {'year': year}, user=getattr(request.user, 'name', None))
+        return _job_queued(job, "Yearly report queued.")
+
+
+class SupplierReportAsyncView(APIView):
+    def post(self, request, supplier_id):
+        user = request.user
+        if not (user.role in ['Manager', 'Salesman', 'Sales Manager'] or user.is_superuser):
+            return Response(
+                {"error": "You are not authorized to retrieve the Supplier Report."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        start_date = parse_date(str(request.data.get('start_date') or ''))
+        end_date = parse_date(str(request.data.get('end_date') or ''))
+        if bool(start_date) ^ bool(end_date):
+            return Response(
+                {"error": "Provide both start_date and end_date, or neither."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        get_object_or_404(PurchaseSupplier, pk=supplier_id)
+        job = enqueue(
+            'supplier_report',
+            {'supplier_id': supplier_id, 'start_date': str(start_date or ''), 'end_date': str(end_date or '')},
+            user=user.name,
+        )
+        return _job_queued(job, "Supplier report queued.")
+
+
+class DemandForecastAsyncAPIView(APIView):
+    """Queues a recomputation of the demand forecasts behind reorder-suggestions/."""
+    def post(self, request, *args, **kwargs):
+        job = enqueue('demand_forecast', user=getattr(request.user, 'name', None))
+        return _job_queued(job, "Demand forecast queued.")
+
+
+class ReorderSuggestionAPIView(APIView):
+    """Suggested reorder quantities per supplier from the latest demand forecast (?supplier_id= to narrow)."""
+    def get(self, request):
+        try:
+            supplier_id = request.query_params.get('supplier_id')
+            if supplier_id is not None and not supplier_id.isdigit():
+                return Response({"error": "supplier_id must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+            computed_at = DemandForecast.objects.order_by('-computed_at').values_list('computed_at', flat=True).first()
+            return Response({
+                "computed_at": computed_at,
+                "suppliers": reorder_suggestions(int(supplier_id) if supplier_id else None),
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Reorder Suggestions. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class BackgroundJobListView(generics.ListAPIView):
+    serializer_class = BackgroundJobSerializer
+    pagination_class = Pagination
+
+    def get_queryset(self):
+        jobs = BackgroundJob.objects.all()
+        for param in ('status', 'kind'):
+            value = self.request.query_params.get(param)
+            if value:
+                jobs = jobs.filter(**{param: value})
+        return jobs.order_by('-id')
+
+
+class BackgroundJobDetailView(generics.RetrieveAPIView):
+    queryset = BackgroundJob.objects.all()
+    serializer_class = BackgroundJobSerializer
+
+
+class BackgroundJobCancelAPIView(APIView):
+    def post(self, request, pk):
+        job = get_object_or_404(BackgroundJob, pk=pk)
+        if job.status not in (BackgroundJob.QUEUED, BackgroundJob.RUNNING):
+            return Response({"error": f"The job is already {job.status.lower()}."}, status=status.HTTP_400_BAD_REQUEST)
+        job = cancel_job(job)
+        return Response(BackgroundJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+class BackgroundJobDownloadAPIView(APIView):
+    def get(self, request, pk):
+        job = get_object_or_404(BackgroundJob, pk=pk)
+        if job.status != BackgroundJob.SUCCEEDED or not job.result_file:
+            return Response({"error": "This job has no result file."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(job.result_file.open('rb'), as_attachment=True, filename=os.path.basename(job.result_file.name))
+
+
 class OrderLogListView(generics.ListAPIView):
     serializer_class = OrderPaymentLogSerializer
 
@@ -2583,6 +3388,35 @@ class PurchaseExpenseDetailView(generics.RetrieveUpdateDestroyAPIView):
         return Response({"message": "Purchase Expenses Deleted successfully."}, status=status.HTTP_200_OK)
 
 
+class PurchaseExpenseReceiveAPIView(APIView):
+    """
+    Adds the purchase's linked, not yet received lines to product stock in one
+    transaction. Body (optional): {"links": [{"line": id, "product": id}, ...]}
+    to link free-text lines to products first. Lines without a product are
+    left for a later receive and listed as "unlinked".
+    """
+    def post(self, request, pk):
+        expense = get_object_or_404(PurchaseExpense, pk=pk)
+        try:
+            links = {int(item['line']): int(item['product']) for item in request.data.get('links') or []}
+        except (KeyError, TypeError, ValueError) as e:
+            return Response({"error": f"Invalid links: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            received, errors = receive_expense(expense, links, user=getattr(request.user, 'name', None))
+            if errors:
+                return Response(
+                    {"error": "Some lines can't be linked; nothing was received.", "errors": errors},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response({"message": "Purchase received successfully.", **received}, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while receiving the Purchase Expense. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class PurchaseProductListCreateView(generics.ListCreateAPIView):
     queryset = PurchaseProduct.objects.all()
     # permission_classes = [PurchasePermission]
@@ -2710,37 +3544,53 @@ class SupplierReportView(generics.GenericAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        supplier = get_object_or_404(
-            PurchaseSupplier.objects.prefetch_related(
-                Prefetch(
-                    "expenses",
-                    queryset=PurchaseExpense.objects.prefetch_related("products", "logs")
-                )
-            ),
-            pk=supplier_id
+        # Only the supplier row is needed to answer from the cache; the expenses are loaded on a miss
+        supplier = get_object_or_404(PurchaseSupplier.objects.select_related("supplier"), pk=supplier_id)
+
+        def build():
+            payload = payables.supplier_report_payload(supplier, start_date, end_date)
+            return self.get_serializer(payload).data
+
+        return cached_json_response(
+            request, 'supplier_report', {'supplier': supplier.pk, 'start': start_date, 'end': end_date},
+            [supplier_key(supplier.pk)], build
         )
 
-        expenses = supplier.expenses.all()
-        if start_date and end_date:
-            expenses = expenses.filter(
-                purchase_date__range=(start_date, end_date)
-            )
-        # Convert the end_date to include the entire day
-        # if start_date and end_date:
-        #     end_date_plus_1 = end_date + timezone.timedelta(days=1)
-        #     expenses = expenses.filter(
-        #         purchase_date__date__gte=start_date,
-        #         purchase_date__date__lt=end_date_plus_1
-        #     )
 
-        payload = {
-            "supplier": supplier,
-            "payment_logs": SupplierPaymentLog.objects.filter(
-                supplier_id=supplier_id
-            ).order_by('-timestamp'),
-            "expenses": expenses,
-        }
-        return Response(self.get_serializer(payload).data, status=status.HTTP_200_OK)
+class SupplierStatementView(APIView):
+    """
+    Opening balance, purchases and payments with the running balance, and the
+    closing balance of a purchase supplier for ?start_date=&end_date= (either
+    may be left out), streamed as JSON or, with ?output=xlsx, as a workbook.
+    """
+    def get(self, request, supplier_id):
+        user = request.user
+        if not (user.role in ['Manager', 'Salesman', 'Sales Manager'] or user.is_superuser):
+            return Response(
+                {"error": "You are not authorized to retrieve the Supplier Statement."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        start_raw = request.query_params.get('start_date')
+        end_raw = request.query_params.get('end_date')
+        start_date = parse_date(start_raw) if start_raw else None
+        end_date = parse_date(end_raw) if end_raw else None
+        if (start_raw and not start_date) or (end_raw and not end_date):
+            return Response({"error": "Dates must be in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+        if start_date and end_date and start_date > end_date:
+            return Response({"error": "start_date must not be after end_date."}, status=status.HTTP_400_BAD_REQUEST)
+        output = request.query_params.get('output', 'json').lower()
+        if output not in ('json', 'xlsx'):
+            return Response({"error": "output must be json or xlsx."}, status=status.HTTP_400_BAD_REQUEST)
+
+        supplier = get_object_or_404(PurchaseSupplier.objects.select_related("supplier"), pk=supplier_id)
+        try:
+            return statement_response(supplier, start_date, end_date, output)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Supplier Statement. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
 
 class TotalOrderAPIView(APIView):
@@ -2753,7 +3603,7 @@ class TotalOrderAPIView(APIView):
             #         {"error": "You are not authorized to retrive the Total Order."},
             #         status=status.HTTP_403_FORBIDDEN
             #     )
-            total_number_order = Order.objects.all().count()       
+            total_number_order = counters.count(counters.ORDERS)
             return Response(total_number_order, status=status.HTTP_200_OK)
 
         except KeyError as e:
@@ -2772,7 +3622,7 @@ class TotalProductAPIView(APIView):
             #         {"error": "You are not authorized to retrive the Product."},
             #         status=status.HTTP_403_FORBIDDEN
             #     )
-            total_number = Product.objects.all().count()       
+            total_number = counters.count(counters.PRODUCTS)
             return Response(total_number, status=status.HTTP_200_OK)         
         except KeyError as e:
             return Response(
@@ -0,0 +1,207 @@
+"""
+Year-end workbook: a Summary sheet plus one sheet per month with that month's
+orders, order items, payments and expenses.
+
+Months are independent, so each one is built in its own process
+(ProcessPoolExecutor) from chunked `values_list` queries into a single-sheet
+write-only workbook. openpyxl writes strings inline, so a worksheet's XML only
+depends on the shared styles; every month sheet registers its styles in the same
+order (the title row holds a date and a datetime) which makes them
+interchangeable. The parent then writes an empty skeleton workbook with the
+final sheet names and swaps the month sheets' XML into it at the zip level,
+without parsing or re-serialising any rows.
+"""
+import calendar
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from decimal import Decimal
+
+import django
+import openpyxl
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import Order, OrderItem, OrderPaymentLog, PurchaseExpense, OtherExpenses
+
+
+CHUNK_SIZE = 2000
+
+# (section title, model, date lookup, [(column header, values lookup)])
+SECTIONS = [
+    ('Orders', Order, 'order_date', [
+        ('id', 'id'), ('order_date', 'order_date'), ('customer', 'customer__name'), ('status', 'status'),
+        ('receipt', 'receipt'), ('sub_total', 'sub_total'), ('vat', 'vat'), ('total_amount', 'total_amount'),
+        ('paid_amount', 'paid_amount'), ('unpaid_amount', 'unpaid_amount'), ('payment_status', 'payment_status'),
+        ('user', 'user'),
+    ]),
+    ('Items', OrderItem, 'order__order_date', [
+        ('order', 'order_id'), ('order_date', 'order__order_date'), ('product', 'product__name'),
+        ('quantity', 'quantity'), ('unit_price', 'unit_price'), ('price', 'price'), ('cost', 'cost'),
+        ('status', 'status'),
+    ]),
+    ('Payments', OrderPaymentLog, 'timestamp', [
+        ('order', 'order_id'), ('timestamp', 'timestamp'), ('customer', 'customer'), ('change_type', 'change_type'),
+        ('field_name', 'field_name'), ('old_value', 'old_value'), ('new_value', 'new_value'), ('user', 'user'),
+    ]),
+    ('Purchases', PurchaseExpense, 'purchase_date', [
+        ('id', 'id'), ('purchase_date', 'purchase_date'), ('supplier', 'supplier'),
+        ('number_of_items', 'number_of_items'), ('total', 'total'), ('paid_amount', 'paid_amount'),
+        ('unpaid_amount', 'unpaid_amount'), ('payment_status', 'payment_status'), ('user', 'user'),
+    ]),
+    ('Other Expenses', OtherExpenses, 'created_at', [
+        ('id', 'id'), ('created_at', 'created_at'), ('expense_type', 'expense_type__name'), ('cost', 'cost'),
+        ('user', 'user'),
+    ]),
+]
+
+SUMMARY_COLUMNS = ['month', 'orders', 'sales', 'items', 'quantity', 'payments', 'purchases', 'other_expenses']
+
+
+def default_workers():
+    return getattr(settings, 'YEARLY_REPORT_WORKERS', min(4, os.cpu_count() or 1))
+
+
+def month_bounds(year, month):
+    """[start, end) of the month as dates and as aware datetimes in the current time zone."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    aware = [timezone.make_aware(datetime.combine(day, datetime.min.time())) for day in (start, end)]
+    return (start, end), tuple(aware)
+
+
+def _cell(value):
+    # Excel has no time zones; show datetimes in local time
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+def _month_filter(model, lookup, year, month):
+    field = None
+    for part in lookup.split('__'):
+        field = (field.related_model if field else model)._meta.get_field(part)
+    dates, datetimes = month_bounds(year, month)
+    start, end = datetimes if isinstance(field, models.DateTimeField) else dates
+    return model.objects.filter(**{f'{lookup}__gte': start, f'{lookup}__lt': end})
+
+
+def month_totals(year, month):
+    orders = _month_filter(Order, 'order_date', year, month)
+    items = _month_filter(OrderItem, 'order__order_date', year, month)
+    sold = orders.exclude(status='Cancelled').aggregate(count=Count('id'), sales=Sum('total_amount'))
+    quantity = items.exclude(status='Cancelled').aggregate(lines=Count('id'), quantity=Sum('quantity'))
+    return {
+        'month': calendar.month_name[month],
+        'orders': sold['count'],
+        'sales': sold['sales'] or Decimal('0.00'),
+        'items': quantity['lines'],
+        'quantity': quantity['quantity'] or 0,
+        'payments': _month_filter(OrderPaymentLog, 'timestamp', year, month).count(),
+        'purchases': _month_filter(PurchaseExpense, 'purchase_date', year, month).aggregate(total=Sum('total'))['total'] or Decimal('0.00'),
+        'other_expenses': _month_filter(OtherExpenses, 'created_at', year, month).aggregate(total=Sum('cost'))['total'] or Decimal('0.00'),
+    }
+
+
+def month_rows(year, month, generated_at):
+    # The title row fixes the style order (date, then datetime) for every month sheet
+    yield [f'{calendar.month_name[month]} {year}', date(year, month, 1), 'Generated', generated_at]
+    for title, model, lookup, columns in SECTIONS:
+        yield []
+        yield [title]
+        yield [header for header, _ in columns]
+        queryset = _month_filter(model, lookup, year, month).order_by(lookup, 'pk')
+        for row in queryset.values_list(*[field for _, field in columns]).iterator(chunk_size=CHUNK_SIZE):
+            yield [_cell(value) for value in row]
+
+
+def build_month(year, month, generated_at, directory):
+    """Write one month to its own workbook in `directory`; returns (month, path, totals)."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=calendar.month_abbr[month])
+    for row in month_rows(year, month, generated_at):
+        ws.append(row)
+    path = os.path.join(directory, f'{month:02d}.xlsx')
+    wb.save(path)
+    return month, path, month_totals(year, month)
+
+
+def _run_month(args):
+    try:
+        return build_month(*args)
+    finally:
+        connections.close_all()
+
+
+def _merge(parts, summary, target):
+    """Write the skeleton workbook and splice the month sheets (in month order) into it."""
+    skeleton = openpyxl.Workbook(write_only=True)
+    ws = skeleton.create_sheet(title='Summary')
+    ws.append(SUMMARY_COLUMNS)
+    for totals in summary:
+        ws.append([totals[column] for column in SUMMARY_COLUMNS])
+    for month, _ in parts:
+        skeleton.create_sheet(title=calendar.month_abbr[month])
+    skeleton_file = tempfile.TemporaryFile()
+    skeleton.save(skeleton_file)
+
+    # Write-only workbooks name their sheets sheet1.xml, sheet2.xml, ... in creation order
+    replacements = {f'xl/worksheets/sheet{index}.xml': path for index, (_, path) in enumerate(parts, start=2)}
+    with zipfile.ZipFile(skeleton_file) as source, zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as merged:
+        for info in source.infolist():
+            part = replacements.get(info.filename)
+            if part is None and info.filename == 'xl/styles.xml' and parts:
+                part = parts[0][1]
+            if part is None:
+                merged.writestr(info, source.read(info.filename))
+                continue
+            with zipfile.ZipFile(part) as month_file:
+                name = 'xl/worksheets/sheet1.xml' if info.filename != 'xl/styles.xml' else info.filename
+                with month_file.open(name) as src, merged.open(info.filename, 'w') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+    skeleton_file.close()
+
+
+def build_yearly_report(year, target, workers=None, progress=None):
+    """
+    Write the workbook for `year` to `target` (a path or binary file).
+    `progress(months_done)` is called as months finish; with one worker the
+    months are built in this process.
+    """
+    workers = default_workers() if workers is None else workers
+    generated_at = timezone.localtime().replace(tzinfo=None, microsecond=0)
+    months = range(1, 13)
+
+    with tempfile.TemporaryDirectory() as directory:
+        jobs = [(year, month, generated_at, directory) for month in months]
+        results = []
+        if workers <= 1:
+            for args in jobs:
+                results.append(build_month(*args))
+                if progress:
+                    progress(len(results))
+        else:
+            # Spawned workers set Django up themselves (importing this module needs the app
+            # registry, so the initializer is django.setup itself) and open their own connections
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as pool:
+                futures = [pool.submit(_run_month, args) for args in jobs]
+                try:
+                    for future in as_completed(futures):
+                        results.append(future.result())
+                        if progress:
+                            progress(len(results))
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        results.sort(key=lambda result: result[0])
+        _merge([(month, path) for month, path, _ in results], [totals for _, _, totals in results], target)
+    return [totals for _, _, totals in results]
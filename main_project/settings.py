@@ -227,3 +227,43 @@ SIMPLE_JWT = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'user.UserAccount'
+
+
+# Inventory costing: 'average' (moving weighted average) or 'fifo'
+INVENTORY_COSTING_METHOD = os.getenv("INVENTORY_COSTING_METHOD", "average")
+
+# Products at or below this stock are low unless the product or its category sets a reorder point
+DEFAULT_REORDER_POINT = int(os.getenv("DEFAULT_REORDER_POINT", 3))
+
+# Lots expiring within this many days are reported as near expiry
+NEAR_EXPIRY_DAYS = int(os.getenv("NEAR_EXPIRY_DAYS", 30))
+
+# Order reports default to the last REPORT_DEFAULT_DAYS days and refuse longer windows than REPORT_MAX_DAYS
+REPORT_DEFAULT_DAYS = int(os.getenv("REPORT_DEFAULT_DAYS", 30))
+REPORT_MAX_DAYS = int(os.getenv("REPORT_MAX_DAYS", 366))
+
+# Generated reports are cached on disk, least recently used files are dropped beyond REPORT_CACHE_MAX_BYTES
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", str(BASE_DIR / 'report_cache'))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+# Processes used to build the per-month sheets of the yearly report (1 builds them in the job worker itself)
+YEARLY_REPORT_WORKERS = int(os.getenv("YEARLY_REPORT_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Closed sales months are archived to Parquet here; the current month and SALES_ARCHIVE_KEEP_MONTHS before it stay live
+SALES_ARCHIVE_DIR = os.getenv("SALES_ARCHIVE_DIR", str(BASE_DIR / 'sales_archive'))
+SALES_ARCHIVE_KEEP_MONTHS = int(os.getenv("SALES_ARCHIVE_KEEP_MONTHS", 1))
+
+# Demand forecasting: days of sales history used, default supplier lead time, days between orders and safety stock z-score
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", 730))
+REORDER_LEAD_TIME_DAYS = int(os.getenv("REORDER_LEAD_TIME_DAYS", 7))
+REORDER_REVIEW_DAYS = int(os.getenv("REORDER_REVIEW_DAYS", 7))
+REORDER_SERVICE_Z = float(os.getenv("REORDER_SERVICE_Z", 1.65))
+
+# Product health: analysis window, dead stock threshold (days without a sale) and ABC revenue share cut-offs
+HEALTH_WINDOW_DAYS = int(os.getenv("HEALTH_WINDOW_DAYS", 365))
+DEAD_STOCK_DAYS = int(os.getenv("DEAD_STOCK_DAYS", 90))
+ABC_A_SHARE = float(os.getenv("ABC_A_SHARE", 0.8))
+ABC_B_SHARE = float(os.getenv("ABC_B_SHARE", 0.95))
+
+# The home screen dashboard is recomputed at most once per DASHBOARD_CACHE_SECONDS per process
+DASHBOARD_CACHE_SECONDS = float(os.getenv("DASHBOARD_CACHE_SECONDS", 5))